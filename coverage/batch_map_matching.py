@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+import time
+
+from db.metrics import add_metrics_arguments, configure_metrics, measure_stage, write_metrics
+from input import read_trajectory_from_wkt
+from map_matching import MapMatchingClient, add_cache_arguments, add_chunking_arguments, create_match_cache
+from trajectory import thin_trajectory
+
+
+def match_trajectories(client, trajectories, output_dir, window_size=None, overlap=0):
+    os.makedirs(output_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    num_matched = 0
+    output_names = set()
+    with measure_stage("map_matching") as stage:
+        for name, map_match, error in client.match_batch(trajectories, window_size, overlap):
+            stage.add_objects(1)
+            if error is None:
+                try:
+                    output_file = get_output_file(output_dir, name, output_names)
+                except ValueError as output_error:
+                    error = output_error
+            if error is not None:
+                logging.error("Failed to match trajectory {}: {}".format(name, error))
+                continue
+            with open(output_file, "wb") as file_stream:
+                pickle.dump(map_match, file_stream)
+            stage.add_rows(1)
+            num_matched += 1
+    duration = time.perf_counter() - start_time
+    logging.info("Matched {} trajectories in {:.1f}s ({:.1f} trajectories/s)".format(
+        num_matched, duration, num_matched / max(duration, 1e-9)))
+    logging.info("Request stats: {}".format(json.dumps(client.get_stats())))
+
+
+def get_output_file(output_dir, name, output_names):
+    # drive ids are derived from the file names, so every name is written once
+    output_name = re.sub(r"[^\w.-]", "_", name)
+    if output_name in output_names:
+        raise ValueError("Output file {}.pickle already written for another trajectory".format(
+            output_name))
+    output_names.add(output_name)
+    return os.path.join(output_dir, "{}.pickle".format(output_name))
+
+
+def read_trajectories(inputs):
+    for input_path in inputs:
+        if input_path == "-":
+            yield from _read_trajectories_from_jsonl(sys.stdin, "stdin")
+        elif os.path.isdir(input_path):
+            yield from read_trajectories(sorted(
+                os.path.join(input_path, name) for name in os.listdir(input_path)))
+        elif input_path.endswith(".jsonl"):
+            with open(input_path, "r") as file_stream:
+                yield from _read_trajectories_from_jsonl(
+                    file_stream, os.path.splitext(os.path.basename(input_path))[0])
+        else:
+            yield _read_trajectory_from_file(input_path)
+
+
+def _read_trajectories_from_jsonl(file_stream, source):
+    for line_number, line in enumerate(file_stream):
+        if line.strip():
+            data = json.loads(line)
+            if "id" in data:
+                yield str(data["id"]), _get_trajectory(data)
+            else:
+                yield "{}-{}".format(source, line_number), _get_trajectory(data)
+
+
+def _read_trajectory_from_file(input_file):
+    name = os.path.splitext(os.path.basename(input_file))[0]
+    with open(input_file, "r") as file_stream:
+        if input_file.endswith(".wkt"):
+            return name, list(read_trajectory_from_wkt(file_stream.read()))
+        return name, _get_trajectory(json.load(file_stream))
+
+
+def _get_trajectory(data):
+    if "wkt" in data:
+        return list(read_trajectory_from_wkt(data["wkt"]))
+    return [{"lat": point["lat"], "lon": point["lon"]} for point in data["shape"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch OSM Map Matcher")
+    parser.add_argument("inputs", metavar="INPUT", nargs="+",
+                        help="Trajectory files (.json/.wkt), directories, JSONL files or - for JSONL on stdin")
+    parser.add_argument("output_dir", metavar="OUTPUT_DIR",
+                        help="The directory to write the match results to")
+    parser.add_argument("--url", default=None,
+                        help="The map matching API URL (default: $MAP_MATCHING_API_URL)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="The maximum number of concurrent requests")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="The request timeout in seconds")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="The maximum number of retries on 429/5xx responses")
+    add_chunking_arguments(parser)
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    configure_metrics(args)
+    client = MapMatchingClient(args.url, args.concurrency, args.timeout, args.max_retries,
+                               cache=create_match_cache(args), refresh=args.refresh)
+    trajectories = ((name, thin_trajectory(trajectory, args.min_distance, args.simplify_tolerance))
+                    for name, trajectory in read_trajectories(args.inputs))
+    match_trajectories(client, trajectories, args.output_dir,
+                       args.window_size, args.overlap)
+    write_metrics(args)
@@ -0,0 +1,186 @@
+#! /usr/bin/env python
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor
+
+from segment_store import add_segment_store_arguments, create_segment_store
+from way_segments import map_match_result_to_osm_way_segments
+
+
+OUTPUT_FORMATS = ("jsonl", "parquet")
+
+_segment_store = None
+
+
+def _init_worker(backend, source, cache_size, pool_size):
+    global _segment_store
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    _segment_store = create_segment_store(
+        backend, source, cache_size, pool_size)
+
+
+def _process_file(match_file):
+    start_time = time.perf_counter()
+    try:
+        with open(match_file, "rb") as file_stream:
+            match_result = pickle.load(file_stream)
+        travelled_segments = map_match_result_to_osm_way_segments(
+            _segment_store, match_result)
+        if travelled_segments is None:
+            raise ValueError("Invalid match result")
+        error = None
+    except Exception:
+        # any broken file is recorded as failed instead of aborting the batch
+        travelled_segments, error = None, traceback.format_exc()
+    return match_file, travelled_segments, time.perf_counter() - start_time, error
+
+
+def get_match_files(inputs):
+    match_files = []
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            match_files.extend(sorted(glob.glob(os.path.join(input_path, "*.pickle"))))
+        elif glob.has_magic(input_path):
+            match_files.extend(sorted(glob.glob(input_path, recursive=True)))
+        else:
+            match_files.append(input_path)
+    return match_files
+
+
+def process_match_files(match_files, output, args):
+    num_workers = args.workers or multiprocessing.cpu_count()
+    logging.info("Processing {} match results with {} workers".format(
+        len(match_files), num_workers))
+    start_time = time.perf_counter()
+    durations = []
+    num_failed = 0
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(
+            args.backend, args.source, args.segment_cache_size, args.pool_size)) as executor:
+        results = executor.map(_process_file, match_files, chunksize=args.chunk_size)
+        for match_file, travelled_segments, duration, error in results:
+            durations.append(duration)
+            if error is not None:
+                logging.error("Failed to process {}: {}".format(match_file, error))
+                num_failed += 1
+            else:
+                logging.debug("Processed {} in {:.1f}ms".format(match_file, 1000 * duration))
+            output.write(match_file, travelled_segments, duration, error)
+    _log_summary(durations, num_failed, time.perf_counter() - start_time)
+
+
+def _log_summary(durations, num_failed, total_duration):
+    durations = sorted(durations)
+    def percentile(p): return durations[min(
+        len(durations) - 1, int(p * len(durations)))] if durations else 0.0
+    logging.info("Processed {} match results ({} failed) in {:.1f}s ({:.1f} files/s)".format(
+        len(durations), num_failed, total_duration, len(durations) / max(total_duration, 1e-9)))
+    logging.info("Per-file time: mean {:.1f}ms, p50 {:.1f}ms, p95 {:.1f}ms, max {:.1f}ms".format(
+        1000 * sum(durations) / max(len(durations), 1), 1000 * percentile(0.5),
+        1000 * percentile(0.95), 1000 * (durations[-1] if durations else 0.0)))
+
+
+class JsonLinesOutput:
+    def __init__(self, output_file):
+        self.file_stream = open(output_file, "w")
+
+    def write(self, match_file, travelled_segments, duration, error):
+        record = {"file": match_file, "duration": round(duration, 6)}
+        if error is not None:
+            record["error"] = error
+        else:
+            record["travelled_segments"] = [[list(segment) for segment in trace]
+                                            for trace in travelled_segments]
+        self.file_stream.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file_stream.close()
+
+
+class ParquetOutput:
+    BATCH_SIZE = 100000
+
+    def __init__(self, output_file):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet output requires the pyarrow package")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            ("file", pyarrow.string()),
+            ("trace", pyarrow.int32()),
+            ("way_id", pyarrow.int64()),
+            ("segment_id", pyarrow.int32()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(output_file, self.schema)
+        self._init_columns()
+
+    def _init_columns(self):
+        self.columns = {name: [] for name in self.schema.names}
+
+    def write(self, match_file, travelled_segments, duration, error):
+        if error is not None:
+            return
+        for trace_idx, trace in enumerate(travelled_segments):
+            for way_id, segment_id in trace:
+                self.columns["file"].append(match_file)
+                self.columns["trace"].append(trace_idx)
+                self.columns["way_id"].append(way_id)
+                self.columns["segment_id"].append(segment_id)
+        if len(self.columns["file"]) >= self.BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self.columns["file"]:
+            self.writer.write_table(self.pyarrow.Table.from_pydict(
+                self.columns, schema=self.schema))
+            self._init_columns()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def create_output(output_file, output_format=None):
+    if output_format is None:
+        output_format = "parquet" if output_file.endswith(".parquet") else "jsonl"
+    if output_format == "jsonl":
+        return JsonLinesOutput(output_file)
+    if output_format == "parquet":
+        return ParquetOutput(output_file)
+    raise ValueError("Unknown output format: {} (available: {})".format(
+        output_format, ", ".join(OUTPUT_FORMATS)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch OSM Way Segments")
+    add_segment_store_arguments(parser)
+    parser.add_argument("output_file", metavar="OUTPUT_FILE",
+                        help="The file to write the travelled segments to (.jsonl or .parquet)")
+    parser.add_argument("inputs", metavar="INPUT", nargs="+",
+                        help="Pickled match results, directories of them or glob patterns")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=None,
+                        help="The output format (default: derived from the output file extension)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="The number of worker processes (0: number of CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=16,
+                        help="The number of match results sent to a worker at once")
+    parser.add_argument("--pool-size", type=int, default=2,
+                        help="The size of the MySQL connection pool of each worker")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    output = create_output(args.output_file, args.format)
+    try:
+        process_match_files(get_match_files(args.inputs), output, args)
+    finally:
+        output.close()
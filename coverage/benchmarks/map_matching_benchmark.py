@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from benchmarks.stub_matching_server import start_stub_server
+from db.road_database import RoadDatabase
+from map_matching import MapMatchingClient
+from offline_matching import METERS_PER_DEGREE, add_matcher_arguments, create_matcher
+from segment_store import LocalSegmentStore
+from way_segments import map_match_result_to_osm_way_segments
+
+
+def create_trajectories(database, num_trajectories, ways_per_trajectory=5, spacing=25.0, noise=5.0, seed=0):
+    generator = np.random.default_rng(seed)
+    offsets = np.asarray(database.way_node_offsets)
+    way_nodes = np.asarray(database.way_nodes)
+    next_ways = dict()
+    for idx in np.flatnonzero(np.diff(offsets) > 1).tolist():
+        next_ways.setdefault(int(way_nodes[offsets[idx]]), []).append(idx)
+    if not next_ways:
+        raise ValueError("The road database does not contain ways with segments")
+    first_ways = [way for ways in next_ways.values() for way in ways]
+    trajectories = []
+    for trajectory_idx in range(num_trajectories):
+        ways = [first_ways[generator.integers(len(first_ways))]]
+        while len(ways) < ways_per_trajectory:
+            candidates = next_ways.get(int(way_nodes[offsets[ways[-1] + 1] - 1]))
+            if not candidates:
+                break
+            ways.append(candidates[generator.integers(len(candidates))])
+        way_ids = [int(database.way_ids[way]) for way in ways]
+        geometry = np.concatenate([database.get_way_geometry(way_id)[(1 if idx else 0):]
+                                   for idx, way_id in enumerate(way_ids)])
+        trajectories.append(("trajectory-{}".format(trajectory_idx),
+                             _sample_points(geometry, spacing, noise, generator), set(way_ids)))
+    return trajectories
+
+
+def _sample_points(geometry, spacing, noise, generator):
+    scale_x = METERS_PER_DEGREE * np.cos(np.radians(geometry[:, 0].mean()))
+    distances = np.append(0, np.cumsum(np.hypot(
+        np.diff(geometry[:, 0]) * METERS_PER_DEGREE, np.diff(geometry[:, 1]) * scale_x)))
+    positions = np.arange(0, distances[-1], spacing)
+    lats = np.interp(positions, distances, geometry[:, 0]) + \
+        generator.normal(0, noise, len(positions)) / METERS_PER_DEGREE
+    lons = np.interp(positions, distances, geometry[:, 1]) + \
+        generator.normal(0, noise, len(positions)) / scale_x
+    return [{"lat": lat, "lon": lon} for lat, lon in zip(lats.tolist(), lons.tolist())]
+
+
+def run_offline_benchmark(matcher, trajectories, segment_store):
+    num_points = sum(len(trajectory) for _, trajectory, _ in trajectories)
+    start_time = time.perf_counter()
+    map_matches = [matcher.match(trajectory) for _, trajectory, _ in trajectories]
+    duration = time.perf_counter() - start_time
+    num_matched = num_correct = num_invalid = 0
+    for (_, _, way_ids), map_match in zip(trajectories, map_matches):
+        for match in map_match["matches"]:
+            num_matched += 1
+            num_correct += map_match["edges"][match["edge_index"]]["way_id"] in way_ids
+        if map_match_result_to_osm_way_segments(segment_store, map_match) is None:
+            num_invalid += 1
+    logging.info("{:>8}: {} points in {:.3f}s ({:.0f} points/s)".format(
+        "offline", num_points, duration, num_points / max(duration, 1e-9)))
+    logging.info("{:>8}: {:.1%} of the points matched, {:.1%} of them to the true ways, {} invalid results".format(
+        "offline", num_matched / max(num_points, 1), num_correct / max(num_matched, 1), num_invalid))
+    return num_points / max(duration, 1e-9)
+
+
+def run_http_benchmark(trajectories, concurrency=8, latency=0.0):
+    num_points = sum(len(trajectory) for _, trajectory, _ in trajectories)
+    server, url = start_stub_server(latency=latency)
+    try:
+        client = MapMatchingClient(url, concurrency)
+        start_time = time.perf_counter()
+        results = list(client.match_batch(
+            (name, trajectory) for name, trajectory, _ in trajectories))
+        duration = time.perf_counter() - start_time
+    finally:
+        server.shutdown()
+    num_failed = sum(error is not None for _, _, error in results)
+    logging.info("{:>8}: {} points in {:.3f}s ({:.0f} points/s, {} failed)".format(
+        "http", num_points, duration, num_points / max(duration, 1e-9), num_failed))
+    return num_points / max(duration, 1e-9)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Map Matching Benchmark (run from the coverage directory with python -m benchmarks.map_matching_benchmark)")
+    parser.add_argument("road_database", metavar="ROAD_DATABASE",
+                        help="The columnar road database directory")
+    parser.add_argument("--num-trajectories", type=int, default=200)
+    parser.add_argument("--ways-per-trajectory", type=int, default=5)
+    parser.add_argument("--spacing", type=float, default=25.0,
+                        help="The distance in meters between trajectory points")
+    parser.add_argument("--noise", type=float, default=5.0,
+                        help="The standard deviation of the simulated GPS noise in meters")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="The number of concurrent requests to the stub server")
+    parser.add_argument("--stub-latency", type=float, default=0.0,
+                        help="The artificial response latency of the stub server in seconds")
+    add_matcher_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    database = RoadDatabase(args.road_database)
+    start_time = time.perf_counter()
+    matcher = create_matcher(database, args)
+    logging.info("Built the segment index in {:.3f}s".format(
+        time.perf_counter() - start_time))
+    trajectories = create_trajectories(database, args.num_trajectories, args.ways_per_trajectory,
+                                       args.spacing, args.noise, args.seed)
+    offline = run_offline_benchmark(
+        matcher, trajectories, LocalSegmentStore(args.road_database))
+    http = run_http_benchmark(
+        trajectories, args.concurrency, args.stub_latency)
+    logging.info("The offline matcher is {:.1f}x as fast as the HTTP path".format(
+        offline / max(http, 1e-9)))
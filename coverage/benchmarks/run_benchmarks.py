@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.map_matching_benchmark import create_trajectories
+from benchmarks.synthetic_osm import create_match_results, create_network, get_motorway_roads, get_way_ids, write_network
+from db.road_database import RoadDatabase
+from input import read_ways_from_osm
+from offline_matching import OfflineMatcher
+from segment_store import LocalSegmentStore
+from way_segments import _get_travelled_way_segments
+
+
+COVERAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASES = ("binary_import", "mysql_import", "travelled_segments", "offline_matching", "read_osm_xml", "read_osm_pbf")
+
+
+class BenchmarkSuite:
+    def __init__(self, network, work_dir, repetitions=3, mysql_config=None):
+        self.network = network
+        self.work_dir = work_dir
+        self.repetitions = repetitions
+        self.mysql_config = mysql_config
+        self.results = dict()
+        os.makedirs(work_dir, exist_ok=True)
+
+    def get_osm_file(self, extension):
+        osm_file = os.path.join(self.work_dir, "network-{}-{}.{}".format(
+            self.network.num_roads, self.network.seed, extension))
+        if not os.path.exists(osm_file):
+            write_network(osm_file, self.network)
+        return osm_file
+
+    def get_road_database(self):
+        database_directory = os.path.join(self.work_dir, "network-{}-{}.db".format(
+            self.network.num_roads, self.network.seed))
+        if not os.path.exists(os.path.join(database_directory, "metadata.json")):
+            self._run_script("import_osm_highways_binary.py",
+                             self.get_osm_file("osm.pbf"), database_directory)
+        return database_directory
+
+    def run(self, cases):
+        for case in cases:
+            if case == "mysql_import" and self.mysql_config is None:
+                logging.info("Skipping mysql_import (no --mysql-config)")
+                continue
+            logging.info("Running benchmark {}".format(case))
+            getattr(self, "_benchmark_{}".format(case))()
+        return self.results
+
+    def _record(self, name, durations):
+        self.results[name] = min(durations)
+        logging.info("{:>40}: {:.4f}s (min of {})".format(
+            name, self.results[name], len(durations)))
+
+    def _time(self, name, function):
+        durations = []
+        for _ in range(self.repetitions):
+            start_time = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start_time)
+        self._record(name, durations)
+
+    def _benchmark_binary_import(self):
+        osm_file = self.get_osm_file("osm.pbf")
+        with tempfile.TemporaryDirectory(dir=self.work_dir) as output_dir:
+            self._time_script("binary_import", "import_osm_highways_binary.py",
+                              osm_file, os.path.join(output_dir, "database"))
+
+    def _benchmark_mysql_import(self):
+        self._time_script("mysql_import", "import_osm_highways_mysql.py",
+                          self.mysql_config, self.get_osm_file("osm.pbf"), "--clear-database")
+
+    def _time_script(self, name, script, *script_args):
+        durations = []
+        stage_durations = dict()
+        for _ in range(self.repetitions):
+            with tempfile.NamedTemporaryFile(dir=self.work_dir, suffix=".json") as metrics_file:
+                start_time = time.perf_counter()
+                self._run_script(script, *script_args,
+                                 "--metrics-file", metrics_file.name)
+                durations.append(time.perf_counter() - start_time)
+                with open(metrics_file.name, "r") as file_stream:
+                    stages = json.load(file_stream)["stages"]
+            for stage, summary in stages.items():
+                stage_durations.setdefault(stage, []).append(summary["wall_time"])
+        self._record(name, durations)
+        for stage, stage_duration in stage_durations.items():
+            self._record("{}.{}".format(name, stage), stage_duration)
+
+    @ staticmethod
+    def _run_script(script, *script_args):
+        subprocess.run([sys.executable, os.path.join(COVERAGE_DIR, "db", script)] + list(script_args),
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _benchmark_travelled_segments(self):
+        segment_store = LocalSegmentStore(self.get_road_database())
+        match_results = create_match_results(self.network, 1000)
+        way_ratios = [segment_store.get_way_ratios(e["way_id"] for e in match_result["edges"])
+                      for match_result in match_results]
+        self._time("travelled_segments", lambda: [
+            _get_travelled_way_segments(match_result, ratios)
+            for match_result, ratios in zip(match_results, way_ratios)])
+
+    def _benchmark_offline_matching(self):
+        database = RoadDatabase(self.get_road_database())
+        matcher = OfflineMatcher(database)
+        trajectories = create_trajectories(database, 20, seed=self.network.seed)
+        self._time("offline_matching", lambda: [
+            matcher.match(trajectory) for _, trajectory, _ in trajectories])
+
+    def _get_sample_way_ids(self, num_ways=100):
+        generator = random.Random(self.network.seed)
+        way_ids = [way_id for road in get_motorway_roads(self.network)
+                   for way_id in get_way_ids(self.network, road)]
+        return generator.sample(way_ids, min(num_ways, len(way_ids)))
+
+    def _benchmark_read_osm_xml(self):
+        osm_file = self.get_osm_file("osm")
+        way_ids = self._get_sample_way_ids()
+        self._time("read_osm_xml", lambda: read_ways_from_osm(osm_file, way_ids))
+
+    def _benchmark_read_osm_pbf(self):
+        osm_file = self.get_osm_file("osm.pbf")
+        way_ids = self._get_sample_way_ids()
+        self._time("read_osm_pbf", lambda: read_ways_from_osm(osm_file, way_ids))
+
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, "r") as file_stream:
+        return json.load(file_stream)
+
+
+def append_history(history_file, history, entry):
+    history.append(entry)
+    with open(history_file, "w") as file_stream:
+        json.dump(history, file_stream, indent=2)
+
+
+def create_history_entry(network, results):
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _get_git_commit(),
+        "network": network._asdict(),
+        "results": results,
+    }
+
+
+def _get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=COVERAGE_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_history(history, entry, threshold):
+    baseline = next((previous for previous in reversed(history)
+                     if previous["network"] == entry["network"]), None)
+    if baseline is None:
+        logging.info("No previous run with the same network, nothing to compare")
+        return []
+    logging.info("Comparing with run {} (commit {})".format(
+        baseline["timestamp"], baseline["commit"]))
+    regressions = []
+    for name, duration in entry["results"].items():
+        if name not in baseline["results"]:
+            continue
+        change = duration / max(baseline["results"][name], 1e-9) - 1
+        regressed = change > threshold
+        logging.info("{:>40}: {:.4f}s -> {:.4f}s ({:+.1%}){}".format(
+            name, baseline["results"][name], duration, change, "  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark Suite (run from the coverage directory with python -m benchmarks.run_benchmarks)")
+    parser.add_argument("--nodes", type=int, default=10000,
+                        help="The approximate number of nodes of the synthetic network (e.g. 10000 to 10000000)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "road_coverage_benchmarks"),
+                        help="The directory for generated networks (reused between runs)")
+    parser.add_argument("--history-file", default="benchmark_history.json",
+                        help="The JSON file the results are appended to")
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--mysql-config", default=None,
+                        help="The configuration of a local MySQL/MariaDB instance for the mysql_import case")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="The relative slowdown that counts as regression")
+    parser.add_argument("--fail-on-regression", help="Exit with status 1 if a regression was found",
+                        action="store_true", default=False)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    network = create_network(args.nodes, seed=args.seed)
+    suite = BenchmarkSuite(network, args.work_dir,
+                           args.repetitions, args.mysql_config)
+    entry = create_history_entry(network, suite.run(args.cases))
+    history = load_history(args.history_file)
+    regressions = compare_with_history(history, entry, args.threshold)
+    append_history(args.history_file, history, entry)
+    if regressions:
+        logging.warning("Regressions: [{}]".format(", ".join(regressions)))
+        if args.fail_on_regression:
+            sys.exit(1)
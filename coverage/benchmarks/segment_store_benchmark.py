@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+
+import argparse
+import logging
+import random
+import time
+
+from db.road_database import RoadDatabase
+from segment_store import open_segment_store
+from way_segments import map_match_result_to_osm_way_segments
+
+
+def create_match_results(database, num_results, ways_per_result=5, points_per_way=20, seed=0):
+    generator = random.Random(seed)
+    way_ids = [int(way_id) for way_id, begin, end in zip(
+        database.way_ids, database.segment_offsets[:-1], database.segment_offsets[1:]) if end > begin]
+    if not way_ids:
+        raise ValueError("The road database does not contain ways with segments")
+    match_results = []
+    for _ in range(num_results):
+        edges = generator.sample(way_ids, min(ways_per_result, len(way_ids)))
+        match_results.append({
+            "meta": [],
+            "edges": [{"way_id": way_id} for way_id in edges],
+            "matches": [{
+                "edge_index": edge_index,
+                "edge_ratio": ratio / 1000,
+            } for edge_index in range(len(edges))
+                for ratio in sorted(generator.sample(range(1000), points_per_way))],
+        })
+    return match_results
+
+
+def run_benchmark(backend, source, match_results):
+    with open_segment_store(backend, source) as segment_store:
+        start_time = time.perf_counter()
+        travelled_segments = [map_match_result_to_osm_way_segments(segment_store, match_result)
+                              for match_result in match_results]
+        duration = time.perf_counter() - start_time
+    logging.info("{:>8}: {} match results in {:.3f}s ({:.1f} results/s)".format(
+        backend, len(match_results), duration, len(match_results) / max(duration, 1e-9)))
+    return travelled_segments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Segment Store Benchmark (run from the coverage directory with python -m benchmarks.segment_store_benchmark)")
+    parser.add_argument("road_database", metavar="ROAD_DATABASE",
+                        help="The columnar road database directory")
+    parser.add_argument("--mysql-config", default=None,
+                        help="Also benchmark the MySQL backend with this configuration file")
+    parser.add_argument("--num-results", type=int, default=1000,
+                        help="The number of synthetic match results")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    match_results = create_match_results(
+        RoadDatabase(args.road_database), args.num_results, seed=args.seed)
+    results = {"local": run_benchmark(
+        "local", args.road_database, match_results)}
+    if args.mysql_config is not None:
+        results["mysql"] = run_benchmark(
+            "mysql", args.mysql_config, match_results)
+        if results["mysql"] != results["local"]:
+            raise SystemExit("The MySQL and local backends returned different travelled segments")
+        logging.info("The MySQL and local backends returned identical travelled segments")
@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+POINTS_PER_EDGE = 10
+
+
+def create_stub_response(shape, first_way_id=1000):
+    num_edges = max(1, (len(shape) + POINTS_PER_EDGE - 1) // POINTS_PER_EDGE)
+    return {
+        "admins": [{
+            "state_code": "BW",
+            "state_text": "Baden-Württemberg",
+            "country_code": "DE",
+            "country_text": "Germany",
+        }],
+        "edges": [{
+            "way_id": first_way_id + idx,
+            "end_node": {"admin_index": 0},
+            "road_class": "motorway",
+            "length": 0.1,
+            "begin_heading": 0,
+            "end_heading": 0,
+        } for idx in range(num_edges)],
+        "matched_points": [{
+            "edge_index": idx // POINTS_PER_EDGE,
+            "type": "matched",
+            "distance_along_edge": (idx % POINTS_PER_EDGE) / POINTS_PER_EDGE,
+            "lat": point["lat"],
+            "lon": point["lon"],
+        } for idx, point in enumerate(shape)],
+    }
+
+
+class StubMatchingHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_POST(self):
+        request_data = json.loads(
+            self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        body = json.dumps(create_stub_response(
+            request_data["shape"])).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def start_stub_server(port=0, latency=0.0, error_rate=0.0):
+    handler = type("ConfiguredStubMatchingHandler", (StubMatchingHandler,), {
+        "latency": latency, "error_rate": error_rate})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}/trace_attributes".format(server.server_port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Stub Map Matching Server (Valhalla trace_attributes)")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="The artificial response latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="The fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    server, url = start_stub_server(args.port, args.latency, args.error_rate)
+    logging.info("Stub map matching server listening on {}".format(url))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
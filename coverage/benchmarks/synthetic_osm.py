@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+
+import argparse
+import logging
+import os
+import random
+
+from collections import namedtuple
+
+import numpy as np
+import osmium
+
+
+# Roads are random walks of NODES_PER_WAY * WAYS_PER_ROAD nodes in Germany, split
+# into ways which share their end nodes. Node and way ids are derived from the road
+# index so that ways and match results can be generated without keeping the network
+# in memory.
+SyntheticNetwork = namedtuple("SyntheticNetwork", [
+    "num_roads", "ways_per_road", "nodes_per_way", "noise_ratio", "seed"])
+
+BOUNDING_BOX = (47.5, 6.0, 54.5, 14.5)
+STEP_SIZE = 0.001
+LINK_ROAD_INTERVAL = 10
+
+
+def create_network(num_nodes, ways_per_road=20, nodes_per_way=50, noise_ratio=0.2, seed=0):
+    nodes_per_road = ways_per_road * (nodes_per_way - 1) + 1
+    return SyntheticNetwork(max(1, num_nodes // nodes_per_road), ways_per_road,
+                            nodes_per_way, noise_ratio, seed)
+
+
+def get_highway_type(network, road):
+    if random.Random("{}-{}".format(network.seed, road)).random() < network.noise_ratio:
+        return "residential"
+    return "motorway_link" if road % LINK_ROAD_INTERVAL == LINK_ROAD_INTERVAL - 1 else "motorway"
+
+
+def get_way_ids(network, road):
+    first_way_id = road * network.ways_per_road + 1
+    return list(range(first_way_id, first_way_id + network.ways_per_road))
+
+
+def get_motorway_roads(network):
+    return [road for road in range(network.num_roads)
+            if get_highway_type(network, road) != "residential"]
+
+
+def _get_first_node_id(network, road):
+    return road * (network.ways_per_road * (network.nodes_per_way - 1) + 1) + 1
+
+
+def _get_road_coordinates(network, road):
+    generator = np.random.default_rng((network.seed, road))
+    num_nodes = network.ways_per_road * (network.nodes_per_way - 1) + 1
+    min_lat, min_lon, max_lat, max_lon = BOUNDING_BOX
+    headings = generator.uniform(0, 2 * np.pi) + \
+        np.cumsum(generator.normal(0, 0.05, num_nodes))
+    lats = generator.uniform(min_lat, max_lat) + \
+        np.cumsum(STEP_SIZE * np.cos(headings))
+    lons = generator.uniform(min_lon, max_lon) + \
+        np.cumsum(STEP_SIZE * np.sin(headings) / np.cos(np.radians(lats)))
+    return np.clip(lats, -90, 90), np.clip(lons, -180, 180)
+
+
+def _get_way_tags(network, road, highway_type):
+    if highway_type == "residential":
+        return {"highway": highway_type, "name": "Street {}".format(road)}
+    return {
+        "highway": highway_type,
+        "ref": "A {}".format(road % 100 + 1),
+        "name": "Autobahn {}".format(road % 100 + 1),
+        "oneway": "yes",
+        "maxspeed": "none" if road % 3 == 0 else "120",
+        "lanes": str(2 + road % 2),
+    }
+
+
+def write_network(output_file, network):
+    logging.info("Writing synthetic network with {} roads to {}".format(
+        network.num_roads, output_file))
+    writer = osmium.SimpleWriter(output_file, overwrite=True)
+    try:
+        for road in range(network.num_roads):
+            first_node_id = _get_first_node_id(network, road)
+            lats, lons = _get_road_coordinates(network, road)
+            for idx, (lat, lon) in enumerate(zip(lats.tolist(), lons.tolist())):
+                writer.add_node(osmium.osm.mutable.Node(
+                    id=first_node_id + idx, location=(lon, lat)))
+        for road in range(network.num_roads):
+            first_node_id = _get_first_node_id(network, road)
+            tags = _get_way_tags(
+                network, road, get_highway_type(network, road))
+            for idx, way_id in enumerate(get_way_ids(network, road)):
+                begin = first_node_id + idx * (network.nodes_per_way - 1)
+                writer.add_way(osmium.osm.mutable.Way(
+                    id=way_id, nodes=list(range(begin, begin + network.nodes_per_way)), tags=tags))
+    finally:
+        writer.close()
+
+
+def create_match_results(network, num_results, ways_per_result=5, points_per_way=20, seed=0):
+    generator = random.Random(seed)
+    roads = get_motorway_roads(network)
+    if not roads:
+        raise ValueError("The synthetic network does not contain motorways")
+    match_results = []
+    for _ in range(num_results):
+        way_ids = get_way_ids(network, generator.choice(roads))
+        num_ways = min(ways_per_result, len(way_ids))
+        first_way = generator.randrange(len(way_ids) - num_ways + 1)
+        edges = way_ids[first_way:first_way + num_ways]
+        match_results.append({
+            "meta": [],
+            "edges": [{"way_id": way_id} for way_id in edges],
+            "matches": [{
+                "edge_index": edge_index,
+                "edge_ratio": ratio / 1000,
+            } for edge_index in range(len(edges))
+                for ratio in sorted(generator.sample(range(1000), points_per_way))],
+        })
+    return match_results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthetic OSM Motorway Network Generator")
+    parser.add_argument("output_files", metavar="OUTPUT_FILE", nargs="+",
+                        help="The OSM files to write (.osm, .osm.pbf, ...)")
+    parser.add_argument("--nodes", type=int, default=10000,
+                        help="The approximate number of nodes")
+    parser.add_argument("--nodes-per-way", type=int, default=50)
+    parser.add_argument("--ways-per-road", type=int, default=20)
+    parser.add_argument("--noise-ratio", type=float, default=0.2,
+                        help="The fraction of roads which are no motorways")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    network = create_network(args.nodes, args.ways_per_road,
+                             args.nodes_per_way, args.noise_ratio, args.seed)
+    for output_file in args.output_files:
+        write_network(output_file, network)
+        logging.info("Wrote {} ({:.1f} MiB)".format(
+            output_file, os.path.getsize(output_file) / 1024 ** 2))
@@ -0,0 +1,65 @@
+#! /usr/bin/env python
+
+import argparse
+import logging
+import random
+import time
+
+from way_segments import map_match_result_to_osm_way_segments
+
+
+class SyntheticSegmentStore:
+    def __init__(self, way_ratios):
+        self.way_ratios = way_ratios
+
+    def get_way_ratios(self, way_ids):
+        return {way_id: self.way_ratios[way_id] for way_id in set(way_ids)
+                if way_id in self.way_ratios}
+
+
+def create_drive(num_ways, segments_per_way, points_per_way, seed=0):
+    generator = random.Random(seed)
+    way_ratios = {way_id: tuple(idx / segments_per_way for idx in range(segments_per_way))
+                  for way_id in range(num_ways)}
+    match_result = {
+        "meta": [],
+        "edges": [{"way_id": way_id} for way_id in range(num_ways)],
+        "matches": [{
+            "edge_index": way_id,
+            "edge_ratio": ratio / 10000,
+        } for way_id in range(num_ways)
+            for ratio in sorted(generator.sample(range(10000), points_per_way))],
+    }
+    return SyntheticSegmentStore(way_ratios), match_result
+
+
+def run_benchmark(num_ways, segments_per_way, points_per_way, repetitions):
+    segment_store, match_result = create_drive(
+        num_ways, segments_per_way, points_per_way)
+    start_time = time.perf_counter()
+    for _ in range(repetitions):
+        map_match_result_to_osm_way_segments(segment_store, match_result)
+    duration = (time.perf_counter() - start_time) / repetitions
+    num_matches = len(match_result["matches"])
+    logging.info("{:>6} ways x {:>4} segments, {:>7} matches: {:8.2f} ms ({:.2f} us/match)".format(
+        num_ways, segments_per_way, num_matches, 1000 * duration, 1e6 * duration / num_matches))
+    return duration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Travelled Way Segments Benchmark (run from the coverage directory with python -m benchmarks.way_segments_benchmark)")
+    parser.add_argument("--max-ways", type=int, default=16000,
+                        help="The number of ways of the longest drive (drive lengths double from 250 ways)")
+    parser.add_argument("--segments-per-way", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--points-per-way", type=int, default=5)
+    parser.add_argument("--repetitions", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    for segments_per_way in args.segments_per_way:
+        num_ways = 250
+        while num_ways <= args.max_ways:
+            run_benchmark(num_ways, segments_per_way,
+                          args.points_per_way, args.repetitions)
+            num_ways *= 2
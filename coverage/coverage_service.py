@@ -0,0 +1,575 @@
+#! /usr/bin/env python
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import mysql.connector
+import numpy as np
+
+from db.mysql_connection import connect_to_database, execute_prepared, load_configuration, log_pool_stats
+from db.road_database import RoadDatabase
+from db.road_version import get_road_version
+
+
+# Rollups are kept per web mercator tile of this zoom level (about 10 km wide at the equator)
+ROLLUP_ZOOM = 12
+# GeoJSON tiles of lower zoom levels would contain the roads of whole countries
+MIN_TILE_ZOOM = 8
+MAX_TILE_ZOOM = 20
+MAX_LATITUDE = 85.0511287798
+COORDINATE_DIGITS = 7
+FETCH_SIZE = 100000
+
+COVERAGE_QUERY = "SELECT way_id, segment_id, coverage FROM way_segment_coverage WHERE coverage > 0"
+VERSION_QUERY = "SELECT COALESCE(MAX(update_id), 0) FROM coverage_updates"
+UPDATE_QUERY = """
+    SELECT coverage.way_id, coverage.segment_id, coverage.coverage
+    FROM (
+        SELECT DISTINCT way_id, segment_id FROM coverage_updates WHERE update_id > %s AND update_id <= %s
+    ) AS updates
+    JOIN way_segment_coverage AS coverage
+        ON coverage.way_id = updates.way_id AND coverage.segment_id = updates.segment_id
+"""
+
+
+def get_tile_coordinates(lats, lons, zoom):
+    num_tiles = 1 << zoom
+    lats = np.radians(np.clip(np.asarray(lats, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    xs = np.floor((np.asarray(lons, dtype=np.float64) + 180) / 360 * num_tiles)
+    ys = np.floor((1 - np.arcsinh(np.tan(lats)) / np.pi) / 2 * num_tiles)
+    return (np.clip(xs, 0, num_tiles - 1).astype(np.int64),
+            np.clip(ys, 0, num_tiles - 1).astype(np.int64))
+
+
+def get_tile_bounds(zoom, x, y):
+    num_tiles = 1 << zoom
+    return (_get_tile_latitude(zoom, y + 1), x / num_tiles * 360 - 180,
+            _get_tile_latitude(zoom, y), (x + 1) / num_tiles * 360 - 180)
+
+
+def _get_tile_latitude(zoom, y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / (1 << zoom)))))
+
+
+def _get_tile_key(x, y, zoom):
+    return (x << zoom) | y
+
+
+def _check_tile(zoom, x, y, min_zoom=MIN_TILE_ZOOM):
+    if not min_zoom <= zoom <= MAX_TILE_ZOOM:
+        raise ValueError("Tile zoom must be between {} and {}".format(min_zoom, MAX_TILE_ZOOM))
+    if not (0 <= x < (1 << zoom) and 0 <= y < (1 << zoom)):
+        raise ValueError("Tile {}/{}/{} does not exist".format(zoom, x, y))
+
+
+def normalize_ref(ref):
+    # "A7", "A 7" and "a 7" refer to the same road
+    return "".join(ref.split()).upper()
+
+
+def _split_refs(value):
+    if not value:
+        return []
+    return [ref.strip() for ref in value.split(";") if ref.strip()]
+
+
+def _get_summary(length, covered_length, num_segments, num_covered_segments):
+    return {
+        "length_km": float(length),
+        "covered_length_km": float(covered_length),
+        "covered_percentage": 100.0 * float(covered_length) / float(length) if length > 0 else 0.0,
+        "segments": int(num_segments),
+        "covered_segments": int(num_covered_segments),
+    }
+
+
+class CoverageRollups:
+    def __init__(self, database, zoom=ROLLUP_ZOOM):
+        self.zoom = zoom
+        self.road_version = database.road_version
+        self.way_ids = np.asarray(database.way_ids)
+        self.way_refs = database.get_string_column("ref")
+        self.way_nodes = np.asarray(database.way_nodes)
+        self.node_lats = np.asarray(database.node_lats)
+        self.node_lons = np.asarray(database.node_lons)
+        self.segment_offsets = np.asarray(database.segment_offsets)
+        self.segment_lengths = np.asarray(database.segment_lengths)
+        way_segment_counts = np.diff(self.segment_offsets)
+        self.segment_ways = np.repeat(np.arange(len(self.way_ids)), way_segment_counts)
+        # segment i of a way connects its nodes i and i + 1
+        self.segment_positions = np.asarray(database.way_node_offsets)[self.segment_ways] + \
+            np.arange(len(self.segment_ways)) - self.segment_offsets[self.segment_ways]
+        begin_nodes = self.way_nodes[self.segment_positions]
+        end_nodes = self.way_nodes[self.segment_positions + 1]
+        self.segment_lats = (self.node_lats[begin_nodes] + self.node_lats[end_nodes]) / 2
+        self.segment_lons = (self.node_lons[begin_nodes] + self.node_lons[end_nodes]) / 2
+        del begin_nodes, end_nodes
+
+        # segments are assigned to the tile of their midpoint, so the tile rollups add up exactly
+        xs, ys = get_tile_coordinates(self.segment_lats, self.segment_lons, zoom)
+        self.tile_keys, self.segment_tiles = np.unique(_get_tile_key(xs, ys, zoom), return_inverse=True)
+        self.segment_tiles = self.segment_tiles.reshape(-1)
+        num_tiles = len(self.tile_keys)
+        self.tile_segments = np.argsort(self.segment_tiles, kind="stable")
+        self.tile_offsets = np.zeros(num_tiles + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.segment_tiles, minlength=num_tiles), out=self.tile_offsets[1:])
+        self.tile_lengths = np.bincount(self.segment_tiles, weights=self.segment_lengths, minlength=num_tiles)
+        way_lengths = np.bincount(
+            self.segment_ways, weights=self.segment_lengths, minlength=len(self.way_ids))
+
+        self.refs = []
+        self._ref_rows = dict()
+        ref_pairs = []
+        for way, value in enumerate(self.way_refs):
+            way_rows = set()
+            for ref in _split_refs(value):
+                row = self._ref_rows.setdefault(normalize_ref(ref), len(self.refs))
+                if row == len(self.refs):
+                    self.refs.append(ref)
+                # "A7;A 7" counts the way once for its road
+                if row not in way_rows:
+                    way_rows.add(row)
+                    ref_pairs.append((row, way))
+        self.ref_pair_refs, self.ref_pair_ways = np.array(ref_pairs, dtype=np.int64).reshape(-1, 2).T
+        self.ref_ways = np.bincount(self.ref_pair_refs, minlength=len(self.refs))
+        self.ref_lengths = self._sum_by_ref(way_lengths)
+        self.ref_segments = self._sum_by_ref(way_segment_counts)
+
+        self.coverage = np.zeros(len(self.segment_ways), dtype=np.int64)
+        self._update_covered_rollups()
+
+    def _sum_by_ref(self, way_values):
+        return np.bincount(self.ref_pair_refs, weights=way_values[self.ref_pair_ways], minlength=len(self.refs))
+
+    def _update_covered_rollups(self):
+        # summing again is exact and takes milliseconds for millions of segments
+        is_covered = self.coverage > 0
+        covered_lengths = np.where(is_covered, self.segment_lengths, 0)
+        self.tile_covered_lengths = np.bincount(
+            self.segment_tiles, weights=covered_lengths, minlength=len(self.tile_keys))
+        self.tile_covered_segments = np.bincount(
+            self.segment_tiles[is_covered], minlength=len(self.tile_keys))
+        way_covered_lengths = np.bincount(self.segment_ways, weights=covered_lengths, minlength=len(self.way_ids))
+        self.ref_covered_lengths = self._sum_by_ref(way_covered_lengths)
+        self.ref_covered_segments = self._sum_by_ref(
+            np.bincount(self.segment_ways[is_covered], minlength=len(self.way_ids)))
+
+    def get_segment_indices(self, way_ids, segment_ids):
+        way_ids = np.asarray(way_ids, dtype=np.int64)
+        segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        if not len(self.way_ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(len(way_ids), dtype=bool)
+        ways = np.minimum(np.searchsorted(self.way_ids, way_ids), len(self.way_ids) - 1)
+        valid = (self.way_ids[ways] == way_ids) & (segment_ids >= 0) & \
+            (segment_ids < self.segment_offsets[ways + 1] - self.segment_offsets[ways])
+        return self.segment_offsets[ways[valid]] + segment_ids[valid], valid
+
+    def update_coverage(self, segments, coverage):
+        segments, positions = np.unique(np.asarray(segments, dtype=np.int64), return_index=True)
+        coverage = np.asarray(coverage, dtype=np.int64)[positions]
+        changed = self.coverage[segments] != coverage
+        segments = segments[changed]
+        if not len(segments):
+            return self.tile_keys[:0]
+        self.coverage[segments] = coverage[changed]
+        self._update_covered_rollups()
+        # every changed count invalidates the tile, the features carry the counts
+        return self.tile_keys[np.unique(self.segment_tiles[segments])]
+
+    def get_bbox_coverage(self, min_lat, min_lon, max_lat, max_lon):
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError("Invalid bounding box: {}, {}, {}, {}".format(min_lat, min_lon, max_lat, max_lon))
+        (min_x, max_x), (max_y, min_y) = get_tile_coordinates(
+            [min_lat, max_lat], [min_lon, max_lon], self.zoom)
+        rows = self._get_tile_rows(int(min_x), int(max_x), int(min_y), int(max_y))
+        xs, ys = self.tile_keys[rows] >> self.zoom, self.tile_keys[rows] & ((1 << self.zoom) - 1)
+        # tiles inside the bounding box are taken from the rollups, only border tiles are filtered
+        is_inner = (xs > min_x) & (xs < max_x) & (ys > min_y) & (ys < max_y)
+        inner_rows = rows[is_inner]
+        segments = self._get_row_segments(rows[~is_inner])
+        lats, lons = self.segment_lats[segments], self.segment_lons[segments]
+        segments = segments[(lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)]
+        lengths = self.segment_lengths[segments]
+        is_covered = self.coverage[segments] > 0
+        return _get_summary(
+            self.tile_lengths[inner_rows].sum() + lengths.sum(),
+            self.tile_covered_lengths[inner_rows].sum() + lengths[is_covered].sum(),
+            (self.tile_offsets[inner_rows + 1] - self.tile_offsets[inner_rows]).sum() + len(segments),
+            self.tile_covered_segments[inner_rows].sum() + is_covered.sum())
+
+    def get_ref_coverage(self, ref):
+        row = self._ref_rows.get(normalize_ref(ref))
+        if row is None:
+            raise KeyError("No road with ref {}".format(ref))
+        return self._get_ref_summary(row)
+
+    def get_road_coverage(self):
+        return [self._get_ref_summary(row) for row in sorted(range(len(self.refs)), key=self.refs.__getitem__)]
+
+    def _get_ref_summary(self, row):
+        summary = {"ref": self.refs[row], "ways": int(self.ref_ways[row])}
+        summary.update(_get_summary(self.ref_lengths[row], self.ref_covered_lengths[row],
+                                    self.ref_segments[row], self.ref_covered_segments[row]))
+        return summary
+
+    def get_tile_coverage(self, zoom, x, y):
+        if zoom <= self.zoom:
+            rows = self._get_descendant_rows(zoom, x, y)
+            return _get_summary(
+                self.tile_lengths[rows].sum(), self.tile_covered_lengths[rows].sum(),
+                (self.tile_offsets[rows + 1] - self.tile_offsets[rows]).sum(), self.tile_covered_segments[rows].sum())
+        segments = self.get_tile_segments(zoom, x, y)
+        lengths = self.segment_lengths[segments]
+        is_covered = self.coverage[segments] > 0
+        return _get_summary(lengths.sum(), lengths[is_covered].sum(), len(segments), is_covered.sum())
+
+    def get_tile_segments(self, zoom, x, y):
+        if zoom <= self.zoom:
+            return np.sort(self._get_row_segments(self._get_descendant_rows(zoom, x, y)))
+        shift = zoom - self.zoom
+        segments = self._get_row_segments(self._get_tile_rows(x >> shift, x >> shift, y >> shift, y >> shift))
+        xs, ys = get_tile_coordinates(self.segment_lats[segments], self.segment_lons[segments], zoom)
+        return np.sort(segments[(xs == x) & (ys == y)])
+
+    def get_tile_features(self, zoom, x, y):
+        segments = self.get_tile_segments(zoom, x, y)
+        ways = self.segment_ways[segments]
+        coverage = self.coverage[segments]
+        # consecutive segments of a way with the same coverage are merged into one line
+        is_start = np.ones(len(segments), dtype=bool)
+        is_start[1:] = (np.diff(segments) != 1) | (ways[1:] != ways[:-1]) | (coverage[1:] != coverage[:-1])
+        bounds = np.append(np.flatnonzero(is_start), len(segments)).tolist()
+        features = []
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            first, last = int(segments[begin]), int(segments[end - 1])
+            way = int(ways[begin])
+            nodes = self.way_nodes[self.segment_positions[first]:self.segment_positions[last] + 2]
+            features.append({
+                "type": "Feature",
+                "geometry": {
+                    "type": "LineString",
+                    "coordinates": np.round(np.column_stack(
+                        (self.node_lons[nodes], self.node_lats[nodes])), COORDINATE_DIGITS).tolist(),
+                },
+                "properties": {
+                    "way_id": int(self.way_ids[way]),
+                    "first_segment_id": first - int(self.segment_offsets[way]),
+                    "last_segment_id": last - int(self.segment_offsets[way]),
+                    "ref": self.way_refs[way],
+                    "coverage": int(coverage[begin]),
+                },
+            })
+        return features
+
+    def _get_descendant_rows(self, zoom, x, y):
+        shift = self.zoom - zoom
+        return self._get_tile_rows(x << shift, ((x + 1) << shift) - 1, y << shift, ((y + 1) << shift) - 1)
+
+    def _get_tile_rows(self, min_x, max_x, min_y, max_y):
+        # tile keys are sorted by x and y, so every column of tiles is one range
+        columns = np.arange(min_x, max_x + 1, dtype=np.int64)
+        begins = np.searchsorted(self.tile_keys, _get_tile_key(columns, min_y, self.zoom))
+        ends = np.searchsorted(self.tile_keys, _get_tile_key(columns, max_y, self.zoom), side="right")
+        return np.concatenate([np.arange(0, dtype=np.int64)] + [
+            np.arange(begin, end) for begin, end in zip(begins.tolist(), ends.tolist()) if end > begin])
+
+    def _get_row_segments(self, rows):
+        return np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            self.tile_segments[self.tile_offsets[row]:self.tile_offsets[row + 1]] for row in rows.tolist()])
+
+
+class TileCache:
+    def __init__(self, max_tiles=1000):
+        self.max_tiles = max_tiles
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key, tile):
+        with self._lock:
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+
+    def invalidate(self, zoom, tile_keys):
+        changed_tiles = {(key >> zoom, key & ((1 << zoom) - 1)) for key in tile_keys.tolist()}
+        if not changed_tiles:
+            return
+        ancestors = dict()
+        with self._lock:
+            for key in list(self._tiles):
+                tile_zoom, x, y = key
+                if tile_zoom > zoom:
+                    shift = tile_zoom - zoom
+                    is_changed = (x >> shift, y >> shift) in changed_tiles
+                else:
+                    if tile_zoom not in ancestors:
+                        shift = zoom - tile_zoom
+                        ancestors[tile_zoom] = {(x >> shift, y >> shift) for x, y in changed_tiles}
+                    is_changed = (x, y) in ancestors[tile_zoom]
+                if is_changed:
+                    del self._tiles[key]
+                    self.invalidations += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {"tiles": len(self._tiles), "hits": self.hits, "misses": self.misses,
+                    "invalidations": self.invalidations}
+
+
+class CoverageService:
+    def __init__(self, rollups, mysql_config=None, tile_cache_size=1000):
+        self.rollups = rollups
+        self.mysql_config = mysql_config
+        self.tile_cache = TileCache(tile_cache_size)
+        self.version = 0
+        self.road_version_mismatch = False
+        self._lock = threading.RLock()
+
+    def load(self):
+        with connect_to_database(self.mysql_config) as dbcon:
+            if not self._check_road_version(dbcon):
+                raise ValueError("The road database was not built from the OSM data in MySQL, "
+                                 "import both from the same OSM file")
+            # updates committed while loading are applied once more by the next refresh
+            version = _get_version(dbcon)
+            with dbcon.cursor() as cursor:
+                cursor.execute(COVERAGE_QUERY)
+                rows = cursor.fetchmany(FETCH_SIZE)
+                while rows:
+                    self.update_coverage(rows)
+                    rows = cursor.fetchmany(FETCH_SIZE)
+        self.version = version
+        logging.info("Loaded the coverage up to update {}".format(version))
+
+    def refresh(self):
+        with connect_to_database(self.mysql_config) as dbcon:
+            version = _get_version(dbcon)
+            if version <= self.version:
+                return 0
+            rows = execute_prepared(dbcon, UPDATE_QUERY, (self.version, version)).fetchall()
+            # checked after reading the updates, a change file is recorded as a new
+            # road version before any of its segments are changed
+            if not self._check_road_version(dbcon):
+                return 0
+        num_tiles = self.update_coverage(rows)
+        logging.info("Applied coverage updates {} to {}: {} segments, {} tiles changed".format(
+            self.version + 1, version, len(rows), num_tiles))
+        self.version = version
+        return num_tiles
+
+    def _check_road_version(self, dbcon):
+        road_version = get_road_version(dbcon)
+        is_mismatch = road_version is None or road_version != self.rollups.road_version
+        if is_mismatch and not self.road_version_mismatch:
+            logging.error("The road database has version {} but MySQL has version {}, coverage updates "
+                          "are not applied until the road database is rebuilt".format(
+                              self.rollups.road_version, road_version))
+        self.road_version_mismatch = is_mismatch
+        return not is_mismatch
+
+    def update_coverage(self, rows):
+        way_ids, segment_ids, coverage = np.array(rows, dtype=np.int64).reshape(-1, 3).T
+        segments, valid = self.rollups.get_segment_indices(way_ids, segment_ids)
+        if not valid.all():
+            logging.warning("{} coverage rows do not match the road database".format(
+                np.count_nonzero(~valid)))
+        with self._lock:
+            tile_keys = self.rollups.update_coverage(segments, coverage[valid])
+            self.tile_cache.invalidate(self.rollups.zoom, tile_keys)
+        return len(tile_keys)
+
+    def get_bbox_coverage(self, min_lat, min_lon, max_lat, max_lon):
+        with self._lock:
+            return self.rollups.get_bbox_coverage(min_lat, min_lon, max_lat, max_lon)
+
+    def get_ref_coverage(self, ref):
+        with self._lock:
+            return self.rollups.get_ref_coverage(ref)
+
+    def get_road_coverage(self):
+        with self._lock:
+            return self.rollups.get_road_coverage()
+
+    def get_tile_coverage(self, zoom, x, y):
+        _check_tile(zoom, x, y, min_zoom=0)
+        with self._lock:
+            return self.rollups.get_tile_coverage(zoom, x, y)
+
+    def get_tile(self, zoom, x, y):
+        _check_tile(zoom, x, y)
+        tile = self.tile_cache.get((zoom, x, y))
+        if tile is not None:
+            return tile
+        with self._lock:
+            body = json.dumps({
+                "type": "FeatureCollection",
+                "features": self.rollups.get_tile_features(zoom, x, y),
+                "coverage": self.rollups.get_tile_coverage(zoom, x, y),
+            }, separators=(",", ":")).encode("utf-8")
+            tile = ('"{}"'.format(hashlib.sha1(body).hexdigest()[:16]), body)
+            # cached under the lock, so an update cannot be overtaken by a stale tile
+            self.tile_cache.put((zoom, x, y), tile)
+        return tile
+
+    def get_stats(self):
+        return {
+            "version": self.version,
+            "road_version": self.rollups.road_version,
+            "road_version_mismatch": self.road_version_mismatch,
+            "zoom": self.rollups.zoom,
+            "segments": len(self.rollups.coverage),
+            "tiles": len(self.rollups.tile_keys),
+            "roads": len(self.rollups.refs),
+            "tile_cache": self.tile_cache.get_stats(),
+        }
+
+
+def _get_version(dbcon):
+    return execute_prepared(dbcon, VERSION_QUERY).fetchall()[0][0]
+
+
+class CoverageRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        try:
+            if parts == ["coverage", "bbox"]:
+                self._send_json(self.service.get_bbox_coverage(*_parse_bbox(parse_qs(url.query))))
+            elif parts[:2] == ["coverage", "ref"] and len(parts) == 3:
+                self._send_json(self.service.get_ref_coverage(parts[2]))
+            elif parts == ["coverage", "roads"]:
+                self._send_json({"roads": self.service.get_road_coverage()})
+            elif parts[:2] == ["coverage", "tile"] and len(parts) == 5:
+                self._send_json(self.service.get_tile_coverage(*_parse_tile(parts[2:])))
+            elif parts[0] == "tiles" and len(parts) == 4 and parts[3].endswith(".geojson"):
+                self._send_tile(*_parse_tile(parts[1:3] + [parts[3][:-len(".geojson")]]))
+            elif parts == ["status"]:
+                self._send_json(self.service.get_stats())
+            else:
+                self._send_error(404, "Not found: {}".format(url.path))
+        except KeyError as error:
+            self._send_error(404, error.args[0])
+        except ValueError as error:
+            self._send_error(400, str(error))
+
+    def _send_tile(self, zoom, x, y):
+        etag, body = self.service.get_tile(zoom, x, y)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._send(200, body, "application/geo+json", {"ETag": etag, "Cache-Control": "no-cache"})
+
+    def _send_json(self, data):
+        self._send(200, json.dumps(data).encode("utf-8"), "application/json")
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({"error": message}).encode("utf-8"), "application/json")
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        for name, value in (headers or dict()).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def _parse_bbox(query):
+    if "bbox" not in query:
+        raise ValueError("Missing parameter bbox=min_lon,min_lat,max_lon,max_lat")
+    values = query["bbox"][0].split(",")
+    if len(values) != 4:
+        raise ValueError("Invalid bbox: {}".format(query["bbox"][0]))
+    min_lon, min_lat, max_lon, max_lat = (float(value) for value in values)
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def _parse_tile(parts):
+    if not all(part.isdigit() for part in parts):
+        raise ValueError("Invalid tile: {}".format("/".join(parts)))
+    return tuple(int(part) for part in parts)
+
+
+def start_coverage_server(service, host="127.0.0.1", port=0):
+    handler = type("ConfiguredCoverageRequestHandler", (CoverageRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://{}:{}/".format(host, server.server_port)
+
+
+def _refresh_periodically(service, interval, stop_event):
+    while not stop_event.wait(interval):
+        try:
+            service.refresh()
+        except mysql.connector.Error as error:
+            logging.warning("Refreshing the coverage failed: {}".format(error))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Coverage Query and Tile Service")
+    parser.add_argument("config_file", metavar="CONFIG_FILE",
+                        help="The MySQL configuration")
+    parser.add_argument("road_database", metavar="ROAD_DATABASE",
+                        help="The columnar road database directory (imported from the same OSM file as MySQL)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8003)
+    parser.add_argument("--rollup-zoom", type=int, default=ROLLUP_ZOOM,
+                        help="The zoom level of the tiles the coverage is rolled up in")
+    parser.add_argument("--tile-cache-size", type=int, default=1000,
+                        help="The number of GeoJSON tiles kept in the cache")
+    parser.add_argument("--refresh-interval", type=float, default=60.0,
+                        help="The seconds between two checks for ingested drives (0: never)")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    config = load_configuration(args.config_file)
+    start_time = time.perf_counter()
+    rollups = CoverageRollups(RoadDatabase(args.road_database), args.rollup_zoom)
+    logging.info("Built the rollups of {} segments in {} tiles and {} roads in {:.1f}s".format(
+        len(rollups.coverage), len(rollups.tile_keys), len(rollups.refs), time.perf_counter() - start_time))
+    service = CoverageService(rollups, config["mysql"], args.tile_cache_size)
+    service.load()
+    server, url = start_coverage_server(service, args.host, args.port)
+    logging.info("Coverage service listening on {}".format(url))
+    stop_event = threading.Event()
+    if args.refresh_interval > 0:
+        threading.Thread(target=_refresh_periodically, args=(service, args.refresh_interval, stop_event),
+                         daemon=True).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stop_event.set()
+        server.shutdown()
+    log_pool_stats()
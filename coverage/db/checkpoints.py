@@ -0,0 +1,151 @@
+import json
+import logging
+
+from bisect import bisect_right
+
+
+PROGRESS_TABLE = "pipeline_progress"
+# row counts of the tables before a stage started, kept for resumed runs
+BASE_STAGE_SUFFIX = "_base"
+BASE_RANGE = -1
+
+
+def clear_progress(dbcon, stages):
+    logging.debug("Clearing progress: [{}]".format(", ".join(stages)))
+    with dbcon.cursor() as cursor:
+        for stage in stages:
+            cursor.execute("DELETE FROM {} WHERE stage LIKE %s".format(
+                PROGRESS_TABLE), (stage + "%",))
+
+
+def get_checkpoint(dbcon, stage):
+    with dbcon.cursor() as cursor:
+        cursor.execute("SELECT range_end, row_counts, completed FROM {} WHERE stage = %s".format(
+            PROGRESS_TABLE), (stage,))
+        row = cursor.fetchone()
+    if row is None:
+        return None, dict(), False
+    return row[0], json.loads(row[1]), bool(row[2])
+
+
+def save_checkpoint(dbcon, stage, last_id, row_counts, completed=False):
+    logging.debug("Checkpoint {}: last id {}, rows {}".format(
+        stage, last_id, row_counts))
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        cursor.execute("DELETE FROM {} WHERE stage = %s".format(
+            PROGRESS_TABLE), (stage,))
+        add_completed_range(cursor, stage, 0, last_id, row_counts, completed)
+    dbcon.commit()
+
+
+def add_completed_range(cursor, stage, range_begin, range_end, row_counts, completed=True):
+    cursor.execute(
+        "INSERT INTO {} (stage, range_begin, range_end, row_counts, completed) VALUES (%s, %s, %s, %s, %s)".format(
+            PROGRESS_TABLE),
+        (stage, range_begin, range_end, json.dumps(row_counts), completed))
+
+
+def save_base_row_counts(dbcon, stage, row_counts):
+    logging.debug("Base row counts {}: {}".format(stage, row_counts))
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        cursor.execute("DELETE FROM {} WHERE stage = %s".format(
+            PROGRESS_TABLE), (stage + BASE_STAGE_SUFFIX,))
+        add_completed_range(cursor, stage + BASE_STAGE_SUFFIX,
+                            BASE_RANGE, BASE_RANGE, row_counts)
+    dbcon.commit()
+
+
+def get_base_row_counts(dbcon, stage):
+    with dbcon.cursor() as cursor:
+        cursor.execute("SELECT row_counts FROM {} WHERE stage = %s AND range_begin = %s".format(
+            PROGRESS_TABLE), (stage + BASE_STAGE_SUFFIX, BASE_RANGE))
+        row = cursor.fetchone()
+    if row is None:
+        return dict()
+    return json.loads(row[0])
+
+
+def get_completed_ranges(dbcon, stage):
+    with dbcon.cursor() as cursor:
+        cursor.execute("SELECT range_begin, range_end, row_counts FROM {} WHERE stage = %s ORDER BY range_begin".format(
+            PROGRESS_TABLE), (stage,))
+        return [(row[0], row[1], json.loads(row[2])) for row in cursor.fetchall()]
+
+
+def filter_completed_ids(ids, completed_ranges):
+    # Batches of a resumed run may enclose ranges completed out of order by an
+    # earlier run, all ids inside the merged ranges are completed nonetheless.
+    merged_ranges = []
+    for range_begin, range_end, _ in sorted(completed_ranges, key=lambda completed_range: completed_range[0]):
+        if merged_ranges and range_begin <= merged_ranges[-1][1]:
+            merged_ranges[-1][1] = max(merged_ranges[-1][1], range_end)
+        else:
+            merged_ranges.append([range_begin, range_end])
+    range_begins = [range_begin for range_begin, _ in merged_ranges]
+    remaining_ids = []
+    for id in ids:
+        idx = bisect_right(range_begins, id) - 1
+        if idx < 0 or id > merged_ranges[idx][1]:
+            remaining_ids.append(id)
+    return remaining_ids
+
+
+def sum_row_counts(tables, completed_ranges, base_row_counts=None):
+    row_counts = {table: (base_row_counts or {}).get(table, 0)
+                  for table in tables}
+    for _, _, range_row_counts in completed_ranges:
+        for table, count in range_row_counts.items():
+            row_counts[table] = row_counts.get(table, 0) + count
+    return row_counts
+
+
+def get_row_counts(dbcon, tables):
+    row_counts = dict()
+    with dbcon.cursor() as cursor:
+        for table in tables:
+            cursor.execute("SELECT COUNT(*) FROM {}".format(table))
+            row_counts[table] = cursor.fetchone()[0]
+    return row_counts
+
+
+def verify_row_counts(dbcon, expected_row_counts):
+    mismatches = []
+    row_counts = get_row_counts(dbcon, expected_row_counts.keys())
+    for table, expected_count in expected_row_counts.items():
+        count = row_counts[table]
+        logging.info("Row count of {}: {} (expected {})".format(
+            table, count, expected_count))
+        if count != expected_count:
+            mismatches.append("{} has {} rows instead of {}".format(
+                table, count, expected_count))
+    if mismatches:
+        raise ValueError("Row count verification failed: {}".format(
+            "; ".join(mismatches)))
+
+
+class ImportCheckpoint:
+    def __init__(self, dbcon, writer, stage, interval, last_id=None, completed=False):
+        self.dbcon = dbcon
+        self.writer = writer
+        self.stage = stage
+        self.interval = interval
+        self.last_id = last_id
+        self.completed = completed
+        self.num_objects = 0
+
+    def skip(self, object_id):
+        return self.last_id is not None and object_id <= self.last_id
+
+    def add(self, object_id):
+        self.last_id = object_id
+        self.num_objects += 1
+        if self.num_objects % self.interval == 0:
+            self.save()
+
+    def save(self, completed=False):
+        self.writer.flush()
+        save_checkpoint(self.dbcon, self.stage, self.last_id,
+                        dict(self.writer.row_counts), completed)
+        self.completed = completed
@@ -2,95 +2,254 @@
 
 import argparse
 import logging
-import os
 import pickle
-from geopy.distance import distance
+import resource
+
+from array import array
+
+import numpy as np
+import osmium.filter
+import osmium.osm
 from osmium import SimpleHandler
 
+from metrics import add_metrics_arguments, configure_metrics, measure_stage, write_metrics
+from road_database import STRING_COLUMNS, write_road_database
+from road_version import get_file_version
+from segment_lengths import METHODS, compute_segment_lengths, compute_segment_lengths_in_chunks, pack_coordinates
+
 
 logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
 
+HIGHWAY_TYPES = ("motorway", "motorway_link")
+OUTPUT_FORMATS = ("columnar", "pickle")
+COORDINATE_PRECISION = 10000000
+
+
+class CategoricalColumn:
+    def __init__(self):
+        self.codes = array("i")
+        self.categories = []
+        self._category_codes = dict()
+
+    def append(self, value):
+        if value is None:
+            self.codes.append(-1)
+            return
+        code = self._category_codes.get(value)
+        if code is None:
+            code = len(self.categories)
+            self._category_codes[value] = code
+            self.categories.append(value)
+        self.codes.append(code)
+
+    def to_list(self, order=None):
+        codes = np.frombuffer(self.codes, dtype=np.int32)
+        if order is not None:
+            codes = codes[order]
+        return [self.categories[code] if code >= 0 else None for code in codes.tolist()]
+
+    def get_size(self):
+        return self.codes.itemsize * len(self.codes)
+
 
 class MotorwayWayHandler(SimpleHandler):
     def __init__(self):
         SimpleHandler.__init__(self)
-        self.motorway_node_ids = set()
-        self.motorway_ways = dict()
+        self.way_ids = array("q")
+        self.way_types = array("B")
+        self.way_node_offsets = array("q", [0])
+        self.way_node_ids = array("q")
+        self.tags = {name: CategoricalColumn() for name in STRING_COLUMNS}
+        self.num_objects = 0
 
     def way(self, way):
+        self.num_objects += 1
         highway = way.tags.get("highway", None)
-        if highway in ["motorway", "motorway_link"]:
-            node_ids = [node.ref for node in way.nodes]
-            self.motorway_ways[way.id] = {
-                "ref": way.tags.get("ref"),
-                "name": way.tags.get("name"),
-                "type": highway,
-                "oneway": way.tags.get("oneway"),
-                "maxspeed": way.tags.get("maxspeed"),
-                "lanes": way.tags.get("lanes"),
-                "tunnel": way.tags.get("tunnel"),
-                "nodes": node_ids
-            }
-            self.motorway_node_ids.update(node_ids)
+        if highway in HIGHWAY_TYPES:
+            self.way_ids.append(way.id)
+            self.way_types.append(HIGHWAY_TYPES.index(highway))
+            self.way_node_ids.extend(node.ref for node in way.nodes)
+            self.way_node_offsets.append(len(self.way_node_ids))
+            for name, column in self.tags.items():
+                column.append(way.tags.get(name))
+
+    def get_node_ids(self):
+        # np.unique needs several times the memory of the ids, sorting needs one copy
+        node_ids = np.sort(np.frombuffer(self.way_node_ids, dtype=np.int64))
+        is_unique = np.ones(len(node_ids), dtype=bool)
+        np.not_equal(node_ids[1:], node_ids[:-1], out=is_unique[1:])
+        return node_ids[is_unique]
+
+    def get_size(self):
+        return sum(values.itemsize * len(values) for values in (
+            self.way_ids, self.way_types, self.way_node_offsets, self.way_node_ids)) + \
+            sum(column.get_size() for column in self.tags.values())
 
 
 def create_ways(input_file):
     logging.info(
         "Extracting OSM ways and node ids for motorways (including on-/off-ramps)")
-    handler = MotorwayWayHandler()
-    handler.apply_file(input_file)
-    return handler.motorway_ways, handler.motorway_node_ids
+    with measure_stage("create_ways") as stage:
+        handler = MotorwayWayHandler()
+        handler.apply_file(input_file, filters=[osmium.filter.TagFilter(
+            *[("highway", highway_type) for highway_type in HIGHWAY_TYPES])])
+        stage.add_objects(handler.num_objects)
+        stage.add_rows(len(handler.way_ids))
+    logging.info("Collected {} ways with {} node references in {:.1f} MiB".format(
+        len(handler.way_ids), len(handler.way_node_ids), handler.get_size() / 1024 ** 2))
+    return handler, handler.get_node_ids()
 
 
 class MotorwayNodeHandler(SimpleHandler):
-    def __init__(self, motorway_node_ids):
+    # Locations are kept as the fixed-point integers osmium stores internally
+    def __init__(self):
         SimpleHandler.__init__(self)
-        self.node_ids = motorway_node_ids
-        self.nodes = dict()
+        self.node_ids = array("q")
+        self.lats = array("i")
+        self.lons = array("i")
+        self.num_objects = 0
 
     def node(self, node):
-        if node.id in self.node_ids:
-            self.nodes[node.id] = {
-                "lat": node.location.lat,
-                "lon": node.location.lon
-            }
+        self.num_objects += 1
+        location = node.location
+        self.node_ids.append(node.id)
+        self.lats.append(location.y)
+        self.lons.append(location.x)
+
+    def get_fixed_point_locations(self):
+        return (np.frombuffer(self.node_ids, dtype=np.int64),
+                np.frombuffer(self.lats, dtype=np.int32),
+                np.frombuffer(self.lons, dtype=np.int32))
+
+    def get_locations(self):
+        node_ids, lats, lons = self.get_fixed_point_locations()
+        return node_ids, lats / COORDINATE_PRECISION, lons / COORDINATE_PRECISION
+
+    def get_size(self):
+        return sum(values.itemsize * len(values) for values in (self.node_ids, self.lats, self.lons))
 
 
 def create_nodes(input_file, motorway_node_ids):
     logging.info(
         "Extracting OSM nodes for motorways (including on-/off-ramps)")
-    handler = MotorwayNodeHandler(motorway_node_ids)
-    handler.apply_file(input_file)
-    return handler.nodes
+    with measure_stage("create_nodes") as stage:
+        handler = MotorwayNodeHandler()
+        # libosmium only passes the requested nodes, tested against its id bitmap
+        handler.apply_file(input_file, filters=[
+            osmium.filter.IdFilter(motorway_node_ids).enable_for(osmium.osm.NODE)])
+        stage.add_objects(handler.num_objects)
+        stage.add_rows(len(handler.node_ids))
+    logging.info("Collected {} nodes in {:.1f} MiB".format(
+        len(handler.node_ids), handler.get_size() / 1024 ** 2))
+    return handler
+
+
+def compute_way_lengths(ways, nodes, method="ellipsoidal"):
+    logging.info("Compute way and segment lengths ({})".format(method))
+    lats, lons, offsets = pack_coordinates(
+        [(nodes[id]["lat"], nodes[id]["lon"]) for id in way["nodes"]]
+        for way in ways.values())
+    lengths = compute_segment_lengths(lats, lons, offsets, method)
+    for idx, way in enumerate(ways.values()):
+        begin, end = lengths.segment_offsets[idx:idx+2]
+        way["segments"] = lengths.segments[begin:end].tolist()
+        way["length"] = float(lengths.way_lengths[idx])
+
+
+def store_database_to_disk(nodes, ways, database_file, output_format="columnar", distance_method="ellipsoidal",
+                           road_version=None):
+    if output_format == "pickle":
+        store_database_to_pickle(nodes, ways, database_file, distance_method)
+    elif output_format == "columnar":
+        store_database_to_columns(nodes, ways, database_file, distance_method, road_version)
+    else:
+        raise ValueError("Unknown output format: {} (available: {})".format(
+            output_format, ", ".join(OUTPUT_FORMATS)))
+
+
+def store_database_to_columns(nodes, ways, database_directory, distance_method, road_version=None):
+    logging.info("Write columnar database to directory {}".format(
+        database_directory))
+    way_ids, way_node_offsets, way_node_ids, order = _get_sorted_ways(ways)
+    # the coordinates are converted to degrees per chunk and once more for writing
+    node_ids, node_lats, node_lons = nodes.get_fixed_point_locations()
+    # OSM files are sorted by id, so the nodes usually need no reordering
+    if np.any(node_ids[1:] < node_ids[:-1]):
+        node_order = np.argsort(node_ids, kind="stable")
+        node_ids, node_lats, node_lons = node_ids[node_order], node_lats[node_order], node_lons[node_order]
+        del node_order
+    way_nodes = np.minimum(np.searchsorted(node_ids, way_node_ids), max(len(node_ids) - 1, 0))
+    if len(way_nodes) and np.any(node_ids[way_nodes] != way_node_ids):
+        raise ValueError("Ways reference nodes which are not part of the input file")
+    lengths = compute_segment_lengths_in_chunks(
+        node_lats, node_lons, way_node_offsets, distance_method, way_nodes, COORDINATE_PRECISION)
+    del way_nodes
+    write_road_database(
+        database_directory,
+        node_ids,
+        node_lats / COORDINATE_PRECISION,
+        node_lons / COORDINATE_PRECISION,
+        way_ids,
+        way_node_offsets,
+        way_node_ids,
+        np.frombuffer(ways.way_types, dtype=np.uint8)[order],
+        HIGHWAY_TYPES,
+        lengths,
+        {name: ways.tags[name].to_list(order) for name in STRING_COLUMNS},
+        distance_method,
+        road_version)
 
 
-def compute_way_lengths(ways, nodes):
-    logging.info("Compute way and segment lengths")
-    def compute_distance(o, t): return distance(
-        (o["lat"], o["lon"]), (t["lat"], t["lon"])).km
-    for way_id, way in ways.items():
-        nodes_in_way = [nodes[id] for id in way["nodes"]]
-        way["segments"] = [compute_distance(
-            nodes_in_way[i], nodes_in_way[i+1]) for i in range(len(nodes_in_way) - 1)]
-        way["length"] = sum(way["segments"])
+def _get_sorted_ways(ways):
+    way_ids = np.frombuffer(ways.way_ids, dtype=np.int64)
+    way_node_offsets = np.frombuffer(ways.way_node_offsets, dtype=np.int64)
+    way_node_ids = np.frombuffer(ways.way_node_ids, dtype=np.int64)
+    order = np.argsort(way_ids, kind="stable")
+    sizes = np.diff(way_node_offsets)[order]
+    sorted_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=sorted_offsets[1:])
+    # OSM files are sorted by id, so the ways are usually in order already
+    if np.all(order == np.arange(len(order))):
+        return way_ids, sorted_offsets, way_node_ids, order
+    positions = np.repeat(way_node_offsets[:-1][order] - sorted_offsets[:-1], sizes) + \
+        np.arange(sorted_offsets[-1])
+    return way_ids[order], sorted_offsets, way_node_ids[positions], order
 
 
-def store_database_to_disk(nodes, ways, database_file):
+def store_database_to_pickle(nodes, ways, database_file, distance_method="ellipsoidal"):
     logging.info("Write database to disk as file {}".format(database_file))
+    node_ids, node_lats, node_lons = nodes.get_locations()
+    node_dicts = {node_id: {"lat": lat, "lon": lon} for node_id, lat, lon in zip(
+        node_ids.tolist(), node_lats.tolist(), node_lons.tolist())}
+    way_node_offsets = np.frombuffer(ways.way_node_offsets, dtype=np.int64).tolist()
+    way_node_ids = np.frombuffer(ways.way_node_ids, dtype=np.int64)
+    tags = {name: ways.tags[name].to_list() for name in STRING_COLUMNS}
+    way_dicts = dict()
+    for idx, way_id in enumerate(ways.way_ids):
+        way_dicts[way_id] = {name: tags[name][idx] for name in STRING_COLUMNS}
+        way_dicts[way_id]["type"] = HIGHWAY_TYPES[ways.way_types[idx]]
+        way_dicts[way_id]["nodes"] = way_node_ids[way_node_offsets[idx]:way_node_offsets[idx + 1]].tolist()
+    compute_way_lengths(way_dicts, node_dicts, distance_method)
     with open(database_file, "wb") as file_stream:
         pickle.dump({
-            "nodes": nodes,
-            "ways": ways
+            "nodes": node_dicts,
+            "ways": way_dicts
         },
             file_stream)
 
 
 def main(args):
+    configure_metrics(args)
     logging.info("Processing OSM file: {}".format(args.input_file))
     ways, node_ids = create_ways(args.input_file)
     nodes = create_nodes(args.input_file, node_ids)
-    compute_way_lengths(ways, nodes)
-    store_database_to_disk(nodes, ways, args.database_file)
+    del node_ids
+    with measure_stage("store_database"):
+        store_database_to_disk(nodes, ways, args.database_file,
+                               args.format, args.distance_method, get_file_version(args.input_file))
+    logging.info("Peak memory usage: {:.1f} MiB".format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    write_metrics(args)
 
 
 if __name__ == '__main__':
@@ -98,7 +257,12 @@ if __name__ == '__main__':
     parser.add_argument("input_file", metavar="OSM_FILE",
                         help="The input OSM file")
     parser.add_argument("database_file", metavar="OUTPUT_FILE",
-                        help="The database binary file")
+                        help="The database directory (columnar) or binary file (pickle)")
+    parser.add_argument("--distance-method", choices=METHODS, default="ellipsoidal",
+                        help="The method used to compute segment lengths")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="columnar",
+                        help="The output format: memory-mappable NumPy columns or a single pickle file")
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     main(args)
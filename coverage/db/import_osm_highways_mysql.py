@@ -3,29 +3,56 @@
 import argparse
 import copy
 import logging
-import math
 import multiprocessing
-import threading
+import resource
+import time
 
-from geopy.distance import distance
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import groupby
+
+import osmium.filter
+import osmium.index
+import osmium.osm
 from osmium import SimpleHandler
 
-from mysql_connection import load_configuration, connect_to_database
+from checkpoints import ImportCheckpoint, add_completed_range, clear_progress, filter_completed_ids, get_base_row_counts, get_checkpoint, get_completed_ranges, get_row_counts, save_base_row_counts, sum_row_counts, verify_row_counts
+from metrics import StageMetrics, add_latency, add_metrics_arguments, add_rows, configure_metrics, get_registry, get_stage, measure_stage, write_metrics
+from mysql_connection import connect_to_database, execute_prepared, get_connection_pool, load_configuration, log_pool_stats
+from mysql_schema import create_index, create_indices, create_tables, disable_session_checks, disabled_keys, get_schema_mode, verify_query_plans
 from mysql_table_config import TABLE_CONFIGURATIONS
+from road_version import get_file_version, save_road_version
+from segment_lengths import compute_segment_lengths, pack_coordinates
+from table_writer import create_table_writer, insert_rows
+
+
+# The columns by which rows written after the last checkpoint of an import
+# stage are removed before the stage is resumed
+RESUME_COLUMNS = {
+    "import_ways": {"ways": "way_id", "way_node_ids": "way_id"},
+    "import_nodes": {"nodes": "node_id"},
+}
 
 
 def main(args):
+    configure_metrics(args)
     config = load_configuration(args.config_file)
-    with connect_to_database(config["mysql"]) as dbcon:
-        _prepare_database(dbcon, args)
+    with connect_to_database(config["mysql"], profile="import") as dbcon:
+        _prepare_database(dbcon, config, args)
         _import_osm_into_database(dbcon, config, args)
         _aggregate_ways(dbcon, config, args)
+        if args.verify_query_plans:
+            _verify_query_plans(dbcon)
+    log_pool_stats()
+    write_metrics(args)
 
 
-def _prepare_database(dbcon, args):
+def _prepare_database(dbcon, config, args):
     if args.clear_database:
         _clear_database(dbcon, args)
-    _setup_tables(dbcon)
+    create_tables(dbcon, config)
+    create_indices(dbcon, config, _get_stage_tables("progress"))
+    if not args.skip_preparation:
+        create_indices(dbcon, config, _get_stage_tables("preparation"))
 
 
 def _clear_database(dbcon, args):
@@ -49,14 +76,9 @@ def _get_stages_from_config(args):
     return stages
 
 
-def _setup_tables(dbcon):
-    logging.info("Setting up tables")
-    with dbcon.cursor() as cursor:
-        for table, config in TABLE_CONFIGURATIONS.items():
-            column_string = ",".join(
-                ["{} {}".format(name, spec) for name, spec in config["columns"]])
-            cursor.execute("CREATE TABLE IF NOT EXISTS {table} ({columns})".format(
-                table=table, columns=column_string))
+def _get_stage_tables(stage):
+    return [table for table, config in TABLE_CONFIGURATIONS.items()
+            if config["stage"] == stage]
 
 
 def _import_osm_into_database(dbcon, config, args):
@@ -64,54 +86,189 @@ def _import_osm_into_database(dbcon, config, args):
         return
 
     logging.info("Importing OSM data into database")
-    node_ids = _import_osm_highways(dbcon, config["import"], args.input_file)
-    _import_osm_nodes(dbcon, node_ids, args.input_file)
+    if not args.resume:
+        clear_progress(dbcon, ("import",))
+    tables = _get_stage_tables("import")
+    num_workers = _get_import_workers(config["import"], args.resume)
+    with measure_stage("import"), disabled_keys(dbcon, config, tables):
+        if num_workers > 1:
+            _import_osm_in_parallel(dbcon, config, args, num_workers)
+        elif config["import"].get("mode", "two_pass") == "single_pass":
+            if get_schema_mode(config) == "indices":
+                create_index(dbcon, "nodes", "nodes_index",
+                             ("node_id",), kind="UNIQUE ")
+            writer = create_table_writer(
+                dbcon, config, ignore_duplicates=("nodes",))
+            checkpoint = _open_import_checkpoint(
+                dbcon, writer, config["import"], "import_ways", args.resume)
+            _import_osm_highways_with_locations(
+                writer, config["import"], args.input_file, checkpoint)
+            verify_row_counts(dbcon, writer.row_counts)
+        else:
+            writer = create_table_writer(dbcon, config)
+            checkpoint = _open_import_checkpoint(
+                dbcon, writer, config["import"], "import_ways", args.resume)
+            node_ids = _import_osm_highways(
+                writer, config["import"], args.input_file, checkpoint)
+            verify_row_counts(dbcon, writer.row_counts)
+            if args.resume:
+                node_ids = _get_way_node_ids(dbcon)
+            checkpoint = _open_import_checkpoint(
+                dbcon, writer, config["import"], "import_nodes", args.resume)
+            _import_osm_nodes(writer, node_ids, args.input_file, checkpoint)
+            verify_row_counts(dbcon, writer.row_counts)
+    with measure_stage("import_indices"):
+        create_indices(dbcon, config, tables)
+    # the coverage service checks that its road database was built from the same file
+    save_road_version(dbcon, get_file_version(args.input_file), args.input_file, clear=True)
+    logging.info("Peak memory usage: {:.1f} MiB".format(_get_peak_memory_mib()))
+
+
+def _get_import_workers(config, resume):
+    num_workers = config.get("workers", 1) or multiprocessing.cpu_count()
+    if num_workers > 1 and config.get("mode", "two_pass") == "single_pass":
+        raise ValueError("Parallel imports require the two_pass import mode")
+    if num_workers > 1 and resume:
+        raise ValueError("Parallel imports cannot be resumed, set the import workers to 1")
+    return num_workers
+
+
+def _open_import_checkpoint(dbcon, writer, config, stage, resume):
+    interval = config.get("checkpoint_interval", 100000)
+    columns = RESUME_COLUMNS[stage]
+    if not resume:
+        writer.row_counts.update(get_row_counts(dbcon, columns.keys()))
+        return ImportCheckpoint(dbcon, writer, stage, interval)
+    last_id, row_counts, completed = get_checkpoint(dbcon, stage)
+    if completed:
+        logging.info("Stage {} already completed".format(stage))
+    else:
+        logging.info("Resuming stage {} after id {}".format(stage, last_id))
+        _delete_rows_after(dbcon, columns, last_id)
+    writer.row_counts.update(row_counts)
+    for table in columns:
+        writer.row_counts[table] = row_counts.get(table, 0)
+    verify_row_counts(dbcon, writer.row_counts)
+    return ImportCheckpoint(dbcon, writer, stage, interval, last_id, completed)
+
+
+def _delete_rows_after(dbcon, columns, last_id):
+    with dbcon.cursor() as cursor:
+        for table, column in columns.items():
+            if last_id is None:
+                cursor.execute("DELETE FROM {}".format(table))
+            else:
+                cursor.execute("DELETE FROM {} WHERE {} > %s".format(
+                    table, column), (last_id,))
+            logging.info("Removed {} uncommitted rows from {}".format(
+                cursor.rowcount, table))
 
 
-def _import_osm_highways(dbcon, config, input_file):
+def _get_way_node_ids(dbcon):
+    with dbcon.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT node_id FROM way_node_ids")
+        return set(row[0] for row in cursor.fetchall())
+
+
+def _get_peak_memory_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _import_osm_highways(writer, config, input_file, checkpoint=None):
+    if checkpoint is not None and checkpoint.completed:
+        return set()
     logging.info("Importing highways: [{}]".format(
         ", ".join(config["highway"].keys())))
-    osm_handler = OsmHighwayHandler(dbcon, config["highway"])
-    osm_handler.apply_file(input_file)
-    osm_handler.finalize()
+    with measure_stage("import_highways") as stage:
+        osm_handler = OsmHighwayHandler(
+            writer, config["highway"], checkpoint)
+        osm_handler.apply_file(input_file, filters=[
+            _create_highway_filter(config["highway"])])
+        osm_handler.finalize()
+        stage.add_objects(osm_handler.num_objects)
     return osm_handler.node_ids
 
 
-class OsmHighwayHandler(SimpleHandler):
-    CACHE_SIZE = 1000
+def _import_osm_highways_with_locations(writer, config, input_file, checkpoint=None):
+    if checkpoint is not None and checkpoint.completed:
+        return
+    location_index = config.get("location_index", "flex_mem")
+    logging.info("Importing highways with node locations: [{}] (index: {})".format(
+        ", ".join(config["highway"].keys()), location_index))
+    _check_location_index(location_index)
+    with measure_stage("import_highways_with_locations") as stage:
+        osm_handler = OsmHighwayLocationHandler(
+            writer, config["highway"], checkpoint)
+        osm_handler.apply_file(input_file, locations=True, idx=location_index,
+                               filters=[_create_highway_filter(config["highway"])])
+        osm_handler.finalize()
+        stage.add_objects(osm_handler.num_objects)
+
 
-    def __init__(self, dbcon, highway_types):
+def _create_highway_filter(highway_types):
+    # Ways of other types are dropped by libosmium and never reach Python
+    return osmium.filter.TagFilter(*[("highway", highway_type) for highway_type in highway_types])
+
+
+def _create_node_filter(node_ids):
+    return osmium.filter.IdFilter(node_ids).enable_for(osmium.osm.NODE)
+
+
+def _check_location_index(location_index):
+    index_type = location_index.split(",")[0]
+    if index_type not in osmium.index.map_types():
+        raise ValueError("Unsupported location index: {} (available: {})".format(
+            index_type, ", ".join(osmium.index.map_types())))
+
+
+class OsmHighwayHandler(SimpleHandler):
+    def __init__(self, writer, highway_types, checkpoint=None, shard=0, num_shards=1):
         SimpleHandler.__init__(self)
-        self.dbcon = dbcon
+        self.writer = writer
         self.highway_types = highway_types
+        self.checkpoint = checkpoint
+        self.shard = shard
+        self.num_shards = num_shards
         self.node_ids = set()
-        self._init_cache()
-
-    def _init_cache(self):
-        self.data_cache = {
-            "size": 0,
-            "ways": [],
-            "way_node_ids": []
-        }
+        self.num_objects = 0
 
     def way(self, way):
+        self.num_objects += 1
+        if self._skip(way.id):
+            return
         highway = way.tags.get("highway", None)
         if highway in self.highway_types:
-            node_ids = self._add_way_to_cache(way, highway)
+            node_ids = self._add_way(way, highway)
             self.node_ids.update(node_ids)
-
-            if self.data_cache["size"] >= self.CACHE_SIZE:
-                self._write_cache_to_database()
+            self._add_checkpoint(way.id)
 
     def finalize(self):
-        self._write_cache_to_database()
-        self._create_indices()
+        if self.checkpoint is not None:
+            self.checkpoint.save(completed=True)
+        else:
+            self.writer.flush()
+
+    def _skip(self, way_id):
+        if way_id % self.num_shards != self.shard:
+            return True
+        return self.checkpoint is not None and self.checkpoint.skip(way_id)
+
+    def _add_checkpoint(self, object_id):
+        if self.checkpoint is not None:
+            self.checkpoint.add(copy.copy(object_id))
 
-    def _add_way_to_cache(self, way, highway_type):
+    def _add_way(self, way, highway_type):
         node_ids = [copy.copy(node.ref) for node in way.nodes]
         way_id = copy.copy(way.id)
-        self.data_cache["ways"].append((
-            way_id,
+        self.writer.write("ways", [self._get_way_row(way, highway_type)])
+        self.writer.write("way_node_ids", [(
+            way_id, index, node_id
+        ) for index, node_id in enumerate(node_ids)])
+        return node_ids
+
+    def _get_way_row(self, way, highway_type):
+        return (
+            copy.copy(way.id),
             self.highway_types[highway_type],
             self.get_tag(way.tags, "ref", None),
             self.get_tag(way.tags, "name", None),
@@ -119,27 +276,7 @@ class OsmHighwayHandler(SimpleHandler):
             self.get_maxspeed(way.tags),
             self.is_oneway(way.tags),
             self.is_tunnel(way.tags),
-        ))
-        self.data_cache["way_node_ids"].extend((
-            way_id, index, node_id
-        ) for index, node_id in enumerate(node_ids))
-        self.data_cache["size"] += 1
-        return node_ids
-
-    def _write_cache_to_database(self):
-        self.dbcon.start_transaction()
-        with self.dbcon.cursor() as cursor:
-            _write_data_to_database(cursor, "ways", self.data_cache["ways"])
-            _write_data_to_database(
-                cursor, "way_node_ids", self.data_cache["way_node_ids"])
-        self.dbcon.commit()
-        self._init_cache()
-
-    def _create_indices(self):
-        with self.dbcon.cursor() as cursor:
-            cursor.execute("CREATE INDEX way_index ON ways (way_id)")
-            cursor.execute(
-                "CREATE INDEX way_node_ids_index ON way_node_ids (way_id)")
+        )
 
     @ staticmethod
     def get_tag(tags, key, default, type_name=str):
@@ -161,185 +298,361 @@ class OsmHighwayHandler(SimpleHandler):
         return "tunnel" in tags and tags["tunnel"] == "yes"
 
 
-def _import_osm_nodes(dbcon, node_ids, input_file):
+def _import_osm_nodes(writer, node_ids, input_file, checkpoint=None):
+    if checkpoint is not None and checkpoint.completed:
+        return
     logging.info("Importing nodes")
-    osm_handler = OsmNodeHandler(dbcon, node_ids)
-    osm_handler.apply_file(input_file)
-    osm_handler.finalize()
+    with measure_stage("import_nodes") as stage:
+        osm_handler = OsmNodeHandler(writer, checkpoint)
+        osm_handler.apply_file(
+            input_file, filters=[_create_node_filter(node_ids)])
+        osm_handler.finalize()
+        stage.add_objects(osm_handler.num_objects)
 
 
 class OsmNodeHandler(SimpleHandler):
-    CACHE_SIZE = 1000
-
-    def __init__(self, dbcon, node_ids):
+    def __init__(self, writer, checkpoint=None):
         SimpleHandler.__init__(self)
-        self.dbcon = dbcon
-        self.node_ids = node_ids
-        self._init_cache()
-
-    def _init_cache(self):
-        self.data_cache = []
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.num_objects = 0
 
     def node(self, node):
-        if node.id in self.node_ids:
-            self._add_node_to_cache(node)
-            if len(self.data_cache) > self.CACHE_SIZE:
-                self._write_cache_to_database()
+        self.num_objects += 1
+        if self.checkpoint is not None and self.checkpoint.skip(node.id):
+            return
+        # the IdFilter only passes the nodes of the imported ways
+        self._add_node(node)
+        if self.checkpoint is not None:
+            self.checkpoint.add(copy.copy(node.id))
 
     def finalize(self):
-        self._write_cache_to_database()
-        self._create_indices()
+        if self.checkpoint is not None:
+            self.checkpoint.save(completed=True)
+        else:
+            self.writer.flush()
 
-    def _add_node_to_cache(self, node):
-        self.data_cache.append(
+    def _add_node(self, node):
+        self.writer.write("nodes", [
             (copy.copy(node.id), node.location.lon, node.location.lat)
-        )
-
-    def _write_cache_to_database(self):
-        self.dbcon.start_transaction()
-        with self.dbcon.cursor() as cursor:
-            cursor.executemany(
-                "INSERT INTO nodes (node_id, location) VALUES (%s, ST_SRID(POINT(%s, %s), 4326))", self.data_cache)
-        self.dbcon.commit()
-        self._init_cache()
+        ])
 
-    def _create_indices(self):
-        with self.dbcon.cursor() as cursor:
-            cursor.execute("CREATE INDEX nodes_index ON nodes (node_id)")
 
-
-def _write_data_to_database(cursor, table, data):
-    column_names = [name for name,
-                    _ in TABLE_CONFIGURATIONS[table]["columns"]]
-    cursor.executemany("INSERT INTO {table} ({columns}) VALUES ({values})".format(
-        table=table,
-        columns=",".join(column_names),
-        values=",".join(["%s"] * len(column_names))
-    ), data)
+class OsmHighwayLocationHandler(OsmHighwayHandler):
+    def way(self, way):
+        self.num_objects += 1
+        if self._skip(way.id):
+            return
+        highway = way.tags.get("highway", None)
+        if highway in self.highway_types:
+            self._add_way(way, highway)
+            self._add_way_nodes(way)
+            self._add_checkpoint(way.id)
+
+    def _add_way_nodes(self, way):
+        nodes = []
+        for node in way.nodes:
+            if node.location.valid():
+                nodes.append(
+                    (copy.copy(node.ref), node.location.lon, node.location.lat))
+            else:
+                logging.warning("Way {} references node {} without location".format(
+                    way.id, node.ref))
+        self.writer.write("nodes", nodes)
+
+
+def _import_osm_in_parallel(dbcon, config, args, num_workers):
+    # Ways are sharded by way id and nodes by node id, so every shard writes a
+    # disjoint set of rows and the result does not depend on the shard order.
+    row_counts = get_row_counts(
+        dbcon, ("ways", "way_node_ids", "nodes"))
+    way_node_ids = _run_import_shards(
+        "import_highways", _import_way_shard, num_workers, row_counts,
+        [(config, args.input_file, shard, num_workers, args.profile, args.profile_dir)
+         for shard in range(num_workers)])
+    # every way shard returns the node ids of its ways split by node shard
+    node_ids = [set() for _ in range(num_workers)]
+    for shard_node_ids in way_node_ids:
+        for node_shard, ids in enumerate(shard_node_ids):
+            node_ids[node_shard].update(ids)
+    del way_node_ids
+    _run_import_shards(
+        "import_nodes", _import_node_shard, num_workers, row_counts,
+        [(config, args.input_file, node_ids[shard], shard, num_workers, args.profile, args.profile_dir)
+         for shard in range(num_workers)])
+    verify_row_counts(dbcon, row_counts)
+
+
+def _run_import_shards(stage, function, num_workers, row_counts, shard_args):
+    logging.info("Running {} in {} shards".format(stage, num_workers))
+    with measure_stage(stage) as stage_metrics:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(function, *args) for args in shard_args]
+            results = sorted((future.result() for future in as_completed(futures)),
+                             key=lambda result: result[0])
+        for shard, num_objects, shard_row_counts, worker_metrics, _ in results:
+            logging.info("Shard {}/{}: {} objects, {}".format(
+                shard + 1, num_workers, num_objects, ", ".join(
+                    "{} {}".format(count, table) for table, count in sorted(shard_row_counts.items()))))
+            get_stage(stage + "_worker").merge(worker_metrics)
+            stage_metrics.add_objects(num_objects)
+            for table, count in shard_row_counts.items():
+                row_counts[table] += count
+    return [result for _, _, _, _, result in results]
+
+
+def _import_way_shard(config, input_file, shard, num_shards, profile_stages=(), profile_directory="."):
+    get_registry().configure_profiling(profile_stages, profile_directory)
+    highway_types = config["import"]["highway"]
+    with connect_to_database(config["mysql"], profile="import") as dbcon:
+        disable_session_checks(dbcon, config)
+        writer = create_table_writer(dbcon, config)
+        with get_registry().measure("import_highways_worker", StageMetrics("import_highways_worker")) as stage:
+            osm_handler = OsmHighwayHandler(
+                writer, highway_types, shard=shard, num_shards=num_shards)
+            osm_handler.apply_file(input_file, filters=[
+                _create_highway_filter(highway_types)])
+            osm_handler.finalize()
+            stage.add_objects(osm_handler.num_objects)
+    node_ids = [set() for _ in range(num_shards)]
+    for node_id in osm_handler.node_ids:
+        node_ids[node_id % num_shards].add(node_id)
+    return shard, osm_handler.num_objects, dict(writer.row_counts), stage.to_dict(), node_ids
+
+
+def _import_node_shard(config, input_file, node_ids, shard, num_shards, profile_stages=(), profile_directory="."):
+    get_registry().configure_profiling(profile_stages, profile_directory)
+    with connect_to_database(config["mysql"], profile="import") as dbcon:
+        disable_session_checks(dbcon, config)
+        writer = create_table_writer(dbcon, config)
+        with get_registry().measure("import_nodes_worker", StageMetrics("import_nodes_worker")) as stage:
+            osm_handler = OsmNodeHandler(writer)
+            osm_handler.apply_file(input_file, filters=[
+                _create_node_filter(node_ids)])
+            osm_handler.finalize()
+            stage.add_objects(osm_handler.num_objects)
+    return shard, osm_handler.num_objects, dict(writer.row_counts), stage.to_dict(), None
 
 
 def _aggregate_ways(dbcon, config, args):
     if args.skip_aggregation:
         return
 
-    logging.info("Aggregating way meta data")
-    way_ids = _get_way_ids(dbcon)
-    way_tasks = _split_into_chunks(way_ids, multiprocessing.cpu_count())
-    workers = _launch_aggregation_worker(config, way_tasks)
-    _wait_for_workers(workers)
-    _create_aggregation_indices(dbcon)
+    aggregation_config = config.get("aggregation", {})
+    num_workers = aggregation_config.get(
+        "workers") or multiprocessing.cpu_count()
+    batch_size = aggregation_config.get("batch_size", 500)
+    logging.info("Aggregating way meta data ({} workers, {} ways per batch)".format(
+        num_workers, batch_size))
+    tables = _get_stage_tables("aggregation")
+    with measure_stage("aggregation") as stage:
+        way_ids = _get_way_ids(dbcon)
+        if args.resume:
+            completed_ranges = get_completed_ranges(dbcon, "aggregation")
+            base_row_counts = get_base_row_counts(dbcon, "aggregation")
+            verify_row_counts(dbcon, sum_row_counts(
+                tables, completed_ranges, base_row_counts))
+            way_ids = filter_completed_ids(way_ids, completed_ranges)
+            logging.info("Resuming aggregation: {} ways in {} completed ranges, {} ways remaining".format(
+                sum(row_counts.get("way_lengths", 0) for _, _, row_counts in completed_ranges),
+                len(completed_ranges), len(way_ids)))
+        else:
+            clear_progress(dbcon, ("aggregation",))
+            base_row_counts = get_row_counts(dbcon, tables)
+            save_base_row_counts(dbcon, "aggregation", base_row_counts)
+        way_batches = list(_split_into_batches(way_ids, batch_size))
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 initializer=_init_aggregation_worker,
+                                 initargs=(config, args.aggregation_query, args.profile, args.profile_dir)) as executor:
+            futures = [executor.submit(_run_aggregation_worker, way_batch)
+                       for way_batch in way_batches]
+            _wait_for_workers(futures, len(way_ids))
+        stage.add_objects(len(way_ids))
+        verify_row_counts(dbcon, sum_row_counts(
+            tables, get_completed_ranges(dbcon, "aggregation"), base_row_counts))
+    with measure_stage("aggregation_indices"):
+        create_indices(dbcon, config, tables)
 
 
 def _get_way_ids(dbcon):
     with dbcon.cursor() as cursor:
-        cursor.execute("SELECT way_id FROM ways")
+        cursor.execute("SELECT way_id FROM ways ORDER BY way_id")
         return tuple((row[0] for row in cursor.fetchall()))
 
 
-def _split_into_chunks(data, num_chunks):
-    chunk_size = math.ceil(len(data) / num_chunks)
-    for i in range(0, len(data), chunk_size):
-        yield data[i:i+chunk_size]
+def _split_into_batches(data, batch_size):
+    for i in range(0, len(data), batch_size):
+        yield data[i:i+batch_size]
 
 
-def _launch_aggregation_worker(config, tasks):
-    logging.debug("Launching workers")
-    workers = list()
-    for task in tasks:
-        worker = WayAggregationWorker(config, task)
-        worker.start()
-        workers.append(worker)
-    return workers
+_aggregation_worker = None
 
 
-def _wait_for_workers(workers):
-    logging.debug("Waiting for workers")
-    for worker in workers:
-        worker.join()
+def _init_aggregation_worker(config, query_mode, profile_stages=(), profile_directory="."):
+    global _aggregation_worker
+    get_registry().configure_profiling(profile_stages, profile_directory)
+    # the connection is held for the lifetime of the worker process
+    _aggregation_worker = WayAggregationWorker(get_connection_pool(
+        config["mysql"], autocommit=False).get_connection("aggregation"), config, query_mode)
 
 
-class WayAggregationWorker(threading.Thread):
+def _run_aggregation_worker(way_ids):
+    return _aggregation_worker.process(way_ids)
+
+
+def _wait_for_workers(futures, num_ways):
+    logging.debug("Waiting for workers")
+    start_time = time.perf_counter()
+    processed_ways = 0
+    for idx, future in enumerate(as_completed(futures)):
+        batch_ways, batch_duration, worker_metrics = future.result()
+        get_stage("aggregation_worker").merge(worker_metrics)
+        processed_ways += batch_ways
+        duration = time.perf_counter() - start_time
+        logging.info("Aggregated batch {}/{}: {} ways in {:.2f}s, {}/{} ways total ({:.0f} ways/s)".format(
+            idx + 1, len(futures), batch_ways, batch_duration,
+            processed_ways, num_ways, processed_ways / max(duration, 1e-9)))
+
+
+class WayAggregationWorker:
+    FETCH_SIZE = 10000
     QUERY = """
         SELECT ST_LONGITUDE(nodes.location) as lon, ST_LATITUDE(nodes.location) as lat
         FROM ways
         JOIN way_node_ids ON ways.way_id = way_node_ids.way_id
         JOIN nodes ON way_node_ids.node_id = nodes.node_id
-        WHERE ways.way_id = {}
+        WHERE ways.way_id = %s
         ORDER BY ways.way_id, way_node_ids.idx
     """
+    RANGE_QUERY = """
+        SELECT way_node_ids.way_id, ST_LONGITUDE(nodes.location) as lon, ST_LATITUDE(nodes.location) as lat
+        FROM way_node_ids
+        JOIN nodes ON way_node_ids.node_id = nodes.node_id
+        WHERE way_node_ids.way_id BETWEEN %s AND %s
+        ORDER BY way_node_ids.way_id, way_node_ids.idx
+    """
+
+    def __init__(self, dbcon, config, query_mode="range"):
+        self.dbcon = dbcon
+        self.query_mode = query_mode
+        self.distance_method = config.get(
+            "aggregation", {}).get("distance_method", "ellipsoidal")
+        self._init_segment_data()
 
-    def __init__(self, config, way_ids):
-        threading.Thread.__init__(self)
-        self.config = config
-        self.way_ids = way_ids
+    def _init_segment_data(self):
         self.way_lengths = []
         self.way_segments = []
         self.way_segment_coverage = []
 
-    def run(self):
-        with connect_to_database(self.config["mysql"], autocommit=False) as dbcon:
-            for way_id in self.way_ids:
-                node_data = self._get_way_data(dbcon, way_id)
-                segments = self._compute_segments(node_data)
-                self._create_way_lengths(way_id, segments)
-                self._create_way_segments(way_id, segments)
-                self._create_way_segment_coverage(way_id, segments)
-            self._write_segment_data(dbcon)
+    def process(self, way_ids):
+        start_time = time.perf_counter()
+        with get_registry().measure("aggregation_worker", StageMetrics("aggregation_worker")) as stage:
+            self._aggregate(way_ids)
+            stage.add_objects(len(way_ids))
+            self._write_segment_data(self.dbcon)
+        return len(way_ids), time.perf_counter() - start_time, stage.to_dict()
+
+    def _aggregate(self, way_ids):
+        if self.query_mode == "range":
+            node_data = self._get_way_range_data(self.dbcon, way_ids)
+        else:
+            node_data = [self._get_way_data(self.dbcon, way_id)
+                         for way_id in way_ids]
+        segments = self._compute_segments(node_data, self.distance_method)
+        self._create_segment_data(way_ids, segments)
+
+    def _get_way_range_data(self, dbcon, way_ids):
+        node_data = {way_id: [] for way_id in way_ids}
+        cursor = execute_prepared(
+            dbcon, self.RANGE_QUERY, (way_ids[0], way_ids[-1]))
+        rows = cursor.fetchmany(self.FETCH_SIZE)
+        while rows:
+            for way_id, way_rows in groupby(rows, key=lambda row: row[0]):
+                # Ranges of resumed batches may span ways aggregated before
+                if way_id in node_data:
+                    node_data[way_id].extend(
+                        (row[2], row[1]) for row in way_rows)
+            rows = cursor.fetchmany(self.FETCH_SIZE)
+        dbcon.commit()
+        return [node_data[way_id] for way_id in way_ids]
 
     def _get_way_data(self, dbcon, way_id):
-        with dbcon.cursor() as cursor:
-            cursor.execute(self.QUERY.format(way_id))
-            node_data = [{"lon": row[0], "lat": row[1]}
-                         for row in cursor.fetchall()]
+        cursor = execute_prepared(dbcon, self.QUERY, (way_id,))
+        node_data = [(row[1], row[0]) for row in cursor.fetchall()]
         dbcon.commit()
         return node_data
 
     @ staticmethod
-    def _compute_segments(node_data):
-        def compute_distance(o, t): return distance(
-            (o["lat"], o["lon"]), (t["lat"], t["lon"])).km
-        num_segments = len(node_data) - 1
-        return [compute_distance(node_data[i], node_data[i+1])
-                for i in range(num_segments)]
-
-    def _create_way_lengths(self, way_id, segments):
+    def _compute_segments(node_data, method):
+        return compute_segment_lengths(*pack_coordinates(node_data), method)
+
+    def _create_segment_data(self, way_ids, segments):
+        way_lengths = segments.way_lengths.tolist()
+        lengths = segments.segments.tolist()
+        ratios = segments.ratios.tolist()
+        for idx, way_id in enumerate(way_ids):
+            begin, end = segments.segment_offsets[idx:idx+2]
+            self._create_way_lengths(way_id, way_lengths[idx])
+            self._create_way_segments(
+                way_id, lengths[begin:end], ratios[begin:end])
+            self._create_way_segment_coverage(way_id, end - begin)
+
+    def _create_way_lengths(self, way_id, way_length):
         self.way_lengths.append(
-            (way_id, sum(segments))
+            (way_id, way_length)
         )
 
-    def _create_way_segments(self, way_id, segments):
-        way_length = sum(segments)
-        accumulated_length = 0
-        for idx, segment in enumerate(segments):
+    def _create_way_segments(self, way_id, lengths, ratios):
+        for idx, (length, ratio) in enumerate(zip(lengths, ratios)):
             self.way_segments.append(
-                (way_id, idx, segment, accumulated_length / way_length)
+                (way_id, idx, length, ratio)
             )
-            accumulated_length += segment
 
-    def _create_way_segment_coverage(self, way_id, segments):
-        for idx, segment in enumerate(segments):
+    def _create_way_segment_coverage(self, way_id, num_segments):
+        for idx in range(num_segments):
             self.way_segment_coverage.append(
                 (way_id, idx, 0)
             )
 
     def _write_segment_data(self, dbcon):
+        start_time = time.perf_counter()
         dbcon.start_transaction()
         with dbcon.cursor() as cursor:
-            _write_data_to_database(cursor, "way_lengths", self.way_lengths)
-            _write_data_to_database(cursor, "way_segments", self.way_segments)
-            _write_data_to_database(
-                cursor, "way_segment_coverage", self.way_segment_coverage)
+            insert_rows(cursor, "way_lengths", self.way_lengths)
+            insert_rows(cursor, "way_segments", self.way_segments)
+            insert_rows(cursor, "way_segment_coverage",
+                        self.way_segment_coverage)
+            self._add_progress(cursor)
         dbcon.commit()
+        add_rows(len(self.way_lengths) + len(self.way_segments) +
+                 len(self.way_segment_coverage))
+        add_latency("commit", time.perf_counter() - start_time)
+        self._init_segment_data()
 
+    def _add_progress(self, cursor):
+        if self.way_lengths:
+            add_completed_range(cursor, "aggregation", self.way_lengths[0][0], self.way_lengths[-1][0], {
+                "way_lengths": len(self.way_lengths),
+                "way_segments": len(self.way_segments),
+                "way_segment_coverage": len(self.way_segment_coverage),
+            })
+
+
+def _verify_query_plans(dbcon):
+    logging.info("Verifying query plans")
+    if not verify_query_plans(dbcon, get_query_plan_checks()):
+        logging.warning("Query plans are not index-only, check the schema configuration")
 
-def _create_aggregation_indices(dbcon):
-    with dbcon.cursor() as cursor:
-        cursor.execute(
-            "CREATE INDEX way_lengths_index ON way_lengths (way_id)")
-        cursor.execute(
-            "CREATE INDEX way_segments_index ON way_segments (way_id, segment_id)")
-        cursor.execute(
-            "CREATE INDEX way_segment_coverage ON way_segment_coverage (way_id, segment_id)")
+
+def get_query_plan_checks():
+    return {
+        "aggregation_range": (WayAggregationWorker.RANGE_QUERY, (0, 0)),
+        "aggregation_way": (WayAggregationWorker.QUERY, (0,)),
+        # the lookup of segment_store.MySqlSegmentStore
+        "way_segments": (
+            "SELECT way_id, way_length_ratio FROM way_segments WHERE way_id IN (%s, %s) ORDER BY way_id, segment_id",
+            (0, 0)),
+    }
 
 
 if __name__ == '__main__':
@@ -356,7 +669,16 @@ if __name__ == '__main__':
                         action="store_true", default=False)
     parser.add_argument("--skip-preparation", help="Skip the preparation stage",
                         action="store_true", default=False)
+    parser.add_argument("--aggregation-query", help="Fetch node coordinates per way id range or per way",
+                        choices=["range", "per_way"], default="range")
+    parser.add_argument("--verify-query-plans", help="Check that lookup queries are served by indices",
+                        action="store_true", default=False)
+    parser.add_argument("--resume", help="Continue an interrupted import or aggregation from its last checkpoint",
+                        action="store_true", default=False)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
+    if args.resume and args.clear_database:
+        parser.error("--resume cannot be combined with --clear-database")
 
     logging.basicConfig(
         format="%(levelname)s: %(message)s", level=logging.DEBUG)
@@ -0,0 +1,303 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import threading
+import time
+
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+
+PROMETHEUS_PREFIX = "road_coverage_stage"
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.rows = 0
+        self.objects = 0
+        self.rss_start_mib = None
+        self.rss_end_mib = None
+        self.rss_delta_mib = 0.0
+        self.latencies = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add_rows(self, num_rows):
+        with self._lock:
+            self.rows += num_rows
+
+    def add_objects(self, num_objects):
+        with self._lock:
+            self.objects += num_objects
+
+    def add_latency(self, kind, latency):
+        with self._lock:
+            self.latencies[kind].append(latency)
+
+    def add_run(self, wall_time, cpu_time, rss_start_mib, rss_end_mib):
+        with self._lock:
+            self.calls += 1
+            self.wall_time += wall_time
+            self.cpu_time += cpu_time
+            if self.rss_start_mib is None:
+                self.rss_start_mib = rss_start_mib
+            self.rss_end_mib = rss_end_mib
+            self.rss_delta_mib += rss_end_mib - rss_start_mib
+
+    def merge(self, data):
+        with self._lock:
+            self.calls += data["calls"]
+            self.wall_time += data["wall_time"]
+            self.cpu_time += data["cpu_time"]
+            self.rows += data["rows"]
+            self.objects += data["objects"]
+            # merged runs come from other processes, keep the largest of them
+            for key in ("rss_start_mib", "rss_end_mib"):
+                if data[key] is not None:
+                    setattr(self, key, max(getattr(self, key) or 0.0, data[key]))
+            self.rss_delta_mib += data["rss_delta_mib"]
+            for kind, latencies in data["latencies"].items():
+                self.latencies[kind].extend(latencies)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "wall_time": self.wall_time,
+                "cpu_time": self.cpu_time,
+                "rows": self.rows,
+                "objects": self.objects,
+                "rss_start_mib": self.rss_start_mib,
+                "rss_end_mib": self.rss_end_mib,
+                "rss_delta_mib": self.rss_delta_mib,
+                "latencies": {kind: list(latencies) for kind, latencies in self.latencies.items()},
+            }
+
+    def get_summary(self):
+        data = self.to_dict()
+        wall_time = max(data["wall_time"], 1e-9)
+        summary = {key: data[key] for key in (
+            "calls", "wall_time", "cpu_time", "rows", "objects",
+            "rss_start_mib", "rss_end_mib", "rss_delta_mib")}
+        summary["rows_per_second"] = data["rows"] / wall_time
+        summary["objects_per_second"] = data["objects"] / wall_time
+        summary["latencies"] = {kind: _summarize_latencies(latencies)
+                                for kind, latencies in data["latencies"].items()}
+        return summary
+
+
+def _summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    summary = {"count": len(latencies), "sum": sum(latencies),
+               "max": latencies[-1] if latencies else 0.0}
+    for quantile in LATENCY_QUANTILES:
+        summary["p{}".format(int(quantile * 100))] = latencies[min(
+            len(latencies) - 1, int(quantile * len(latencies)))] if latencies else 0.0
+    return summary
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.profile_stages = set()
+        self.profile_directory = "."
+        self._active = threading.local()
+        self._profilers = dict()
+        self._profiling_pid = None
+        self._lock = threading.Lock()
+
+    def get_stage(self, name):
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageMetrics(name)
+            return self.stages[name]
+
+    def configure_profiling(self, stages, directory="."):
+        self._reset_inherited_profiler()
+        self.profile_stages = set(stages or ())
+        self.profile_directory = directory
+
+    @contextmanager
+    def measure(self, name, stage=None):
+        if stage is None:
+            stage = self.get_stage(name)
+        profiler = self._start_profiler(name)
+        active_stages = self._get_active_stages()
+        active_stages.append(stage)
+        try:
+            with measure(stage):
+                yield stage
+        finally:
+            active_stages.pop()
+            if profiler is not None:
+                self._stop_profiler(name, profiler)
+
+    def _get_active_stages(self):
+        if not hasattr(self._active, "stages"):
+            self._active.stages = []
+        return self._active.stages
+
+    def add_rows(self, num_rows):
+        for stage in self._get_active_stages():
+            stage.add_rows(num_rows)
+
+    def add_latency(self, kind, latency):
+        for stage in self._get_active_stages():
+            stage.add_latency(kind, latency)
+
+    def _start_profiler(self, name):
+        self._reset_inherited_profiler()
+        if self._profiling_pid is not None or not (name in self.profile_stages or "all" in self.profile_stages):
+            return None
+        self._profiling_pid = os.getpid()
+        profiler = self._profilers.setdefault(name, cProfile.Profile())
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, name, profiler):
+        profiler.disable()
+        self._profiling_pid = None
+        os.makedirs(self.profile_directory, exist_ok=True)
+        profile_file = os.path.join(
+            self.profile_directory, "{}-{}.prof".format(name, os.getpid()))
+        profiler.dump_stats(profile_file)
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats(
+            "cumulative").print_stats(20)
+        logging.debug("Profile of stage {} written to {}".format(name, profile_file))
+        logging.debug(output.getvalue())
+
+    def _reset_inherited_profiler(self):
+        # processes forked while a stage is profiled inherit its enabled profiler
+        if self._profiling_pid not in (None, os.getpid()):
+            for profiler in self._profilers.values():
+                profiler.disable()
+            self._profilers = dict()
+            self._profiling_pid = None
+
+    def get_report(self):
+        return {
+            "stages": OrderedDict((name, stage.get_summary()) for name, stage in self.stages.items()),
+            "peak_rss_mib": _get_peak_rss_mib(resource.RUSAGE_SELF),
+            "peak_rss_children_mib": _get_peak_rss_mib(resource.RUSAGE_CHILDREN),
+        }
+
+    def to_prometheus(self):
+        lines = []
+        report = self.get_report()
+        gauges = (
+            ("wall_seconds", "wall_time"), ("cpu_seconds", "cpu_time"),
+            ("rows_total", "rows"), ("rows_per_second", "rows_per_second"),
+            ("objects_total", "objects"), ("objects_per_second", "objects_per_second"),
+            ("rss_start_mib", "rss_start_mib"), ("rss_end_mib", "rss_end_mib"),
+            ("rss_delta_mib", "rss_delta_mib"),
+        )
+        for metric, key in gauges:
+            lines.append("# TYPE {}_{} gauge".format(PROMETHEUS_PREFIX, metric))
+            for name, summary in report["stages"].items():
+                if summary[key] is not None:
+                    lines.append('{}_{}{{stage="{}"}} {}'.format(
+                        PROMETHEUS_PREFIX, metric, name, summary[key]))
+        for metric in ("peak_rss_mib", "peak_rss_children_mib"):
+            lines.append("# TYPE {}_process_{} gauge".format(PROMETHEUS_PREFIX, metric))
+            lines.append("{}_process_{} {}".format(PROMETHEUS_PREFIX, metric, report[metric]))
+        lines.append("# TYPE {}_latency_seconds summary".format(PROMETHEUS_PREFIX))
+        for name, summary in report["stages"].items():
+            for kind, latencies in summary["latencies"].items():
+                labels = 'stage="{}",kind="{}"'.format(name, kind)
+                for quantile in LATENCY_QUANTILES:
+                    lines.append('{}_latency_seconds{{{},quantile="{}"}} {}'.format(
+                        PROMETHEUS_PREFIX, labels, quantile,
+                        latencies["p{}".format(int(quantile * 100))]))
+                lines.append("{}_latency_seconds_sum{{{}}} {}".format(
+                    PROMETHEUS_PREFIX, labels, latencies["sum"]))
+                lines.append("{}_latency_seconds_count{{{}}} {}".format(
+                    PROMETHEUS_PREFIX, labels, latencies["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self, json_file=None, prometheus_file=None):
+        if json_file is not None:
+            logging.info("Writing metrics report to {}".format(json_file))
+            with open(json_file, "w") as file_stream:
+                json.dump(self.get_report(), file_stream, indent=2)
+        if prometheus_file is not None:
+            logging.info("Writing Prometheus metrics to {}".format(prometheus_file))
+            with open(prometheus_file, "w") as file_stream:
+                file_stream.write(self.to_prometheus())
+
+
+@contextmanager
+def measure(stage):
+    start_wall_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    start_rss = _get_current_rss_mib()
+    try:
+        yield stage
+    finally:
+        stage.add_run(time.perf_counter() - start_wall_time,
+                      time.process_time() - start_cpu_time,
+                      start_rss, _get_current_rss_mib())
+
+
+def _get_current_rss_mib():
+    try:
+        with open("/proc/self/statm") as file_stream:
+            resident_pages = int(file_stream.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # without procfs only the lifetime peak of the process is available
+        return _get_peak_rss_mib(resource.RUSAGE_SELF)
+
+
+def _get_peak_rss_mib(who):
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    return _registry
+
+
+def measure_stage(name):
+    return _registry.measure(name)
+
+
+def get_stage(name):
+    return _registry.get_stage(name)
+
+
+def add_rows(num_rows):
+    _registry.add_rows(num_rows)
+
+
+def add_latency(kind, latency):
+    _registry.add_latency(kind, latency)
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write a JSON report of the stage metrics to this file")
+    parser.add_argument("--prometheus-file", default=None,
+                        help="Write the stage metrics in the Prometheus text format to this file")
+    parser.add_argument("--profile", metavar="STAGE", action="append", default=[],
+                        help="Profile a stage with cProfile (repeatable, 'all' for every stage)")
+    parser.add_argument("--profile-dir", default=".",
+                        help="The directory to write cProfile dumps to")
+
+
+def configure_metrics(args):
+    _registry.configure_profiling(args.profile, args.profile_dir)
+
+
+def write_metrics(args):
+    _registry.write_reports(args.metrics_file, args.prometheus_file)
@@ -1,8 +1,24 @@
 import logging
+import os
+import re
+import threading
+import time
+import weakref
 import mysql.connector
 import yaml
 
 from contextlib import contextmanager
+from functools import lru_cache
+
+
+DRIVERS = ("c_extension", "pure")
+DEFAULT_POOL_SIZE = 4
+SESSION_VARIABLE_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Pools are shared by all callers of a process, forked workers open their own
+_connection_pools = dict()
+_connection_pools_lock = threading.Lock()
+_statement_caches = weakref.WeakKeyDictionary()
 
 
 def load_configuration(config_file):
@@ -12,13 +28,196 @@ def load_configuration(config_file):
 
 
 @contextmanager
-def connect_to_database(config, autocommit=True):
-    logging.debug("Connecting to MySQL database")
-    with mysql.connector.connect(
+def connect_to_database(config, autocommit=True, profile=None):
+    with get_connection_pool(config, autocommit=autocommit).connection(profile) as dbcon:
+        yield dbcon
+
+
+def get_connection_pool(config, pool_size=None, autocommit=True):
+    key = (config["host"], config["database"], config["user"], autocommit)
+    with _connection_pools_lock:
+        connection_pool = _connection_pools.get(key)
+        if connection_pool is None or connection_pool.pid != os.getpid():
+            connection_pool = ConnectionPool(config, pool_size, autocommit)
+            _connection_pools[key] = connection_pool
+        elif pool_size is not None:
+            connection_pool.resize(pool_size)
+    return connection_pool
+
+
+def get_pool_stats():
+    with _connection_pools_lock:
+        return {connection_pool.name: connection_pool.get_stats()
+                for connection_pool in _connection_pools.values() if connection_pool.pid == os.getpid()}
+
+
+def log_pool_stats():
+    for name, stats in get_pool_stats().items():
+        logging.info("Connection pool {}: {} checkouts, {} connections, {} prepared statements, "
+                     "wait time {:.3f}s (max {:.3f}s)".format(
+                         name, stats["checkouts"], stats["connections"], stats["prepared_statements"],
+                         stats["wait_time"], stats["max_wait_time"]))
+
+
+def execute_prepared(dbcon, query, params=()):
+    statement_cache = _statement_caches.get(dbcon)
+    if statement_cache is None:
+        statement_cache = _statement_caches.setdefault(dbcon, StatementCache())
+    return statement_cache.execute(dbcon, query, params)
+
+
+class StatementCache:
+    # The connector only prepares a statement again if a cursor executes
+    # another string object, so the first string of a statement is kept.
+    def __init__(self, prepared=True):
+        self.prepared = prepared
+        self.statements = dict()
+
+    def execute(self, dbcon, query, params=()):
+        if query not in self.statements:
+            self.statements[query] = (query, dbcon.cursor(prepared=self.prepared or None))
+        query, cursor = self.statements[query]
+        cursor.execute(query, params)
+        return cursor
+
+
+class ConnectionPool:
+    def __init__(self, config, pool_size=None, autocommit=True):
+        self.name = "{}@{}{}".format(
+            config["database"], config["host"], "" if autocommit else " (transactions)")
+        self.pid = os.getpid()
+        self.pool_size = pool_size or config.get("pool_size", DEFAULT_POOL_SIZE)
+        self.session_profiles = config.get("session_profiles") or dict()
+        self.prepared_statements = config.get("prepared_statements", True)
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._connection_arguments = _get_connection_arguments(config, autocommit)
+        self._connections = []
+        self._idle_connections = []
+        self._session_variables = dict()
+        self._condition = threading.Condition()
+
+    def resize(self, pool_size):
+        with self._condition:
+            if pool_size > self.pool_size:
+                self.pool_size = pool_size
+                self._condition.notify_all()
+
+    @contextmanager
+    def connection(self, profile=None):
+        dbcon = self.get_connection(profile)
+        try:
+            yield dbcon
+        finally:
+            self.release(dbcon)
+
+    def get_connection(self, profile=None):
+        start_time = time.perf_counter()
+        with self._condition:
+            while not self._idle_connections and len(self._connections) >= self.pool_size:
+                self._condition.wait()
+            wait_time = time.perf_counter() - start_time
+            self.checkouts += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            dbcon = self._idle_connections.pop() if self._idle_connections else None
+            if dbcon is None:
+                # the slot is reserved before connecting outside of the lock
+                self._connections.append(None)
+        try:
+            if dbcon is None:
+                dbcon = self._connect()
+            elif not dbcon.is_connected():
+                logging.debug("Reconnecting pooled MySQL connection")
+                dbcon.reconnect()
+                _statement_caches[dbcon] = StatementCache(self.prepared_statements)
+            self._session_variables[id(dbcon)] = _set_session_variables(
+                dbcon, self.session_profiles.get(profile) or dict())
+        except BaseException:
+            self._discard(dbcon)
+            raise
+        return dbcon
+
+    def release(self, dbcon):
+        try:
+            if dbcon.in_transaction:
+                dbcon.rollback()
+            _set_session_variables(dbcon, self._session_variables.pop(id(dbcon), dict()))
+        except mysql.connector.Error as error:
+            logging.warning("Discarding pooled MySQL connection: {}".format(error))
+            self._discard(dbcon)
+            return
+        with self._condition:
+            self._idle_connections.append(dbcon)
+            self._condition.notify()
+
+    def get_stats(self):
+        with self._condition:
+            connections = [dbcon for dbcon in self._connections if dbcon is not None]
+            return {
+                "connections": len(connections),
+                "idle": len(self._idle_connections),
+                "checkouts": self.checkouts,
+                "wait_time": self.wait_time,
+                "max_wait_time": self.max_wait_time,
+                "prepared_statements": sum(len(_statement_caches[dbcon].statements)
+                                           for dbcon in connections if dbcon in _statement_caches),
+            }
+
+    def _connect(self):
+        logging.debug("Connecting to MySQL database")
+        dbcon = mysql.connector.connect(**self._connection_arguments)
+        _statement_caches[dbcon] = StatementCache(self.prepared_statements)
+        with self._condition:
+            self._connections[self._connections.index(None)] = dbcon
+        return dbcon
+
+    def _discard(self, dbcon):
+        self._session_variables.pop(id(dbcon), None)
+        with self._condition:
+            self._connections.remove(dbcon)
+            self._condition.notify()
+        if dbcon is not None:
+            try:
+                dbcon.close()
+            except mysql.connector.Error:
+                pass
+
+
+def _set_session_variables(dbcon, variables):
+    if not variables:
+        return dict()
+    for name in variables:
+        if not SESSION_VARIABLE_PATTERN.match(name):
+            raise ValueError("Invalid session variable: {}".format(name))
+    with dbcon.cursor() as cursor:
+        cursor.execute("SELECT {}".format(", ".join(
+            "@@SESSION.{}".format(name) for name in variables)))
+        previous_values = dict(zip(variables, cursor.fetchone()))
+        cursor.execute("SET {}".format(", ".join(
+            "SESSION {} = %s".format(name) for name in variables)), tuple(variables.values()))
+    return previous_values
+
+
+def _get_connection_arguments(config, autocommit):
+    return dict(
         host=config["host"],
         database=config["database"],
         user=config["user"],
         password=config["password"],
-        autocommit=autocommit
-    ) as dbcon:
-        yield dbcon
+        autocommit=autocommit,
+        allow_local_infile=config.get("allow_local_infile", False),
+        use_pure=_use_pure_driver(config.get("driver", "c_extension"))
+    )
+
+
+@lru_cache(maxsize=None)
+def _use_pure_driver(driver):
+    if driver not in DRIVERS:
+        raise ValueError("Unknown MySQL driver: {} (available: {})".format(
+            driver, ", ".join(DRIVERS)))
+    if driver == "c_extension" and not mysql.connector.HAVE_CEXT:
+        logging.warning("The MySQL C extension is not available, using the pure Python driver")
+        return True
+    return driver == "pure"
@@ -0,0 +1,128 @@
+import logging
+
+from contextlib import contextmanager
+
+from mysql_table_config import TABLE_CONFIGURATIONS
+
+
+# primary_keys: tables are clustered by their primary key which is created
+#               together with the table, secondary indices are built after load
+# indices:      heap tables without primary keys, all indices are built after load
+SCHEMA_MODES = ("primary_keys", "indices")
+INDEX_LOOKUP_TYPES = ("const", "eq_ref", "ref", "range")
+
+
+def get_schema_mode(config):
+    mode = config.get("schema", {}).get("mode", "indices")
+    if mode not in SCHEMA_MODES:
+        raise ValueError("Unknown schema mode: {} (available: {})".format(
+            mode, ", ".join(SCHEMA_MODES)))
+    return mode
+
+
+def create_tables(dbcon, config):
+    mode = get_schema_mode(config)
+    logging.info("Setting up tables (schema: {})".format(mode))
+    with dbcon.cursor() as cursor:
+        for table, table_config in TABLE_CONFIGURATIONS.items():
+            definitions = ["{} {}".format(name, spec)
+                           for name, spec in table_config["columns"]]
+            if mode == "primary_keys" and "primary_key" in table_config:
+                definitions.append("PRIMARY KEY ({})".format(
+                    ",".join(table_config["primary_key"])))
+            cursor.execute("CREATE TABLE IF NOT EXISTS {table} ({columns})".format(
+                table=table, columns=",".join(definitions)))
+
+
+def create_indices(dbcon, config, tables):
+    mode = get_schema_mode(config)
+    spatial_index = config.get("schema", {}).get("spatial_index", False)
+    for table in tables:
+        table_config = TABLE_CONFIGURATIONS[table]
+        for index, columns in table_config.get("indices", {}).items():
+            if mode == "primary_keys" and _is_covered_by_primary_key(table_config, columns):
+                continue
+            create_index(dbcon, table, index, columns)
+        if spatial_index:
+            for index, column in table_config.get("spatial_indices", {}).items():
+                create_index(dbcon, table, index, (column,), kind="SPATIAL ")
+
+
+def create_index(dbcon, table, index, columns, kind=""):
+    with dbcon.cursor() as cursor:
+        if _index_exists(cursor, table, index):
+            logging.debug("Index {} on {} already exists".format(index, table))
+            return
+        logging.info("Creating index {} on {} ({})".format(
+            index, table, ", ".join(columns)))
+        cursor.execute("CREATE {kind}INDEX {index} ON {table} ({columns})".format(
+            kind=kind, index=index, table=table, columns=",".join(columns)))
+
+
+def _index_exists(cursor, table, index):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        (table, index))
+    return cursor.fetchone()[0] > 0
+
+
+def _is_covered_by_primary_key(table_config, columns):
+    primary_key = table_config.get("primary_key", ())
+    return tuple(primary_key[:len(columns)]) == tuple(columns)
+
+
+def disable_session_checks(dbcon, config):
+    # Uniqueness of secondary indices must stay enforced in the indices mode
+    # because nodes are deduplicated through a unique index there.
+    with dbcon.cursor() as cursor:
+        cursor.execute("SET SESSION foreign_key_checks = 0")
+        if get_schema_mode(config) == "primary_keys":
+            cursor.execute("SET SESSION unique_checks = 0")
+
+
+@contextmanager
+def disabled_keys(dbcon, config, tables):
+    logging.debug("Disabling keys during load: [{}]".format(", ".join(tables)))
+    disable_session_checks(dbcon, config)
+    with dbcon.cursor() as cursor:
+        for table in tables:
+            cursor.execute("ALTER TABLE {} DISABLE KEYS".format(table))
+    try:
+        yield
+    finally:
+        logging.debug("Rebuilding keys: [{}]".format(", ".join(tables)))
+        with dbcon.cursor() as cursor:
+            for table in tables:
+                cursor.execute("ALTER TABLE {} ENABLE KEYS".format(table))
+            cursor.execute("SET SESSION unique_checks = 1")
+            cursor.execute("SET SESSION foreign_key_checks = 1")
+
+
+def verify_query_plans(dbcon, queries):
+    problems = get_query_plan_problems(dbcon, queries)
+    for problem in problems:
+        logging.warning("Query plan is not index-only: {}".format(problem))
+    return not problems
+
+
+def get_query_plan_problems(dbcon, queries):
+    problems = []
+    with dbcon.cursor(dictionary=True) as cursor:
+        for name, (query, params) in queries.items():
+            cursor.execute("EXPLAIN " + query, params)
+            for row in cursor.fetchall():
+                logging.debug("Query plan for {}: table={} type={} key={} extra={}".format(
+                    name, row["table"], row["type"], row["key"], row["Extra"]))
+                if not _is_index_only(row):
+                    problems.append("{} reads table {} with type={} key={} extra={}".format(
+                        name, row["table"], row["type"], row["key"], row["Extra"]))
+    return problems
+
+
+def _is_index_only(row):
+    # Rows of InnoDB tables are stored in the primary key, so a lookup through
+    # it reads no other pages, secondary indices have to cover all columns.
+    if row["key"] is None or row["type"] not in INDEX_LOOKUP_TYPES:
+        return False
+    return row["key"] == "PRIMARY" or "Using index" in (row["Extra"] or "")
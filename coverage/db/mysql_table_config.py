@@ -10,7 +10,11 @@ TABLE_CONFIGURATIONS = {
             ("maxspeed", "SMALLINT"),
             ("oneway", "BOOL"),
             ("tunnel", "BOOL"),
-        )
+        ),
+        "primary_key": ("way_id",),
+        "indices": {
+            "way_index": ("way_id",),
+        }
     },
     "way_node_ids": {
         "stage": "import",
@@ -18,21 +22,48 @@ TABLE_CONFIGURATIONS = {
             ("way_id", "BIGINT"),
             ("idx", "SMALLINT"),
             ("node_id", "BIGINT"),
-        )
+        ),
+        "primary_key": ("way_id", "idx"),
+        "indices": {
+            "way_node_ids_index": ("way_id",),
+        }
     },
     "nodes": {
         "stage": "import",
         "columns":  (
             ("node_id", "BIGINT"),
-            ("location", "POINT SRID 4326"),
-        )
+            ("location", "POINT SRID 4326 NOT NULL"),
+        ),
+        "primary_key": ("node_id",),
+        "indices": {
+            "nodes_index": ("node_id",),
+        },
+        "spatial_indices": {
+            "nodes_location_index": "location",
+        }
+    },
+    "road_versions": {
+        "stage": "import",
+        "columns": (
+            ("version_id", "INT"),
+            ("version", "CHAR(40)"),
+            ("source", "VARCHAR(255)"),
+        ),
+        "primary_key": ("version_id",),
+        "indices": {
+            "road_versions_index": ("version_id",),
+        }
     },
     "way_lengths": {
         "stage": "aggregation",
         "columns": (
             ("way_id", "BIGINT"),
             ("length", "FLOAT"),
-        )
+        ),
+        "primary_key": ("way_id",),
+        "indices": {
+            "way_lengths_index": ("way_id",),
+        }
     },
     "way_segments": {
         "stage": "aggregation",
@@ -41,7 +72,11 @@ TABLE_CONFIGURATIONS = {
             ("segment_id", "SMALLINT"),
             ("length", "FLOAT"),
             ("way_length_ratio", "FLOAT")
-        )
+        ),
+        "primary_key": ("way_id", "segment_id"),
+        "indices": {
+            "way_segments_index": ("way_id", "segment_id"),
+        }
     },
     "way_segment_coverage": {
         "stage": "aggregation",
@@ -49,14 +84,22 @@ TABLE_CONFIGURATIONS = {
             ("way_id", "BIGINT"),
             ("segment_id", "SMALLINT"),
             ("coverage", "INT"),
-        )
+        ),
+        "primary_key": ("way_id", "segment_id"),
+        "indices": {
+            "way_segment_coverage": ("way_id", "segment_id"),
+        }
     },
     "drives": {
         "stage": "preparation",
         "columns": (
             ("drive_id", "BIGINT"),
             ("drive_name", "VARCHAR(256)"),
-        )
+        ),
+        "primary_key": ("drive_id",),
+        "indices": {
+            "drives_index": ("drive_id",),
+        }
     },
     "way_segments_drive_coverage": {
         "stage": "preparation",
@@ -65,6 +108,37 @@ TABLE_CONFIGURATIONS = {
             ("segment_id", "SMALLINT"),
             ("drive_id", "BIGINT"),
             ("date", "DATE")
-        )
+        ),
+        "primary_key": ("way_id", "segment_id", "drive_id"),
+        "indices": {
+            "way_segments_drive_coverage_index": ("way_id", "segment_id"),
+            "way_segments_drive_coverage_drive_index": ("drive_id",),
+        }
+    },
+    "coverage_updates": {
+        "stage": "preparation",
+        "columns": (
+            ("update_id", "BIGINT"),
+            ("way_id", "BIGINT"),
+            ("segment_id", "SMALLINT"),
+        ),
+        "primary_key": ("update_id", "way_id", "segment_id"),
+        "indices": {
+            "coverage_updates_index": ("update_id",),
+        }
+    },
+    "pipeline_progress": {
+        "stage": "progress",
+        "columns": (
+            ("stage", "VARCHAR(32)"),
+            ("range_begin", "BIGINT"),
+            ("range_end", "BIGINT"),
+            ("row_counts", "JSON"),
+            ("completed", "BOOL"),
+        ),
+        "primary_key": ("stage", "range_begin"),
+        "indices": {
+            "pipeline_progress_index": ("stage", "range_begin"),
+        }
     }
 }
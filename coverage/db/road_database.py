@@ -0,0 +1,159 @@
+import json
+import os
+
+import numpy as np
+
+
+FORMAT_VERSION = 1
+METADATA_FILE = "metadata.json"
+
+NUMERIC_COLUMNS = (
+    "node_ids", "node_lats", "node_lons",
+    "way_ids", "way_node_offsets", "way_nodes",
+    "way_types", "way_lengths",
+    "segment_offsets", "segment_lengths", "segment_ratios",
+)
+STRING_COLUMNS = ("ref", "name", "oneway", "maxspeed", "lanes", "tunnel")
+
+
+def write_road_database(directory, node_ids, node_lats, node_lons, way_ids, way_node_offsets,
+                        way_node_ids, way_types, highway_types, lengths, attributes, distance_method,
+                        road_version=None):
+    os.makedirs(directory, exist_ok=True)
+    metadata_file = os.path.join(directory, METADATA_FILE)
+    if os.path.exists(metadata_file):
+        os.remove(metadata_file)
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    node_lats = np.asarray(node_lats, dtype=np.float64)
+    node_lons = np.asarray(node_lons, dtype=np.float64)
+    if np.any(node_ids[1:] < node_ids[:-1]):
+        node_order = np.argsort(node_ids, kind="stable")
+        node_ids, node_lats, node_lons = node_ids[node_order], node_lats[node_order], node_lons[node_order]
+    way_nodes = np.searchsorted(
+        node_ids, np.asarray(way_node_ids, dtype=np.int64))
+    if len(way_nodes) and (way_nodes.max() >= len(node_ids) or np.any(node_ids[way_nodes] != way_node_ids)):
+        raise ValueError("Ways reference nodes which are not part of the database")
+
+    columns = {
+        "node_ids": node_ids,
+        "node_lats": node_lats,
+        "node_lons": node_lons,
+        "way_ids": np.asarray(way_ids, dtype=np.int64),
+        "way_node_offsets": np.asarray(way_node_offsets, dtype=np.int64),
+        "way_nodes": way_nodes.astype(np.int64, copy=False),
+        "way_types": np.asarray(way_types, dtype=np.uint8),
+        "way_lengths": np.asarray(lengths.way_lengths, dtype=np.float64),
+        "segment_offsets": np.asarray(lengths.segment_offsets, dtype=np.int64),
+        "segment_lengths": np.asarray(lengths.segments, dtype=np.float64),
+        "segment_ratios": np.asarray(lengths.ratios, dtype=np.float64),
+    }
+    if np.any(np.diff(columns["way_ids"]) <= 0):
+        raise ValueError("Way ids must be unique and sorted in ascending order")
+    for name, values in columns.items():
+        np.save(os.path.join(directory, "{}.npy".format(name)), values)
+    for name in STRING_COLUMNS:
+        _write_string_column(directory, name, attributes[name])
+
+    # written last so that a partially written database cannot be opened
+    with open(metadata_file, "w") as file_stream:
+        json.dump({
+            "format_version": FORMAT_VERSION,
+            "num_nodes": len(node_ids),
+            "num_ways": len(columns["way_ids"]),
+            "num_segments": len(columns["segment_lengths"]),
+            "distance_method": distance_method,
+            "highway_types": list(highway_types),
+            "road_version": road_version,
+        }, file_stream, indent=2)
+
+
+def _write_string_column(directory, name, values):
+    encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    np.save(os.path.join(directory, "{}.offsets.npy".format(name)), offsets)
+    np.save(os.path.join(directory, "{}.data.npy".format(name)),
+            np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(os.path.join(directory, "{}.valid.npy".format(name)),
+            np.array([value is not None for value in values], dtype=bool))
+
+
+class RoadDatabase:
+    def __init__(self, directory):
+        self.directory = directory
+        metadata_file = os.path.join(directory, METADATA_FILE)
+        if not os.path.exists(metadata_file):
+            raise ValueError("No road database found in {}".format(directory))
+        with open(metadata_file, "r") as file_stream:
+            self.metadata = json.load(file_stream)
+        if self.metadata["format_version"] != FORMAT_VERSION:
+            raise ValueError("Unsupported road database format version {} (expected {})".format(
+                self.metadata["format_version"], FORMAT_VERSION))
+        for name in NUMERIC_COLUMNS:
+            setattr(self, name, self._load("{}.npy".format(name)))
+        self.strings = {name: tuple(self._load("{}.{}.npy".format(name, part))
+                                    for part in ("offsets", "data", "valid"))
+                        for name in STRING_COLUMNS}
+        self.highway_types = self.metadata["highway_types"]
+        self.distance_method = self.metadata["distance_method"]
+        # databases written before road versions were recorded have none
+        self.road_version = self.metadata.get("road_version")
+
+    def _load(self, file_name):
+        return np.load(os.path.join(self.directory, file_name), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.way_ids)
+
+    def __contains__(self, way_id):
+        return self.find_way(way_id) is not None
+
+    def find_way(self, way_id):
+        idx = int(np.searchsorted(self.way_ids, way_id))
+        if idx < len(self.way_ids) and self.way_ids[idx] == way_id:
+            return idx
+        return None
+
+    def get_way_index(self, way_id):
+        idx = self.find_way(way_id)
+        if idx is None:
+            raise KeyError("Way {} not found in road database".format(way_id))
+        return idx
+
+    def get_way_node_ids(self, way_id):
+        return self.node_ids[self._get_way_nodes(way_id)]
+
+    def get_way_geometry(self, way_id):
+        way_nodes = self._get_way_nodes(way_id)
+        return np.column_stack((self.node_lats[way_nodes], self.node_lons[way_nodes]))
+
+    def _get_way_nodes(self, way_id):
+        idx = self.get_way_index(way_id)
+        return self.way_nodes[self.way_node_offsets[idx]:self.way_node_offsets[idx + 1]]
+
+    def get_way_length(self, way_id):
+        return float(self.way_lengths[self.get_way_index(way_id)])
+
+    def get_way_segments(self, way_id):
+        idx = self.get_way_index(way_id)
+        begin, end = self.segment_offsets[idx:idx+2]
+        return self.segment_lengths[begin:end], self.segment_ratios[begin:end]
+
+    def get_way_attributes(self, way_id):
+        idx = self.get_way_index(way_id)
+        attributes = {name: self._get_string(name, idx)
+                      for name in STRING_COLUMNS}
+        attributes["type"] = self.highway_types[self.way_types[idx]]
+        return attributes
+
+    def get_string_column(self, name):
+        offsets, data, valid = self.strings[name]
+        data = data.tobytes()
+        return [data[begin:end].decode("utf-8") if is_valid else None
+                for begin, end, is_valid in zip(offsets[:-1].tolist(), offsets[1:].tolist(), valid.tolist())]
+
+    def _get_string(self, name, idx):
+        offsets, data, valid = self.strings[name]
+        if not valid[idx]:
+            return None
+        return data[offsets[idx]:offsets[idx + 1]].tobytes().decode("utf-8")
@@ -0,0 +1,39 @@
+import hashlib
+import logging
+import os
+
+
+VERSION_TABLE = "road_versions"
+READ_SIZE = 1 << 20
+
+
+def get_file_version(file_name, previous_version=None):
+    # The road network imported from an OSM file is identified by the digest of
+    # the file, applying a change file chains its digest to the previous version.
+    digest = hashlib.sha1()
+    if previous_version is not None:
+        digest.update(previous_version.encode("utf-8"))
+    with open(file_name, "rb") as file_stream:
+        for chunk in iter(lambda: file_stream.read(READ_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_road_version(dbcon):
+    with dbcon.cursor() as cursor:
+        cursor.execute("SELECT version FROM {} ORDER BY version_id DESC LIMIT 1".format(VERSION_TABLE))
+        row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+def save_road_version(dbcon, version, source_file, clear=False):
+    logging.info("Road network version {} ({})".format(version, source_file))
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        if clear:
+            cursor.execute("DELETE FROM {}".format(VERSION_TABLE))
+        cursor.execute("SELECT COALESCE(MAX(version_id), 0) + 1 FROM {} FOR UPDATE".format(VERSION_TABLE))
+        version_id = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO {} (version_id, version, source) VALUES (%s, %s, %s)".format(
+            VERSION_TABLE), (version_id, version, os.path.basename(source_file)[:255]))
+    dbcon.commit()
@@ -0,0 +1,172 @@
+import numpy as np
+
+from collections import namedtuple
+
+
+# WGS-84 ellipsoid
+EQUATORIAL_RADIUS = 6378.137
+FLATTENING = 1 / 298.257223563
+POLAR_RADIUS = EQUATORIAL_RADIUS * (1 - FLATTENING)
+ECCENTRICITY_SQUARED = FLATTENING * (2 - FLATTENING)
+MEAN_RADIUS = (2 * EQUATORIAL_RADIUS + POLAR_RADIUS) / 3
+
+VINCENTY_TOLERANCE = 1e-12
+VINCENTY_MAX_ITERATIONS = 200
+
+# Supported methods (all lengths in km):
+#  haversine:   spherical earth with the mean WGS-84 radius, relative error
+#               up to 0.56% compared to the ellipsoid
+#  ellipsoidal: local tangent plane with the WGS-84 radii of curvature at the
+#               mid latitude, relative error below 0.01% for segments shorter
+#               than 10 km (OSM way segments are usually far shorter)
+#  exact:       Vincenty's inverse formula on WGS-84, within 0.5 mm of the
+#               geodesic computed by geopy (Karney); does not converge for
+#               nearly antipodal points which never occur within a way
+METHODS = ("haversine", "ellipsoidal", "exact")
+
+SegmentLengths = namedtuple("SegmentLengths", [
+    "segments", "segment_offsets", "cumulative", "way_lengths", "ratios"])
+
+
+def pack_coordinates(ways_coordinates):
+    lats, lons, sizes = [], [], []
+    for coordinates in ways_coordinates:
+        sizes.append(len(coordinates))
+        for lat, lon in coordinates:
+            lats.append(lat)
+            lons.append(lon)
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    return np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64), offsets
+
+
+def compute_segment_lengths(lats, lons, offsets, method="ellipsoidal"):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    pair_lengths = _compute_distances(
+        lats[:-1], lons[:-1], lats[1:], lons[1:], method)
+    is_way_start = np.zeros(len(lats), dtype=bool)
+    is_way_start[offsets[1:-1][offsets[1:-1] < len(lats)]] = True
+    segments = pair_lengths[~is_way_start[1:]]
+
+    num_ways = len(offsets) - 1
+    segment_offsets = np.zeros(num_ways + 1, dtype=np.int64)
+    np.cumsum(np.maximum(np.diff(offsets) - 1, 0), out=segment_offsets[1:])
+    way_lengths = np.add.reduceat(
+        np.append(segments, 0), segment_offsets[:-1]) if num_ways else np.zeros(0)
+    way_lengths[segment_offsets[:-1] == segment_offsets[1:]] = 0
+
+    total_cumulative = np.append(0, np.cumsum(segments))
+    segment_way = np.repeat(np.arange(num_ways), np.diff(segment_offsets))
+    way_start_cumulative = total_cumulative[segment_offsets[:-1]][segment_way]
+    cumulative = total_cumulative[1:] - way_start_cumulative
+    # subtracting from the running sum before the segment keeps the first ratio of a way exactly 0
+    ratios = np.divide(
+        total_cumulative[:-1] - way_start_cumulative, way_lengths[segment_way],
+        out=np.zeros_like(segments), where=way_lengths[segment_way] > 0)
+    return SegmentLengths(segments, segment_offsets, cumulative, way_lengths, ratios)
+
+
+def compute_segment_lengths_in_chunks(lats, lons, offsets, method="ellipsoidal", way_nodes=None,
+                                      coordinate_precision=None, chunk_size=100000):
+    # bounds the temporary arrays of the distance computation to about chunk_size
+    # nodes, the ways are never split between chunks. With way_nodes the
+    # coordinates of the ways are gathered from the node arrays chunk by chunk,
+    # fixed-point coordinates are converted to degrees with coordinate_precision.
+    # The cumulative lengths are not part of the road database and left out.
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_ways = len(offsets) - 1
+    segment_offsets = np.zeros(num_ways + 1, dtype=np.int64)
+    np.cumsum(np.maximum(np.diff(offsets) - 1, 0), out=segment_offsets[1:])
+    result = SegmentLengths(
+        np.empty(segment_offsets[-1]), segment_offsets, None,
+        np.empty(num_ways), np.empty(segment_offsets[-1]))
+    boundaries = np.unique(np.append(np.searchsorted(
+        offsets, np.arange(0, offsets[-1], chunk_size)), num_ways))
+    for begin, end in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+        nodes = slice(offsets[begin], offsets[end])
+        if way_nodes is not None:
+            nodes = way_nodes[nodes]
+        chunk_lats, chunk_lons = lats[nodes], lons[nodes]
+        if coordinate_precision is not None:
+            chunk_lats, chunk_lons = chunk_lats / coordinate_precision, chunk_lons / coordinate_precision
+        chunk = compute_segment_lengths(
+            chunk_lats, chunk_lons, offsets[begin:end + 1] - offsets[begin], method)
+        segments = slice(segment_offsets[begin], segment_offsets[end])
+        result.segments[segments] = chunk.segments
+        result.ratios[segments] = chunk.ratios
+        result.way_lengths[begin:end] = chunk.way_lengths
+    return result
+
+
+def _compute_distances(lat1, lon1, lat2, lon2, method):
+    if method == "haversine":
+        return _haversine(lat1, lon1, lat2, lon2)
+    if method == "ellipsoidal":
+        return _ellipsoidal_approximation(lat1, lon1, lat2, lon2)
+    if method == "exact":
+        return _vincenty(lat1, lon1, lat2, lon2)
+    raise ValueError("Unknown distance method: {} (available: {})".format(
+        method, ", ".join(METHODS)))
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * MEAN_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def _ellipsoidal_approximation(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    mid_lat = (lat1 + lat2) / 2
+    w = 1 - ECCENTRICITY_SQUARED * np.sin(mid_lat) ** 2
+    meridional_radius = EQUATORIAL_RADIUS * \
+        (1 - ECCENTRICITY_SQUARED) / w ** 1.5
+    normal_radius = EQUATORIAL_RADIUS / np.sqrt(w)
+    delta_lon = np.remainder(lon2 - lon1 + np.pi, 2 * np.pi) - np.pi
+    return np.hypot(meridional_radius * (lat2 - lat1),
+                    normal_radius * np.cos(mid_lat) * delta_lon)
+
+
+def _vincenty(lat1, lon1, lat2, lon2):
+    f = FLATTENING
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    delta_lon = np.radians(lon2 - lon1)
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lam = delta_lon.copy()
+    for _ in range(VINCENTY_MAX_ITERATIONS):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cos_u2 * sin_lam,
+                             cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = np.divide(cos_u1 * cos_u2 * sin_lam, sin_sigma,
+                              out=np.zeros_like(sin_sigma), where=sin_sigma > 0)
+        cos2_alpha = 1 - sin_alpha ** 2
+        cos_2sigma_m = np.divide(2 * sin_u1 * sin_u2, cos2_alpha,
+                                 out=np.zeros_like(cos2_alpha), where=cos2_alpha > 0)
+        cos_2sigma_m = cos_sigma - cos_2sigma_m
+        c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        next_lam = delta_lon + (1 - c) * f * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        active = np.abs(next_lam - lam) > VINCENTY_TOLERANCE
+        lam = next_lam
+        if not active.any():
+            break
+
+    b = POLAR_RADIUS
+    u_squared = cos2_alpha * (EQUATORIAL_RADIUS ** 2 - b ** 2) / b ** 2
+    a_coef = 1 + u_squared / 16384 * \
+        (4096 + u_squared * (-768 + u_squared * (320 - 175 * u_squared)))
+    b_coef = u_squared / 1024 * \
+        (256 + u_squared * (-128 + u_squared * (74 - 47 * u_squared)))
+    delta_sigma = b_coef * sin_sigma * (cos_2sigma_m + b_coef / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - b_coef / 6 * cos_2sigma_m *
+        (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return b * a_coef * (sigma - delta_sigma)
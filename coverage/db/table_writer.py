@@ -0,0 +1,135 @@
+import logging
+import os
+import tempfile
+import time
+
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from metrics import add_latency, add_rows
+from mysql_table_config import TABLE_CONFIGURATIONS
+
+
+def create_table_writer(dbcon, config, ignore_duplicates=()):
+    writer_config = config.get("writer", {})
+    backend = writer_config.get("backend", "executemany")
+    logging.debug("Using table writer backend: {}".format(backend))
+    if backend == "executemany":
+        return ExecuteManyTableWriter(dbcon, writer_config, ignore_duplicates)
+    if backend == "load_data":
+        return LoadDataTableWriter(dbcon, writer_config, ignore_duplicates)
+    raise ValueError("Unknown table writer backend: {}".format(backend))
+
+
+class TableWriter(ABC):
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self, dbcon, config, ignore_duplicates=()):
+        self.dbcon = dbcon
+        self.batch_sizes = config.get("batch_size", {})
+        self.ignore_duplicates = set(ignore_duplicates)
+        self.rows = defaultdict(list)
+        self.row_counts = defaultdict(int)
+
+    def write(self, table, rows):
+        self.rows[table].extend(rows)
+        if len(self.rows[table]) >= self.batch_sizes.get(table, self.DEFAULT_BATCH_SIZE):
+            self.flush(table)
+
+    def flush(self, table=None):
+        tables = [table] if table else list(self.rows.keys())
+        for table in tables:
+            if self.rows[table]:
+                start_time = time.perf_counter()
+                self.dbcon.start_transaction()
+                self._write_rows(table, self.rows[table])
+                self.dbcon.commit()
+                if table not in self.ignore_duplicates:
+                    self.row_counts[table] += len(self.rows[table])
+                add_rows(len(self.rows[table]))
+                add_latency("commit", time.perf_counter() - start_time)
+                self.rows[table] = []
+
+    @ abstractmethod
+    def _write_rows(self, table, rows):
+        pass
+
+
+class ExecuteManyTableWriter(TableWriter):
+    def _write_rows(self, table, rows):
+        with self.dbcon.cursor() as cursor:
+            insert_rows(cursor, table, rows, table in self.ignore_duplicates)
+
+
+class LoadDataTableWriter(TableWriter):
+    def __init__(self, dbcon, config, ignore_duplicates=()):
+        TableWriter.__init__(self, dbcon, config, ignore_duplicates)
+        self.spool_directory = config.get("spool_directory", None)
+
+    def _write_rows(self, table, rows):
+        file_descriptor, spool_file = tempfile.mkstemp(
+            prefix="{}_".format(table), suffix=".tsv", dir=self.spool_directory)
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8", newline="\n") as file_stream:
+                for row in rows:
+                    file_stream.write(
+                        "\t".join([_to_tsv_field(value) for value in row]))
+                    file_stream.write("\n")
+            with self.dbcon.cursor() as cursor:
+                cursor.execute(self._get_load_statement(table, spool_file))
+        finally:
+            os.remove(spool_file)
+
+    def _get_load_statement(self, table, spool_file):
+        columns, assignments = [], []
+        for name, spec in TABLE_CONFIGURATIONS[table]["columns"]:
+            if _is_point_column(spec):
+                columns.extend(["@{}_lon".format(name), "@{}_lat".format(name)])
+                assignments.append("{name} = ST_SRID(POINT(@{name}_lon, @{name}_lat), {srid})".format(
+                    name=name, srid=_get_srid(spec)))
+            else:
+                columns.append(name)
+        return ("LOAD DATA LOCAL INFILE '{file}' {ignore}INTO TABLE {table} "
+                "CHARACTER SET utf8mb4 "
+                "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+                "({columns}){assignments}").format(
+            file=spool_file.replace("\\", "\\\\").replace("'", "\\'"),
+            ignore="IGNORE " if table in self.ignore_duplicates else "",
+            table=table,
+            columns=",".join(columns),
+            assignments=" SET " + ",".join(assignments) if assignments else "")
+
+
+def insert_rows(cursor, table, rows, ignore_duplicates=False):
+    columns = TABLE_CONFIGURATIONS[table]["columns"]
+    cursor.executemany("INSERT {ignore}INTO {table} ({columns}) VALUES ({values})".format(
+        ignore="IGNORE " if ignore_duplicates else "",
+        table=table,
+        columns=",".join([name for name, _ in columns]),
+        values=",".join([_get_value_placeholder(spec) for _, spec in columns])
+    ), rows)
+
+
+def _is_point_column(spec):
+    return spec.startswith("POINT")
+
+
+def _get_srid(spec):
+    tokens = spec.split()
+    return int(tokens[tokens.index("SRID") + 1]) if "SRID" in tokens else 0
+
+
+def _get_value_placeholder(spec):
+    if _is_point_column(spec):
+        return "ST_SRID(POINT(%s, %s), {})".format(_get_srid(spec))
+    return "%s"
+
+
+def _to_tsv_field(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
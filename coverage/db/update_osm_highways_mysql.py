@@ -0,0 +1,290 @@
+#! /usr/bin/env python
+
+import argparse
+import copy
+import logging
+
+from osmium import SimpleHandler
+
+from import_osm_highways_mysql import OsmHighwayHandler, WayAggregationWorker
+from mysql_connection import connect_to_database, load_configuration, log_pool_stats
+from mysql_schema import create_tables
+from road_version import get_file_version, get_road_version, save_road_version
+from table_writer import insert_rows
+
+
+CHUNK_SIZE = 1000
+
+
+def main(args):
+    config = load_configuration(args.config_file)
+    with connect_to_database(config["mysql"], profile="update") as dbcon:
+        create_tables(dbcon, config)
+        for change_file in args.change_files:
+            _apply_change_file(dbcon, config, change_file, args)
+    log_pool_stats()
+
+
+def _apply_change_file(dbcon, config, change_file, args):
+    logging.info("Applying OSM change file: {}".format(change_file))
+    changes = _read_changes(config["import"], change_file)
+    # recorded first, so the coverage service sees the new version before any changed segment
+    save_road_version(dbcon, get_file_version(
+        change_file, get_road_version(dbcon)), change_file)
+    removed_way_ids, changed_way_ids, old_node_ids = _update_ways(
+        dbcon, changes)
+    moved_node_ids = _update_nodes(
+        dbcon, changes, old_node_ids, args.locations_file)
+    affected_way_ids = changed_way_ids | _get_ways_of_nodes(
+        dbcon, moved_node_ids)
+    old_segments = _get_coverage_segments(dbcon, removed_way_ids | affected_way_ids)
+    _remove_way_aggregates(dbcon, removed_way_ids)
+    _update_way_aggregates(dbcon, config, sorted(affected_way_ids))
+    _add_coverage_updates(dbcon, old_segments, affected_way_ids)
+
+
+def _read_changes(config, change_file):
+    handler = OsmChangeHandler(config["highway"])
+    handler.apply_file(change_file)
+    logging.info("Read {} changed ways and {} changed nodes".format(
+        len(handler.ways), len(handler.nodes)))
+    return handler
+
+
+class OsmChangeHandler(OsmHighwayHandler):
+    def __init__(self, highway_types):
+        OsmHighwayHandler.__init__(self, None, highway_types)
+        self.ways = dict()
+        self.nodes = dict()
+
+    def node(self, node):
+        if node.deleted or not node.location.valid():
+            self.nodes[node.id] = None
+        else:
+            self.nodes[node.id] = (node.location.lon, node.location.lat)
+
+    def way(self, way):
+        highway = way.tags.get("highway", None)
+        if not way.deleted and highway in self.highway_types:
+            self.ways[way.id] = (
+                self._get_way_row(way, highway),
+                [copy.copy(node.ref) for node in way.nodes]
+            )
+        else:
+            self.ways[way.id] = None
+
+
+def _update_ways(dbcon, changes):
+    existing_way_ids = _select_ids(
+        dbcon, "SELECT way_id FROM ways WHERE way_id IN ({})", changes.ways.keys())
+    changed_ways = {way_id: way for way_id,
+                    way in changes.ways.items() if way is not None}
+    removed_way_ids = existing_way_ids - changed_ways.keys()
+    logging.info("Updating ways: {} removed, {} modified, {} created".format(
+        len(removed_way_ids), len(existing_way_ids & changed_ways.keys()),
+        len(changed_ways.keys() - existing_way_ids)))
+
+    old_node_ids = _select_ids(
+        dbcon, "SELECT node_id FROM way_node_ids WHERE way_id IN ({})", existing_way_ids)
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        for table in ("ways", "way_node_ids"):
+            _delete_ids(cursor, table, "way_id", existing_way_ids)
+        insert_rows(cursor, "ways", [way for way, _ in changed_ways.values()])
+        insert_rows(cursor, "way_node_ids", [
+            (way_id, idx, node_id)
+            for way_id, (_, node_ids) in changed_ways.items()
+            for idx, node_id in enumerate(node_ids)])
+    dbcon.commit()
+    return removed_way_ids, set(changed_ways.keys()), old_node_ids
+
+
+def _update_nodes(dbcon, changes, old_node_ids, locations_file):
+    existing_node_ids = _select_ids(
+        dbcon, "SELECT node_id FROM nodes WHERE node_id IN ({})", changes.nodes.keys())
+    moved_nodes = [(lon, lat, node_id) for node_id, location in changes.nodes.items()
+                   if node_id in existing_node_ids and location is not None]
+    deleted_node_ids = {node_id for node_id, location in changes.nodes.items()
+                        if node_id in existing_node_ids and location is None}
+    logging.info("Updating nodes: {} moved, {} deleted".format(
+        len(moved_nodes), len(deleted_node_ids)))
+
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        cursor.executemany(
+            "UPDATE nodes SET location = ST_SRID(POINT(%s, %s), 4326) WHERE node_id = %s", moved_nodes)
+        _delete_ids(cursor, "nodes", "node_id", deleted_node_ids)
+    dbcon.commit()
+
+    _insert_missing_nodes(dbcon, changes, locations_file)
+    _delete_orphaned_nodes(dbcon, old_node_ids)
+    return {node_id for _, _, node_id in moved_nodes}
+
+
+def _insert_missing_nodes(dbcon, changes, locations_file):
+    referenced_node_ids = {node_id for way in changes.ways.values() if way is not None
+                           for node_id in way[1]}
+    missing_node_ids = referenced_node_ids - _select_ids(
+        dbcon, "SELECT node_id FROM nodes WHERE node_id IN ({})", referenced_node_ids)
+    nodes = {node_id: changes.nodes[node_id] for node_id in missing_node_ids
+             if changes.nodes.get(node_id) is not None}
+    unresolved_node_ids = missing_node_ids - nodes.keys()
+    if unresolved_node_ids and locations_file:
+        logging.info("Resolving {} node locations from {}".format(
+            len(unresolved_node_ids), locations_file))
+        handler = OsmNodeLocationHandler(unresolved_node_ids)
+        handler.apply_file(locations_file)
+        nodes.update(handler.nodes)
+        unresolved_node_ids -= handler.nodes.keys()
+    if unresolved_node_ids:
+        logging.warning("No location for {} referenced nodes (use --locations-file)".format(
+            len(unresolved_node_ids)))
+
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        insert_rows(cursor, "nodes", [(node_id, lon, lat)
+                    for node_id, (lon, lat) in nodes.items()])
+    dbcon.commit()
+
+
+class OsmNodeLocationHandler(SimpleHandler):
+    def __init__(self, node_ids):
+        SimpleHandler.__init__(self)
+        self.node_ids = node_ids
+        self.nodes = dict()
+
+    def node(self, node):
+        if node.id in self.node_ids:
+            self.nodes[node.id] = (node.location.lon, node.location.lat)
+
+
+def _delete_orphaned_nodes(dbcon, node_ids):
+    referenced_node_ids = _select_ids(
+        dbcon, "SELECT node_id FROM way_node_ids WHERE node_id IN ({})", node_ids)
+    orphaned_node_ids = set(node_ids) - referenced_node_ids
+    logging.debug("Deleting {} orphaned nodes".format(len(orphaned_node_ids)))
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        _delete_ids(cursor, "nodes", "node_id", orphaned_node_ids)
+    dbcon.commit()
+
+
+def _get_ways_of_nodes(dbcon, node_ids):
+    return _select_ids(
+        dbcon, "SELECT DISTINCT way_id FROM way_node_ids WHERE node_id IN ({})", node_ids)
+
+
+def _remove_way_aggregates(dbcon, way_ids):
+    logging.info("Removing aggregates of {} ways".format(len(way_ids)))
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        for table in ("way_lengths", "way_segments", "way_segment_coverage", "way_segments_drive_coverage"):
+            _delete_ids(cursor, table, "way_id", way_ids)
+    dbcon.commit()
+
+
+def _get_coverage_segments(dbcon, way_ids):
+    segments = set()
+    with dbcon.cursor() as cursor:
+        for chunk in _split_into_chunks(list(way_ids), CHUNK_SIZE):
+            cursor.execute("SELECT way_id, segment_id FROM way_segment_coverage WHERE way_id IN ({})".format(
+                ",".join(["%s"] * len(chunk))), chunk)
+            segments.update(tuple(row) for row in cursor.fetchall())
+    return segments
+
+
+def _add_coverage_updates(dbcon, old_segments, way_ids):
+    # the coverage service reloads the removed, re-segmented and new segments
+    segments = old_segments | _get_coverage_segments(dbcon, way_ids)
+    logging.info("Recording coverage updates of {} segments".format(len(segments)))
+    if not segments:
+        return
+    dbcon.start_transaction()
+    with dbcon.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(update_id), 0) + 1 FROM coverage_updates FOR UPDATE")
+        update_id = cursor.fetchone()[0]
+        insert_rows(cursor, "coverage_updates", [
+            (update_id, way_id, segment_id) for way_id, segment_id in sorted(segments)])
+    dbcon.commit()
+
+
+def _update_way_aggregates(dbcon, config, way_ids):
+    logging.info("Recomputing aggregates of {} ways".format(len(way_ids)))
+    worker = WayUpdateWorker(dbcon, config)
+    for chunk in _split_into_chunks(way_ids, CHUNK_SIZE):
+        worker.process(chunk)
+
+
+class WayUpdateWorker(WayAggregationWorker):
+    def __init__(self, dbcon, config):
+        WayAggregationWorker.__init__(self, dbcon, config, query_mode="per_way")
+
+    def _write_segment_data(self, dbcon):
+        way_ids = [way_id for way_id, _ in self.way_lengths]
+        num_segments = {way_id: 0 for way_id in way_ids}
+        for way_id, _, _ in self.way_segment_coverage:
+            num_segments[way_id] += 1
+
+        dbcon.start_transaction()
+        with dbcon.cursor() as cursor:
+            for table in ("way_lengths", "way_segments"):
+                _delete_ids(cursor, table, "way_id", way_ids)
+            insert_rows(cursor, "way_lengths", self.way_lengths)
+            insert_rows(cursor, "way_segments", self.way_segments)
+            for table in ("way_segment_coverage", "way_segments_drive_coverage"):
+                cursor.executemany(
+                    "DELETE FROM {} WHERE way_id = %s AND segment_id >= %s".format(
+                        table),
+                    list(num_segments.items()))
+            existing_segments = self._get_existing_coverage(cursor, way_ids)
+            insert_rows(cursor, "way_segment_coverage", [
+                (way_id, idx, 0) for way_id, idx, _ in self.way_segment_coverage
+                if (way_id, idx) not in existing_segments])
+        dbcon.commit()
+        self._init_segment_data()
+
+    @ staticmethod
+    def _get_existing_coverage(cursor, way_ids):
+        existing_segments = set()
+        for chunk in _split_into_chunks(way_ids, CHUNK_SIZE):
+            cursor.execute("SELECT way_id, segment_id FROM way_segment_coverage WHERE way_id IN ({})".format(
+                ",".join(["%s"] * len(chunk))), chunk)
+            existing_segments.update(tuple(row) for row in cursor.fetchall())
+        return existing_segments
+
+
+def _select_ids(dbcon, query, ids):
+    result = set()
+    with dbcon.cursor() as cursor:
+        for chunk in _split_into_chunks(list(ids), CHUNK_SIZE):
+            cursor.execute(query.format(
+                ",".join(["%s"] * len(chunk))), chunk)
+            result.update(row[0] for row in cursor.fetchall())
+    return result
+
+
+def _delete_ids(cursor, table, column, ids):
+    for chunk in _split_into_chunks(list(ids), CHUNK_SIZE):
+        cursor.execute("DELETE FROM {table} WHERE {column} IN ({values})".format(
+            table=table, column=column, values=",".join(["%s"] * len(chunk))), chunk)
+
+
+def _split_into_chunks(data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i+chunk_size]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Motorway Database Updater")
+    parser.add_argument("config_file", metavar="CONFIG_FILE",
+                        help="The import configuration")
+    parser.add_argument("change_files", metavar="OSC_FILE", nargs="+",
+                        help="The OSM change files (.osc/.osc.gz) in the order to apply")
+    parser.add_argument("--locations-file", metavar="OSM_FILE", default=None,
+                        help="An OSM file to resolve the locations of unchanged nodes newly referenced by highways")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    main(args)
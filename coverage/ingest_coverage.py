@@ -0,0 +1,213 @@
+#! /usr/bin/env python
+
+import argparse
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+import time
+
+from collections import Counter
+
+from db.mysql_connection import connect_to_database, load_configuration, log_pool_stats
+from segment_store import open_segment_store
+from way_segments import map_match_result_to_osm_way_segments
+
+
+CHUNK_SIZE = 1000
+
+STAGING_TABLE = "way_segment_coverage_staging"
+
+
+class CoverageIngester:
+    def __init__(self, dbcon, segment_store, replace=False):
+        self.dbcon = dbcon
+        self.segment_store = segment_store
+        self.replace = replace
+        self.num_ingested = 0
+        self.num_skipped = 0
+        self.num_segments = 0
+
+    def ingest(self, drives):
+        drives = self._get_drive_segments(drives)
+        self.dbcon.start_transaction()
+        with self.dbcon.cursor() as cursor:
+            existing_drive_ids = _get_existing_drive_ids(
+                cursor, list(drives.keys()))
+            if not self.replace:
+                for drive_id in existing_drive_ids:
+                    logging.debug("Skipping already ingested drive {}".format(drive_id))
+                    drives.pop(drive_id)
+                self.num_skipped += len(existing_drive_ids)
+            if drives:
+                update_id = _get_next_update_id(cursor)
+                if self.replace:
+                    _remove_drives(cursor, existing_drive_ids, update_id)
+                self._write_drives(cursor, drives, update_id)
+        self.dbcon.commit()
+        self.num_ingested += len(drives)
+
+    def _get_drive_segments(self, drives):
+        drive_segments = dict()
+        for drive_id, drive_name, date, match_result in drives:
+            travelled_segments = map_match_result_to_osm_way_segments(
+                self.segment_store, match_result) or []
+            drive_segments[drive_id] = (drive_name, date, {
+                (way_id, segment_id) for trace in travelled_segments
+                for way_id, segment_id in trace if way_id is not None and segment_id >= 0})
+        return drive_segments
+
+    def _write_drives(self, cursor, drives, update_id):
+        cursor.executemany("INSERT INTO drives (drive_id, drive_name) VALUES (%s, %s)", [
+            (drive_id, drive_name) for drive_id, (drive_name, _, _) in drives.items()])
+        drive_coverage = [(way_id, segment_id, drive_id, date)
+                          for drive_id, (_, date, segments) in drives.items()
+                          for way_id, segment_id in segments]
+        for chunk in _split_into_chunks(drive_coverage, CHUNK_SIZE):
+            cursor.executemany(
+                "INSERT INTO way_segments_drive_coverage (way_id, segment_id, drive_id, date) VALUES (%s, %s, %s, %s)", chunk)
+        hits = Counter((way_id, segment_id)
+                       for _, _, segments in drives.values() for way_id, segment_id in segments)
+        self._update_coverage(cursor, hits, update_id)
+        self.num_segments += len(drive_coverage)
+
+    @ staticmethod
+    def _update_coverage(cursor, hits, update_id):
+        cursor.execute(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS {} (way_id BIGINT, segment_id SMALLINT, hits INT, "
+            "PRIMARY KEY (way_id, segment_id))".format(STAGING_TABLE))
+        cursor.execute("DELETE FROM {}".format(STAGING_TABLE))
+        for chunk in _split_into_chunks([key + (count,) for key, count in hits.items()], CHUNK_SIZE):
+            cursor.executemany(
+                "INSERT INTO {} (way_id, segment_id, hits) VALUES (%s, %s, %s)".format(STAGING_TABLE), chunk)
+        cursor.execute("""
+            UPDATE way_segment_coverage
+            JOIN {} AS staging
+                ON way_segment_coverage.way_id = staging.way_id AND way_segment_coverage.segment_id = staging.segment_id
+            SET way_segment_coverage.coverage = way_segment_coverage.coverage + staging.hits
+        """.format(STAGING_TABLE))
+        if cursor.rowcount < len(hits):
+            logging.warning("{} travelled segments have no coverage row, aggregate the ways first".format(
+                len(hits) - cursor.rowcount))
+        # the coverage service reloads the segments of new updates and invalidates their tiles
+        cursor.execute(
+            "INSERT IGNORE INTO coverage_updates (update_id, way_id, segment_id) "
+            "SELECT %s, way_id, segment_id FROM {}".format(STAGING_TABLE), (update_id,))
+
+    def get_stats(self):
+        return {"ingested": self.num_ingested, "skipped": self.num_skipped, "segments": self.num_segments}
+
+
+def _get_existing_drive_ids(cursor, drive_ids):
+    existing_drive_ids = set()
+    for chunk in _split_into_chunks(drive_ids, CHUNK_SIZE):
+        cursor.execute("SELECT drive_id FROM drives WHERE drive_id IN ({}) FOR UPDATE".format(
+            ",".join(["%s"] * len(chunk))), chunk)
+        existing_drive_ids.update(row[0] for row in cursor.fetchall())
+    return existing_drive_ids
+
+
+def _get_next_update_id(cursor):
+    # the locking read serializes concurrent ingests, so update ids are committed in ascending order
+    cursor.execute("SELECT COALESCE(MAX(update_id), 0) + 1 FROM coverage_updates FOR UPDATE")
+    return cursor.fetchone()[0]
+
+
+def _remove_drives(cursor, drive_ids, update_id):
+    for chunk in _split_into_chunks(list(drive_ids), CHUNK_SIZE):
+        logging.debug("Removing coverage of {} drives".format(len(chunk)))
+        placeholders = ",".join(["%s"] * len(chunk))
+        cursor.execute(
+            "INSERT IGNORE INTO coverage_updates (update_id, way_id, segment_id) "
+            "SELECT DISTINCT %s, way_id, segment_id FROM way_segments_drive_coverage "
+            "WHERE drive_id IN ({})".format(placeholders), [update_id] + chunk)
+        cursor.execute("""
+            UPDATE way_segment_coverage
+            JOIN (
+                SELECT way_id, segment_id, COUNT(*) AS hits FROM way_segments_drive_coverage
+                WHERE drive_id IN ({}) GROUP BY way_id, segment_id
+            ) AS drive_hits
+                ON way_segment_coverage.way_id = drive_hits.way_id AND way_segment_coverage.segment_id = drive_hits.segment_id
+            SET way_segment_coverage.coverage = way_segment_coverage.coverage - drive_hits.hits
+        """.format(placeholders), chunk)
+        cursor.execute("DELETE FROM way_segments_drive_coverage WHERE drive_id IN ({})".format(
+            placeholders), chunk)
+        cursor.execute("DELETE FROM drives WHERE drive_id IN ({})".format(
+            placeholders), chunk)
+
+
+def _split_into_chunks(data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i+chunk_size]
+
+
+def get_drive_id(drive_name):
+    if drive_name.isdigit():
+        return int(drive_name)
+    return int(hashlib.sha1(drive_name.encode("utf-8")).hexdigest()[:15], 16)
+
+
+def read_drives(match_files, date):
+    for match_file in match_files:
+        drive_name = os.path.splitext(os.path.basename(match_file))[0]
+        with open(match_file, "rb") as file_stream:
+            match_result = pickle.load(file_stream)
+        yield get_drive_id(drive_name), drive_name, date, match_result
+
+
+def ingest_drives(ingester, drives, batch_size):
+    start_time = time.perf_counter()
+    batch = []
+    for drive in drives:
+        batch.append(drive)
+        if len(batch) >= batch_size:
+            ingester.ingest(batch)
+            batch = []
+    if batch:
+        ingester.ingest(batch)
+    duration = time.perf_counter() - start_time
+    stats = ingester.get_stats()
+    logging.info("Ingested {} drives ({} skipped, {} drive segments) in {:.1f}s ({:.1f} drives/s)".format(
+        stats["ingested"], stats["skipped"], stats["segments"], duration,
+        (stats["ingested"] + stats["skipped"]) / max(duration, 1e-9)))
+    return stats
+
+
+def _get_drive_files(inputs):
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            yield from sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                              if name.endswith(".pickle"))
+        else:
+            yield input_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive Coverage Ingest")
+    parser.add_argument("config_file", metavar="CONFIG_FILE",
+                        help="The MySQL configuration")
+    parser.add_argument("inputs", metavar="MATCH_FILE", nargs="+",
+                        help="Pickled match results or directories of them, one per drive (file name: drive name)")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, default=datetime.date.today(),
+                        help="The date of the drives (YYYY-MM-DD, default: today)")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="The number of drives applied per transaction")
+    parser.add_argument("--road-database", default=None,
+                        help="Look up way segments in this road database instead of MySQL")
+    parser.add_argument("--segment-cache-size", type=int, default=100000,
+                        help="The number of ways kept in the segment cache (0: no cache)")
+    parser.add_argument("--replace", help="Replace the coverage of drives which are already ingested",
+                        action="store_true", default=False)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    config = load_configuration(args.config_file)
+    backend, source = ("local", args.road_database) if args.road_database \
+        else ("mysql", args.config_file)
+    with connect_to_database(config["mysql"], profile="ingest") as dbcon, \
+            open_segment_store(backend, source, args.segment_cache_size) as segment_store:
+        ingester = CoverageIngester(dbcon, segment_store, args.replace)
+        ingest_drives(ingester, read_drives(
+            _get_drive_files(args.inputs), args.date), args.batch_size)
+    log_pool_stats()
@@ -1,6 +1,11 @@
 #! /usr/bin/env python
 
+import bz2
+import gzip
 import xml.etree.ElementTree as xml
+
+import numpy as np
+import osmium
 import shapely.wkt as wkt
 
 
@@ -17,14 +22,103 @@ def read_trajectory_from_wkt(wkt_string):
 
 
 def read_trajectory_from_osm(osm_file, way_id):
-    root = xml.parse(osm_file).getroot()
-    way = root.find(".//way[@id='{}']".format(way_id))
-    trajectory = list()
-    for nd in way:
-        node_id = nd.attrib.get("ref")
-        node = root.find(".//node[@id='{}']".format(node_id)) 
-        trajectory.append({
-            "lat": float(node.attrib.get("lat")),
-            "lon": float(node.attrib.get("lon"))
-        })
-    return trajectory
+    ways = read_ways_from_osm(osm_file, [way_id])
+    if way_id not in ways:
+        raise ValueError("Way {} not found in {}".format(way_id, osm_file))
+    return [{"lat": lat, "lon": lon} for lat, lon in ways[way_id].tolist()]
+
+
+def iter_trajectories_from_osm(osm_file, way_ids):
+    for way_id, coordinates in read_ways_from_osm(osm_file, way_ids).items():
+        yield way_id, ({"lat": lat, "lon": lon} for lat, lon in coordinates.tolist())
+
+
+def read_ways_from_osm(osm_file, way_ids):
+    way_ids = set(int(way_id) for way_id in way_ids)
+    if osm_file.endswith(".pbf"):
+        way_nodes, node_locations = _read_ways_with_osmium(osm_file, way_ids)
+    else:
+        way_nodes = _read_way_nodes_from_xml(osm_file, way_ids)
+        node_locations = _read_node_locations_from_xml(
+            osm_file, {node_id for node_ids in way_nodes.values() for node_id in node_ids})
+    return {
+        way_id: np.array([node_locations[node_id] for node_id in node_ids
+                          if node_id in node_locations], dtype=np.float64).reshape(-1, 2)
+        for way_id, node_ids in way_nodes.items()
+    }
+
+
+def _open_osm_file(osm_file):
+    if osm_file.endswith(".gz"):
+        return gzip.open(osm_file, "rb")
+    if osm_file.endswith(".bz2"):
+        return bz2.open(osm_file, "rb")
+    return open(osm_file, "rb")
+
+
+def _iter_elements(osm_file, tag):
+    with _open_osm_file(osm_file) as file_stream:
+        root = None
+        for event, element in xml.iterparse(file_stream, events=("start", "end")):
+            if root is None:
+                root = element
+            if event != "end":
+                continue
+            if element.tag == tag:
+                yield element
+            if element.tag in ("node", "way", "relation"):
+                root.clear()
+
+
+def _read_way_nodes_from_xml(osm_file, way_ids):
+    way_nodes = dict()
+    for way in _iter_elements(osm_file, "way"):
+        way_id = int(way.attrib["id"])
+        if way_id in way_ids:
+            way_nodes[way_id] = [int(nd.attrib["ref"])
+                                 for nd in way.iter("nd")]
+            if len(way_nodes) == len(way_ids):
+                break
+    return way_nodes
+
+
+def _read_node_locations_from_xml(osm_file, node_ids):
+    node_locations = dict()
+    for node in _iter_elements(osm_file, "node"):
+        node_id = int(node.attrib["id"])
+        if node_id in node_ids:
+            node_locations[node_id] = (
+                float(node.attrib["lat"]), float(node.attrib["lon"]))
+            if len(node_locations) == len(node_ids):
+                break
+    return node_locations
+
+
+def _read_ways_with_osmium(osm_file, way_ids):
+    # two passes without a location index over all nodes, like the XML path
+    way_nodes = dict()
+    for way in osmium.FileProcessor(osm_file, osmium.osm.WAY).with_filter(
+            _get_id_filter(osmium.osm.WAY, way_ids)):
+        if way.id in way_ids:
+            way_nodes[way.id] = [node.ref for node in way.nodes]
+            if len(way_nodes) == len(way_ids):
+                break
+    node_ids = {node_id for node_ids in way_nodes.values() for node_id in node_ids}
+    node_locations = dict()
+    if not node_ids:
+        return way_nodes, node_locations
+    for node in osmium.FileProcessor(osm_file, osmium.osm.NODE).with_filter(
+            _get_id_filter(osmium.osm.NODE, node_ids)):
+        if node.id in node_ids and node.location.valid():
+            node_locations[node.id] = (node.location.lat, node.location.lon)
+            if len(node_locations) == len(node_ids):
+                break
+    return way_nodes, node_locations
+
+
+def _get_id_filter(entity, ids):
+    # libosmium's IdFilter only takes positive ids, negative ids of files
+    # edited with JOSM are matched by the callers instead
+    if any(id < 0 for id in ids):
+        return osmium.filter.EntityFilter(entity)
+    return osmium.filter.IdFilter(ids).enable_for(entity)
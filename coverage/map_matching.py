@@ -1,31 +1,219 @@
 #! /usr/bin/env python
 
 import argparse
+import logging
 import os
+import random
 import requests
 import pickle
+import threading
+import time
 
-import xml.etree.ElementTree as xml
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
 
+from db.metrics import get_stage
 from input import read_trajectory_from_osm
+from match_cache import MatchCache
+from trajectory import split_trajectory, stitch_matches, thin_trajectory
 
 
-def match_trajectory(trajectory):
-    if not "MAP_MATCHING_API_URL" in os.environ:
-        raise ValueError("Environment variable MAP_MATCHING_API_URL not found")
-    request_data = {
-        "shape": trajectory,
-        "costing": "auto",
-        "shape_match": "map_snap",
-    }
-    result = requests.post(
-        os.environ["MAP_MATCHING_API_URL"], json=request_data)
+MATCH_OPTIONS = {
+    "costing": "auto",
+    "shape_match": "map_snap",
+}
+
+
+def match_trajectory(trajectory, session=None, timeout=None):
+    result = (session or requests).post(
+        get_map_matching_url(), json=create_match_request(trajectory), timeout=timeout)
     if result.status_code != 200:
-        raise ValueError("Request to map matching API faile")
-    print(result.json())
+        raise ValueError("Request to map matching API failed with status {}".format(
+            result.status_code))
+    logging.debug("Map matching response: {}".format(result.text))
     return _postprocess_match(result.json())
 
 
+def get_map_matching_url():
+    if not "MAP_MATCHING_API_URL" in os.environ:
+        raise ValueError("Environment variable MAP_MATCHING_API_URL not found")
+    return os.environ["MAP_MATCHING_API_URL"]
+
+
+def create_match_request(trajectory):
+    request_data = {"shape": list(trajectory)}
+    request_data.update(MATCH_OPTIONS)
+    return request_data
+
+
+class MapMatchingClient:
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, url=None, concurrency=8, timeout=60, max_retries=5, backoff_factor=0.5,
+                 cache=None, refresh=False):
+        self.url = url
+        self.cache = cache
+        self.refresh = refresh
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session = self._create_session(concurrency)
+        self.latencies = []
+        self.num_retries = 0
+        self.num_failures = 0
+        self._lock = threading.Lock()
+
+    @ staticmethod
+    def _create_session(concurrency):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def match(self, trajectory):
+        if self.cache is None:
+            return self._request_match(trajectory)
+        key = MatchCache.get_key(trajectory, MATCH_OPTIONS)
+        map_match = None if self.refresh else self.cache.get(key)
+        if map_match is None:
+            map_match = self._request_match(trajectory)
+            self.cache.put(key, map_match)
+        return map_match
+
+    def _request_match(self, trajectory):
+        if self.url is None:
+            self.url = get_map_matching_url()
+        request_data = create_match_request(trajectory)
+        for attempt in range(self.max_retries + 1):
+            response = None
+            start_time = time.perf_counter()
+            try:
+                response = self.session.post(
+                    self.url, json=request_data, timeout=self.timeout)
+            except requests.RequestException as error:
+                if not isinstance(error, self.RETRY_EXCEPTIONS) or attempt == self.max_retries:
+                    self._record_failure()
+                    raise ValueError("Request to map matching API failed: {}".format(error))
+            else:
+                self._record_latency(time.perf_counter() - start_time)
+                if response.status_code == 200:
+                    return self._postprocess_response(response)
+                if response.status_code not in self.RETRY_STATUS_CODES or attempt == self.max_retries:
+                    self._record_failure()
+                    raise ValueError("Request to map matching API failed with status {}".format(
+                        response.status_code))
+            self._record_retry()
+            time.sleep(self._get_backoff(attempt, response))
+
+    def _postprocess_response(self, response):
+        # a malformed response fails only its own trajectory
+        try:
+            return _postprocess_match(response.json())
+        except (ValueError, KeyError, TypeError, IndexError) as error:
+            self._record_failure()
+            raise ValueError("Invalid response from map matching API: {!r}".format(error))
+
+    def match_batch(self, trajectories, window_size=None, overlap=0):
+        # trajectories are tracked by their position, names need not be unique
+        names = dict()
+        windows = dict()
+        window_matches = dict()
+        failed = set()
+
+        def split_into_requests():
+            for position, (name, trajectory) in enumerate(trajectories):
+                trajectory = list(trajectory)
+                if not trajectory:
+                    logging.warning("Skipping trajectory {} without points".format(name))
+                    continue
+                names[position] = name
+                windows[position] = split_trajectory(trajectory, window_size, overlap)
+                window_matches[position] = dict()
+                for idx, (_, points) in enumerate(windows[position]):
+                    yield (position, idx), points
+
+        for (position, idx), map_match, error in self._match_requests(split_into_requests()):
+            if position in failed:
+                continue
+            if error is not None:
+                failed.add(position)
+                windows.pop(position)
+                window_matches.pop(position)
+                yield names.pop(position), None, error
+                continue
+            window_matches[position][idx] = map_match
+            if len(window_matches[position]) == len(windows[position]):
+                matches = [window_matches[position][idx]
+                           for idx in range(len(windows[position]))]
+                yield names.pop(position), stitch_matches(windows.pop(position), matches), None
+                del window_matches[position]
+
+    def match_chunked(self, trajectory, window_size=None, overlap=0):
+        for _, map_match, error in self.match_batch([("trajectory", trajectory)], window_size, overlap):
+            if error is not None:
+                raise error
+            return map_match
+        raise ValueError("The trajectory has no points")
+
+    def _match_requests(self, match_requests):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = dict()
+            for key, trajectory in match_requests:
+                if len(pending) >= 2 * self.concurrency:
+                    yield from self._collect_completed(pending)
+                pending[executor.submit(self.match, trajectory)] = key
+            while pending:
+                yield from self._collect_completed(pending)
+
+    @ staticmethod
+    def _collect_completed(pending):
+        done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = pending.pop(future)
+            try:
+                yield name, future.result(), None
+            except ValueError as error:
+                yield name, None, error
+
+    def _get_backoff(self, attempt, response):
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return int(response.headers["Retry-After"])
+        return self.backoff_factor * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def _record_latency(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+        get_stage("map_matching").add_latency("request", latency)
+
+    def _record_retry(self):
+        with self._lock:
+            self.num_retries += 1
+
+    def _record_failure(self):
+        with self._lock:
+            self.num_failures += 1
+
+    def get_stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p): return latencies[min(
+            len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+        cache_stats = self.cache.get_stats() if self.cache is not None else {}
+        return {
+            "cache_hits": cache_stats.get("hits", 0),
+            "cache_misses": cache_stats.get("misses", 0),
+            "requests": len(latencies),
+            "retries": self.num_retries,
+            "failures": self.num_failures,
+            "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
 def _postprocess_match(result):
     map_match = dict()
     map_match["meta"] = _extract_metadata(result["admins"])
@@ -64,6 +252,34 @@ def _extract_matches(data):
     } for e in data]
 
 
+def add_chunking_arguments(parser):
+    parser.add_argument("--window-size", type=int, default=2000,
+                        help="Split trajectories into windows of this many points (0: no splitting)")
+    parser.add_argument("--overlap", type=int, default=100,
+                        help="The number of points shared by consecutive windows")
+    parser.add_argument("--min-distance", type=float, default=None,
+                        help="Drop points closer than this many meters to the previous point")
+    parser.add_argument("--simplify-tolerance", type=float, default=None,
+                        help="Simplify trajectories with Douglas-Peucker using this tolerance in meters")
+
+
+def add_cache_arguments(parser):
+    parser.add_argument("--cache-dir", default=os.path.join(os.path.expanduser("~"), ".cache", "road_coverage", "map_matching"),
+                        help="The directory of the map matching result cache")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="The maximum size of the map matching result cache in MiB")
+    parser.add_argument("--no-cache", help="Do not use the map matching result cache",
+                        action="store_true", default=False)
+    parser.add_argument("--refresh", help="Ignore cached map matching results and replace them",
+                        action="store_true", default=False)
+
+
+def create_match_cache(args):
+    if args.no_cache:
+        return None
+    return MatchCache(args.cache_dir, args.cache_size * 1024 ** 2)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="OSM Way Map Matcher")
     parser.add_argument("osm_file", metavar="OSM_FILE", help="The OSM file")
@@ -71,10 +287,16 @@ if __name__ == "__main__":
                         type=int, help="The way id")
     parser.add_argument("match_result_file", metavar="OUTPUT_FILE",
                         help="The file to write the match result to")
+    add_chunking_arguments(parser)
+    add_cache_arguments(parser)
     args = parser.parse_args()
 
-    trajectory = read_trajectory_from_osm(args.osm_file, args.way_id)
-    map_match = match_trajectory(trajectory)
+    trajectory = thin_trajectory(read_trajectory_from_osm(args.osm_file, args.way_id),
+                                 args.min_distance, args.simplify_tolerance)
+    client = MapMatchingClient(
+        cache=create_match_cache(args), refresh=args.refresh)
+    map_match = client.match_chunked(
+        trajectory, args.window_size, args.overlap)
     print(map_match)
     with open(args.match_result_file, "wb") as file_stream:
         pickle.dump(map_match, file_stream)
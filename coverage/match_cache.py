@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+
+COORDINATE_PRECISION = 7
+
+
+class MatchCache:
+    def __init__(self, cache_dir, max_size=1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for directory, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        self._index = OrderedDict(
+            (path, size) for _, path, size in sorted(entries))
+        self._size = sum(self._index.values())
+
+    @ staticmethod
+    def get_key(trajectory, options):
+        shape = [(round(point["lat"], COORDINATE_PRECISION), round(point["lon"], COORDINATE_PRECISION))
+                 for point in trajectory]
+        content = json.dumps({"shape": shape, "options": options},
+                             sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        cache_file = self._get_cache_file(key)
+        try:
+            with open(cache_file, "rb") as file_stream:
+                map_match = pickle.load(file_stream)
+            os.utime(cache_file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            if cache_file in self._index:
+                self._index.move_to_end(cache_file)
+        return map_match
+
+    def put(self, key, map_match):
+        cache_file = self._get_cache_file(key)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        file_descriptor, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(cache_file), suffix=".tmp")
+        with os.fdopen(file_descriptor, "wb") as file_stream:
+            pickle.dump(map_match, file_stream)
+        size = os.path.getsize(temp_file)
+        os.replace(temp_file, cache_file)
+        with self._lock:
+            self._size += size - self._index.pop(cache_file, 0)
+            self._index[cache_file] = size
+            self._evict()
+
+    def _get_cache_file(self, key):
+        return os.path.join(self.cache_dir, key[:2], "{}.pickle".format(key))
+
+    def _evict(self):
+        while self._size > self.max_size and self._index:
+            path, size = self._index.popitem(last=False)
+            logging.debug("Evicting cached match result {}".format(path))
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._index), "size": self._size}
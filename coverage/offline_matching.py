@@ -0,0 +1,377 @@
+#! /usr/bin/env python
+
+import argparse
+import logging
+import os
+import pickle
+import time
+
+import numpy as np
+
+from batch_map_matching import get_output_file, read_trajectories
+from db.metrics import add_metrics_arguments, configure_metrics, measure_stage, write_metrics
+from db.road_database import RoadDatabase
+from trajectory import EARTH_RADIUS, thin_trajectory
+
+
+METERS_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+CELL_OFFSET = 2 ** 24
+CELL_STRIDE = 2 ** 25
+ONEWAY_VALUES = ("yes", "true", "1")
+# GPS noise of slow or standing vehicles moves points backwards along oneways
+BACKWARD_TOLERANCE = 10.0
+
+
+class SegmentIndex:
+    # Pieces connect consecutive nodes of a way and are stored in the same
+    # order as the segments of the road database, so piece i is segment i.
+    def __init__(self, database, cell_size=250.0):
+        self.database = database
+        way_node_offsets = np.asarray(database.way_node_offsets)
+        way_nodes = np.asarray(database.way_nodes)
+        segment_offsets = np.asarray(database.segment_offsets)
+        lats = np.asarray(database.node_lats)[way_nodes]
+        lons = np.asarray(database.node_lons)[way_nodes]
+        is_piece_start = np.ones(len(way_nodes), dtype=bool)
+        is_piece_start[way_node_offsets[1:][way_node_offsets[1:] > 0] - 1] = False
+        piece_starts = np.flatnonzero(is_piece_start)
+        self.begin_lats, self.begin_lons = lats[piece_starts], lons[piece_starts]
+        self.end_lats, self.end_lons = lats[piece_starts + 1], lons[piece_starts + 1]
+
+        way_lengths = np.asarray(database.way_lengths)
+        self.way_ids = np.array(database.way_ids)
+        self.piece_ways = np.repeat(
+            np.arange(len(way_lengths)), np.diff(segment_offsets))
+        self.piece_begins = 1000 * \
+            np.asarray(database.segment_ratios) * way_lengths[self.piece_ways]
+        self.piece_lengths = 1000 * np.asarray(database.segment_lengths)
+        self.way_lengths = 1000 * way_lengths
+
+        has_nodes = np.diff(way_node_offsets) > 0
+        self.way_first_nodes = np.where(
+            has_nodes, way_nodes[np.minimum(way_node_offsets[:-1], len(way_nodes) - 1)], -1)
+        self.way_last_nodes = np.where(
+            has_nodes, way_nodes[np.maximum(way_node_offsets[1:] - 1, 0)], -2)
+        self.way_oneway = np.array([_is_oneway(database.get_way_attributes(way_id))
+                                    for way_id in database.way_ids.tolist()], dtype=bool)
+        self._build_grid(cell_size, lats)
+
+    def _build_grid(self, cell_size, lats):
+        max_lat = min(float(np.abs(lats).max()) if len(lats) else 0.0, 89.0)
+        self.cell_lat = cell_size / METERS_PER_DEGREE
+        self.cell_lon = self.cell_lat / np.cos(np.radians(max_lat))
+        pieces, keys = self._get_covered_cells(
+            np.minimum(self.begin_lats, self.end_lats), np.maximum(self.begin_lats, self.end_lats),
+            np.minimum(self.begin_lons, self.end_lons), np.maximum(self.begin_lons, self.end_lons))
+        order = np.argsort(keys, kind="stable")
+        self.cell_keys, cell_offsets = np.unique(keys[order], return_index=True)
+        self.cell_offsets = np.append(cell_offsets, len(order))
+        self.cell_pieces = pieces[order]
+        logging.debug("Indexed {} pieces in {} grid cells".format(
+            len(self.piece_ways), len(self.cell_keys)))
+
+    def _get_covered_cells(self, min_lats, max_lats, min_lons, max_lons):
+        first_rows = np.floor(min_lats / self.cell_lat).astype(np.int64)
+        first_cols = np.floor(min_lons / self.cell_lon).astype(np.int64)
+        heights = np.floor(max_lats / self.cell_lat).astype(np.int64) - first_rows + 1
+        widths = np.floor(max_lons / self.cell_lon).astype(np.int64) - first_cols + 1
+        owners, within = _expand_ranges(heights * widths)
+        return owners, _get_cell_keys(first_rows[owners] + within // widths[owners],
+                                      first_cols[owners] + within % widths[owners])
+
+    def get_candidates(self, lats, lons, radius, max_candidates):
+        lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+        scale_x = METERS_PER_DEGREE * np.cos(np.radians(lats))
+        points, keys = self._get_covered_cells(
+            lats - radius / METERS_PER_DEGREE, lats + radius / METERS_PER_DEGREE,
+            lons - radius / scale_x, lons + radius / scale_x)
+        cells = np.searchsorted(self.cell_keys, keys)
+        found = cells < len(self.cell_keys)
+        found[found] = self.cell_keys[cells[found]] == keys[found]
+        points, cells = points[found], cells[found]
+        sizes = self.cell_offsets[cells + 1] - self.cell_offsets[cells]
+        owners, within = _expand_ranges(sizes)
+        points = points[owners]
+        pieces = self.cell_pieces[self.cell_offsets[cells][owners] + within]
+
+        begin_x = (self.begin_lons[pieces] - lons[points]) * scale_x[points]
+        begin_y = (self.begin_lats[pieces] - lats[points]) * METERS_PER_DEGREE
+        delta_x = (self.end_lons[pieces] - self.begin_lons[pieces]) * scale_x[points]
+        delta_y = (self.end_lats[pieces] - self.begin_lats[pieces]) * METERS_PER_DEGREE
+        squared_lengths = delta_x ** 2 + delta_y ** 2
+        t = np.clip(np.divide(-(begin_x * delta_x + begin_y * delta_y), squared_lengths,
+                              out=np.zeros_like(squared_lengths), where=squared_lengths > 0), 0, 1)
+        x, y = begin_x + t * delta_x, begin_y + t * delta_y
+        distances = np.hypot(x, y)
+        within_radius = distances <= radius
+        points, pieces, t, x, y, distances = (values[within_radius] for values in (
+            points, pieces, t, x, y, distances))
+        ways = self.piece_ways[pieces]
+
+        # keep the closest piece of every way, then the closest ways of every point
+        order = np.lexsort((distances, ways, points))
+        is_closest = np.ones(len(order), dtype=bool)
+        is_closest[1:] = (points[order][1:] != points[order][:-1]) | (
+            ways[order][1:] != ways[order][:-1])
+        order = order[is_closest]
+        order = order[np.lexsort((distances[order], points[order]))]
+        ranks = np.arange(len(order)) - \
+            np.searchsorted(points[order], points[order])
+        order, ranks = order[ranks < max_candidates], ranks[ranks < max_candidates]
+        rows = points[order]
+
+        shape = (len(lats), int(ranks.max()) + 1 if len(ranks) else 1)
+        candidates = {
+            "ways": np.full(shape, -1, dtype=np.int64),
+            "distances": np.full(shape, np.inf),
+            "offsets": np.zeros(shape),
+            "lats": np.zeros(shape),
+            "lons": np.zeros(shape),
+        }
+        candidates["ways"][rows, ranks] = ways[order]
+        candidates["distances"][rows, ranks] = distances[order]
+        candidates["offsets"][rows, ranks] = self.piece_begins[pieces[order]] + \
+            t[order] * self.piece_lengths[pieces[order]]
+        candidates["lats"][rows, ranks] = lats[rows] + y[order] / METERS_PER_DEGREE
+        candidates["lons"][rows, ranks] = lons[rows] + x[order] / scale_x[rows]
+        return candidates
+
+    def get_route_distances(self, candidates):
+        # distances in meters from every candidate of a point to every candidate
+        # of the next point along the ways, inf if not connected
+        ways_p, ways_c = candidates["ways"][:-1, :, None], candidates["ways"][1:, None, :]
+        offsets_p, offsets_c = candidates["offsets"][:-1, :, None], candidates["offsets"][1:, None, :]
+        lengths_p, lengths_c = self.way_lengths[ways_p], self.way_lengths[ways_c]
+        oneway_p, oneway_c = self.way_oneway[ways_p], self.way_oneway[ways_c]
+        first_p, last_p = self.way_first_nodes[ways_p], self.way_last_nodes[ways_p]
+        first_c, last_c = self.way_first_nodes[ways_c], self.way_last_nodes[ways_c]
+
+        same_way = np.where(oneway_p & (offsets_c < offsets_p - BACKWARD_TOLERANCE),
+                            np.inf, np.abs(offsets_c - offsets_p))
+        routes = np.where(ways_p == ways_c, same_way, np.inf)
+        # leaving a way through its first node or entering one through its last
+        # node means driving against the way direction
+        connections = (
+            (last_p == first_c, (lengths_p - offsets_p) + offsets_c),
+            ((first_p == first_c) & ~oneway_p, offsets_p + offsets_c),
+            ((last_p == last_c) & ~oneway_c, (lengths_p - offsets_p) + (lengths_c - offsets_c)),
+            ((first_p == last_c) & ~oneway_p & ~oneway_c, offsets_p + (lengths_c - offsets_c)),
+        )
+        for connected, distances in connections:
+            routes = np.where(connected & (ways_p != ways_c),
+                              np.minimum(routes, distances), routes)
+        return np.where((ways_p < 0) | (ways_c < 0), np.inf, routes)
+
+
+def _expand_ranges(sizes):
+    owners = np.repeat(np.arange(len(sizes)), sizes)
+    return owners, np.arange(len(owners)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+
+def _get_cell_keys(rows, cols):
+    return (rows + CELL_OFFSET) * CELL_STRIDE + (cols + CELL_OFFSET)
+
+
+def _is_oneway(attributes):
+    if attributes["oneway"] is None:
+        # motorways are implicitly oneway in OSM
+        return attributes["type"] == "motorway"
+    return attributes["oneway"] in ONEWAY_VALUES
+
+
+class OfflineMatcher:
+    def __init__(self, database, search_radius=50.0, sigma=10.0, beta=50.0, max_candidates=8,
+                 cell_size=250.0):
+        self.database = database
+        self.index = SegmentIndex(database, cell_size)
+        self.search_radius = search_radius
+        self.sigma = sigma
+        self.beta = beta
+        self.max_candidates = max_candidates
+
+    def match(self, trajectory):
+        trajectory = list(trajectory)
+        lats = np.array([point["lat"] for point in trajectory], dtype=np.float64)
+        lons = np.array([point["lon"] for point in trajectory], dtype=np.float64)
+        candidates = self.index.get_candidates(
+            lats, lons, self.search_radius, self.max_candidates)
+        states = self._run_viterbi(self._get_emissions(
+            candidates), self._get_transitions(candidates, lats, lons))
+        return self._create_match(candidates, states)
+
+    def _get_emissions(self, candidates):
+        return -0.5 * (candidates["distances"] / self.sigma) ** 2
+
+    def _get_transitions(self, candidates, lats, lons):
+        routes = self.index.get_route_distances(candidates)
+        scale_x = METERS_PER_DEGREE * np.cos(np.radians((lats[:-1] + lats[1:]) / 2))
+        distances = np.hypot(np.diff(lons) * scale_x,
+                             np.diff(lats) * METERS_PER_DEGREE)
+        with np.errstate(invalid="ignore"):
+            return np.where(np.isfinite(routes), -np.abs(routes - distances[:, None, None]) / self.beta, -np.inf)
+
+    def _run_viterbi(self, emissions, transitions):
+        states = np.full(len(emissions), -1, dtype=np.int64)
+        has_candidates = np.isfinite(emissions[:, 0]).tolist()
+        columns = np.arange(emissions.shape[1])
+        chain = []
+        scores = None
+        for idx in range(len(emissions)):
+            if not has_candidates[idx]:
+                self._backtrack(chain, scores, states)
+                chain, scores = [], None
+                continue
+            back_pointers = None
+            if scores is not None:
+                total = scores[:, None] + transitions[idx - 1]
+                back_pointers = total.argmax(axis=0)
+                next_scores = total[back_pointers, columns]
+                if next_scores.max() > -np.inf:
+                    scores = next_scores + emissions[idx]
+                else:
+                    # no candidate is reachable from the previous point
+                    self._backtrack(chain, scores, states)
+                    chain, scores, back_pointers = [], None, None
+            if scores is None:
+                scores = emissions[idx]
+            chain.append((idx, back_pointers))
+        self._backtrack(chain, scores, states)
+        return states
+
+    @ staticmethod
+    def _backtrack(chain, scores, states):
+        if not chain:
+            return
+        state = int(scores.argmax())
+        for idx, back_pointers in reversed(chain):
+            states[idx] = state
+            if back_pointers is not None:
+                state = int(back_pointers[state])
+
+    def _create_match(self, candidates, states):
+        points = np.flatnonzero(states >= 0)
+        ways = candidates["ways"][points, states[points]]
+        way_lengths = self.index.way_lengths[ways]
+        ratios = np.divide(candidates["offsets"][points, states[points]], way_lengths,
+                           out=np.zeros(len(points)), where=way_lengths > 0)
+        edges, matches = [], []
+        previous_way_id, previous_ratio, run_begin = None, None, 0
+        for way, way_id, oneway, ratio, lat, lon in zip(
+                ways.tolist(), self.index.way_ids[ways].tolist(), self.index.way_oneway[ways].tolist(),
+                ratios.tolist(), candidates["lats"][points, states[points]].tolist(),
+                candidates["lons"][points, states[points]].tolist()):
+            # points without candidates, standing points and points moving backwards
+            # on a oneway are left out. Every run of points moving in one direction
+            # along a way gets an edge, and ratios of runs against the way direction
+            # are measured from the end of the way, so matches are ordered in edges.
+            if way_id != previous_way_id:
+                edges.append(self._create_edge(way))
+                run_begin = len(matches)
+            elif ratio == previous_ratio or (oneway and ratio < previous_ratio):
+                continue
+            elif (ratio < previous_ratio) != edges[-1]["reverse"]:
+                edge = self._create_edge(way, ratio < previous_ratio)
+                if len(matches) - run_begin == 1:
+                    # the second point of a run sets the direction of its edge
+                    edges[-1] = edge
+                    matches[-1]["edge_ratio"] = 1 - previous_ratio if edge["reverse"] else previous_ratio
+                else:
+                    # turning around continues on an edge of the same way
+                    edges.append(edge)
+                    run_begin = len(matches)
+            matches.append({
+                "edge_index": len(edges) - 1,
+                "type": "matched",
+                "edge_ratio": 1 - ratio if edges[-1]["reverse"] else ratio,
+                "lat": lat,
+                "lon": lon,
+            })
+            previous_way_id, previous_ratio = way_id, ratio
+        return {"meta": [], "edges": edges, "matches": matches}
+
+    def _create_edge(self, way, reverse=False):
+        way_id = int(self.index.way_ids[way])
+        geometry = self.database.get_way_geometry(way_id)
+        if reverse:
+            geometry = geometry[::-1]
+        return {
+            "way_id": way_id,
+            "meta_index": 0,
+            "road_class": self.database.highway_types[self.database.way_types[way]],
+            "length": float(self.database.way_lengths[way]),
+            "begin_heading": _get_heading(geometry[:2]),
+            "end_heading": _get_heading(geometry[-2:]),
+            "reverse": reverse,
+        }
+
+
+def _get_heading(geometry):
+    if len(geometry) < 2:
+        return 0
+    (lat1, lon1), (lat2, lon2) = np.radians(geometry[0]), np.radians(geometry[1])
+    heading = np.degrees(np.arctan2(np.sin(lon2 - lon1) * np.cos(lat2),
+                                    np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)))
+    return int(round(heading)) % 360
+
+
+def match_trajectories(matcher, trajectories, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    num_points = 0
+    output_names = set()
+    with measure_stage("offline_matching") as stage:
+        for name, trajectory in trajectories:
+            try:
+                output_file = get_output_file(output_dir, name, output_names)
+            except ValueError as error:
+                logging.error("Failed to match trajectory {}: {}".format(name, error))
+                continue
+            map_match = matcher.match(trajectory)
+            num_points += len(trajectory)
+            stage.add_objects(len(trajectory))
+            with open(output_file, "wb") as file_stream:
+                pickle.dump(map_match, file_stream)
+            stage.add_rows(1)
+    duration = time.perf_counter() - start_time
+    logging.info("Matched {} points in {:.1f}s ({:.0f} points/s)".format(
+        num_points, duration, num_points / max(duration, 1e-9)))
+
+
+def add_matcher_arguments(parser):
+    parser.add_argument("--search-radius", type=float, default=50.0,
+                        help="The maximum distance in meters between a point and its candidate ways")
+    parser.add_argument("--sigma", type=float, default=10.0,
+                        help="The standard deviation of the GPS noise in meters")
+    parser.add_argument("--beta", type=float, default=50.0,
+                        help="The tolerated difference in meters between route and point distance")
+    parser.add_argument("--max-candidates", type=int, default=8,
+                        help="The maximum number of candidate ways per point")
+
+
+def create_matcher(database, args):
+    return OfflineMatcher(database, args.search_radius, args.sigma, args.beta, args.max_candidates)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline OSM Map Matcher")
+    parser.add_argument("road_database", metavar="ROAD_DATABASE",
+                        help="The columnar road database directory")
+    parser.add_argument("inputs", metavar="INPUT", nargs="+",
+                        help="Trajectory files (.json/.wkt), directories, JSONL files or - for JSONL on stdin")
+    parser.add_argument("output_dir", metavar="OUTPUT_DIR",
+                        help="The directory to write the match results to")
+    parser.add_argument("--min-distance", type=float, default=None,
+                        help="Drop points closer than this many meters to the previous point")
+    parser.add_argument("--simplify-tolerance", type=float, default=None,
+                        help="Simplify trajectories with Douglas-Peucker using this tolerance in meters")
+    add_matcher_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+    configure_metrics(args)
+    matcher = create_matcher(RoadDatabase(args.road_database), args)
+    trajectories = ((name, thin_trajectory(trajectory, args.min_distance, args.simplify_tolerance))
+                    for name, trajectory in read_trajectories(args.inputs))
+    match_trajectories(matcher, trajectories, args.output_dir)
+    write_metrics(args)
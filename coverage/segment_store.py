@@ -0,0 +1,167 @@
+import logging
+import os
+import pickle
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import groupby
+
+from db.mysql_connection import execute_prepared, get_connection_pool, load_configuration
+from db.road_database import RoadDatabase
+
+
+BACKENDS = ("mysql", "local")
+
+
+class MySqlSegmentStore:
+    QUERY = "SELECT way_id, way_length_ratio FROM way_segments WHERE way_id IN ({}) ORDER BY way_id, segment_id"
+
+    def __init__(self, connection_pool, chunk_size=1000):
+        self.connection_pool = connection_pool
+        self.chunk_size = chunk_size
+        self._queries = dict()
+
+    def get_way_ratios(self, way_ids):
+        way_ids = sorted(set(way_ids))
+        way_ratios = dict()
+        if not way_ids:
+            return way_ratios
+        with self.connection_pool.connection() as dbcon:
+            for chunk in _split_into_chunks(way_ids, self.chunk_size):
+                query, params = self._get_query(chunk)
+                cursor = execute_prepared(dbcon, query, params)
+                for way_id, rows in groupby(cursor.fetchall(), key=lambda row: row[0]):
+                    way_ratios[way_id] = tuple(row[1] for row in rows)
+        return way_ratios
+
+    def _get_query(self, way_ids):
+        # Statements are prepared for powers of two of way ids and padded with
+        # the last way id, so that few statements are kept per connection.
+        size = min(self.chunk_size, 1 << (len(way_ids) - 1).bit_length())
+        if size not in self._queries:
+            self._queries[size] = self.QUERY.format(",".join(["%s"] * size))
+        return self._queries[size], way_ids + [way_ids[-1]] * (size - len(way_ids))
+
+
+class LocalSegmentStore:
+    def __init__(self, database_path):
+        if os.path.isdir(database_path):
+            self.database = RoadDatabase(database_path)
+            self.pickled_ways = None
+        else:
+            self.database = None
+            self.pickled_ways = _load_pickled_ways(database_path)
+
+    def get_way_ratios(self, way_ids):
+        way_ratios = dict()
+        for way_id in set(way_ids):
+            ratios = self._get_ratios(way_id)
+            if ratios is not None:
+                way_ratios[way_id] = ratios
+        return way_ratios
+
+    def _get_ratios(self, way_id):
+        if self.pickled_ways is not None:
+            return self.pickled_ways.get(way_id)
+        if way_id not in self.database:
+            return None
+        _, ratios = self.database.get_way_segments(way_id)
+        # like MySQL, which has no way_segments rows for them
+        return tuple(ratios.tolist()) or None
+
+
+def _load_pickled_ways(database_file):
+    logging.info("Loading pickled road database {}".format(database_file))
+    with open(database_file, "rb") as file_stream:
+        ways = pickle.load(file_stream)["ways"]
+    pickled_ways = dict()
+    for way_id, way in ways.items():
+        if not way["segments"]:
+            continue
+        ratios = []
+        accumulated_length = 0.0
+        for length in way["segments"]:
+            ratios.append(accumulated_length / way["length"] if way["length"] > 0 else 0.0)
+            accumulated_length += length
+        pickled_ways[way_id] = tuple(ratios)
+    return pickled_ways
+
+
+class CachedSegmentStore:
+    def __init__(self, segment_store, max_size=100000):
+        self.segment_store = segment_store
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_way_ratios(self, way_ids):
+        way_ratios = dict()
+        missing_way_ids = []
+        way_ids = set(way_ids)
+        with self._lock:
+            for way_id in way_ids:
+                if way_id in self._cache:
+                    self._cache.move_to_end(way_id)
+                    if self._cache[way_id] is not None:
+                        way_ratios[way_id] = self._cache[way_id]
+                else:
+                    missing_way_ids.append(way_id)
+            self.hits += len(way_ids) - len(missing_way_ids)
+            self.misses += len(missing_way_ids)
+        if not missing_way_ids:
+            return way_ratios
+
+        fetched_ratios = self.segment_store.get_way_ratios(missing_way_ids)
+        way_ratios.update(fetched_ratios)
+        with self._lock:
+            # ways without segments are cached as well, most edges of a match are no motorways
+            for way_id in missing_way_ids:
+                self._cache[way_id] = fetched_ratios.get(way_id)
+                self._cache.move_to_end(way_id)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return way_ratios
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._cache)}
+
+
+def _split_into_chunks(data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i+chunk_size]
+
+
+@contextmanager
+def open_segment_store(backend, source, cache_size=100000, pool_size=None):
+    segment_store = create_segment_store(
+        backend, source, cache_size, pool_size)
+    yield segment_store
+    if cache_size > 0:
+        logging.info("Segment cache stats: {}".format(segment_store.get_stats()))
+
+
+def create_segment_store(backend, source, cache_size=100000, pool_size=None):
+    if backend == "mysql":
+        config = load_configuration(source)
+        segment_store = MySqlSegmentStore(
+            get_connection_pool(config["mysql"], pool_size))
+    elif backend == "local":
+        segment_store = LocalSegmentStore(source)
+    else:
+        raise ValueError("Unknown segment store backend: {} (available: {})".format(
+            backend, ", ".join(BACKENDS)))
+    if cache_size > 0:
+        segment_store = CachedSegmentStore(segment_store, cache_size)
+    return segment_store
+
+
+def add_segment_store_arguments(parser):
+    parser.add_argument("source", metavar="MYSQL_CONFIG|ROAD_DATABASE",
+                        help="The MySQL configuration file (mysql) or the road database directory/pickle file (local)")
+    parser.add_argument("--backend", choices=BACKENDS, default="mysql",
+                        help="Read way segments from MySQL or from the binary road database")
+    parser.add_argument("--segment-cache-size", type=int, default=100000,
+                        help="The number of ways kept in the segment cache (0: no cache)")
@@ -0,0 +1,139 @@
+import os
+import pickle
+import sys
+
+import mysql.connector
+import numpy as np
+import pytest
+
+COVERAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [COVERAGE_DIR, os.path.join(COVERAGE_DIR, "db")]
+
+from road_database import STRING_COLUMNS, write_road_database  # noqa: E402
+from segment_lengths import compute_segment_lengths  # noqa: E402
+
+
+# The tests which need MySQL drop and fill the tables of the configured database
+MYSQL_CONFIG_VARIABLE = "ROAD_COVERAGE_TEST_CONFIG"
+
+NUM_WAYS = 500
+NODES_PER_WAY = 5
+# a way with a repeated node location has segments of length 0 and equal ratios
+REPEATED_LOCATION_WAY_ID = 7
+# a way with a single node has no segments
+SINGLE_NODE_WAY_ID = 3
+
+
+def create_test_ways():
+    ways = dict()
+    for idx in range(NUM_WAYS):
+        lat, lon = 48.0 + 0.01 * (idx // 25), 9.0 + 0.01 * (idx % 25)
+        ways[1000 + 10 * idx] = [
+            (100000 + NODES_PER_WAY * idx + node, lat + 0.001 * node, lon + 0.0005 * node)
+            for node in range(NODES_PER_WAY)]
+    ways[REPEATED_LOCATION_WAY_ID] = [(1, 47.5, 8.5), (2, 47.5, 8.5), (3, 47.501, 8.5)]
+    ways[SINGLE_NODE_WAY_ID] = [(4, 47.6, 8.6)]
+    return dict(sorted(ways.items()))
+
+
+def get_way_segments(ways):
+    lats = [lat for nodes in ways.values() for _, lat, _ in nodes]
+    lons = [lon for nodes in ways.values() for _, _, lon in nodes]
+    offsets = [0]
+    for nodes in ways.values():
+        offsets.append(offsets[-1] + len(nodes))
+    return compute_segment_lengths(lats, lons, offsets)
+
+
+def get_expected_ratios(ways):
+    lengths = get_way_segments(ways)
+    return {way_id: lengths.ratios[begin:end].tolist()
+            for way_id, begin, end in zip(ways, lengths.segment_offsets[:-1], lengths.segment_offsets[1:])
+            if end > begin}
+
+
+@pytest.fixture(scope="session")
+def test_ways():
+    return create_test_ways()
+
+
+@pytest.fixture(scope="session")
+def road_database(tmp_path_factory, test_ways):
+    directory = str(tmp_path_factory.mktemp("road_database"))
+    nodes = sorted({node for way_nodes in test_ways.values() for node in way_nodes})
+    way_node_ids = [node_id for way_nodes in test_ways.values() for node_id, _, _ in way_nodes]
+    write_road_database(
+        directory,
+        [node_id for node_id, _, _ in nodes],
+        [lat for _, lat, _ in nodes],
+        [lon for _, _, lon in nodes],
+        list(test_ways),
+        np.cumsum([0] + [len(way_nodes) for way_nodes in test_ways.values()]),
+        way_node_ids,
+        np.zeros(len(test_ways), dtype=np.uint8),
+        ("motorway",),
+        get_way_segments(test_ways),
+        {name: ["A 1"] * len(test_ways) if name == "ref" else [None] * len(test_ways)
+         for name in STRING_COLUMNS},
+        "ellipsoidal")
+    return directory
+
+
+@pytest.fixture(scope="session")
+def pickled_road_database(tmp_path_factory, test_ways):
+    lengths = get_way_segments(test_ways)
+    database_file = str(tmp_path_factory.mktemp("pickled_road_database") / "database.pickle")
+    with open(database_file, "wb") as file_stream:
+        pickle.dump({"nodes": dict(), "ways": {
+            way_id: {"segments": lengths.segments[begin:end].tolist(), "length": float(length)}
+            for way_id, begin, end, length in zip(
+                test_ways, lengths.segment_offsets[:-1], lengths.segment_offsets[1:], lengths.way_lengths)
+        }}, file_stream)
+    return database_file
+
+
+@pytest.fixture(scope="session")
+def mysql_config():
+    config_file = os.environ.get(MYSQL_CONFIG_VARIABLE)
+    if not config_file:
+        pytest.skip("Set {} to the configuration of a disposable MySQL database".format(MYSQL_CONFIG_VARIABLE))
+    from mysql_connection import connect_to_database, load_configuration
+    config = load_configuration(config_file)
+    config["schema"] = dict(config.get("schema") or dict(), mode="primary_keys")
+    try:
+        with connect_to_database(config["mysql"]):
+            pass
+    except mysql.connector.Error as error:
+        pytest.skip("MySQL server not available: {}".format(error))
+    return config
+
+
+@pytest.fixture(scope="session")
+def mysql_database(mysql_config, test_ways):
+    from mysql_connection import connect_to_database
+    from mysql_schema import create_indices, create_tables
+    from mysql_table_config import TABLE_CONFIGURATIONS
+    from table_writer import insert_rows
+
+    lengths = get_way_segments(test_ways)
+    with connect_to_database(mysql_config["mysql"]) as dbcon:
+        with dbcon.cursor() as cursor:
+            for table in TABLE_CONFIGURATIONS:
+                cursor.execute("DROP TABLE IF EXISTS {}".format(table))
+        create_tables(dbcon, mysql_config)
+        create_indices(dbcon, mysql_config, list(TABLE_CONFIGURATIONS))
+        with dbcon.cursor() as cursor:
+            insert_rows(cursor, "ways", [(way_id, 1, "A 1", None, None, None, None, None) for way_id in test_ways])
+            insert_rows(cursor, "way_node_ids", [(way_id, idx, node_id) for way_id, nodes in test_ways.items()
+                                                 for idx, (node_id, _, _) in enumerate(nodes)])
+            insert_rows(cursor, "nodes", [(node_id, lon, lat) for nodes in test_ways.values()
+                                          for node_id, lat, lon in nodes])
+            insert_rows(cursor, "way_segments", [
+                (way_id, segment_id, float(lengths.segments[begin + segment_id]),
+                 float(lengths.ratios[begin + segment_id]))
+                for way_id, begin, end in zip(test_ways, lengths.segment_offsets[:-1], lengths.segment_offsets[1:])
+                for segment_id in range(end - begin)])
+            for table in ("ways", "way_node_ids", "nodes", "way_segments"):
+                cursor.execute("ANALYZE TABLE {}".format(table))
+                cursor.fetchall()
+    return mysql_config
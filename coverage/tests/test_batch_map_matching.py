@@ -0,0 +1,38 @@
+import json
+import os
+import pickle
+
+from batch_map_matching import match_trajectories, read_trajectories
+
+
+class FakeClient:
+    def match_batch(self, trajectories, window_size=None, overlap=0):
+        for name, trajectory in trajectories:
+            yield name, {"points": len(trajectory)}, None
+
+    def get_stats(self):
+        return dict()
+
+
+def write_jsonl(path, trajectories):
+    with open(path, "w") as file_stream:
+        for trajectory in trajectories:
+            file_stream.write(json.dumps(trajectory) + "\n")
+    return str(path)
+
+
+def test_jsonl_names_without_id_are_unique(tmp_path):
+    shape = {"shape": [{"lat": 48.0, "lon": 9.0}]}
+    inputs = [write_jsonl(tmp_path / "monday.jsonl", [shape, dict(shape, id=17)]),
+              write_jsonl(tmp_path / "tuesday.jsonl", [shape])]
+    assert [name for name, _ in read_trajectories(inputs)] == ["monday-0", "17", "tuesday-0"]
+
+
+def test_output_names_are_sanitised_and_unique(tmp_path):
+    point = {"lat": 48.0, "lon": 9.0}
+    trajectories = [("a/b", [point]), ("../c", [point, point]), ("a/b", [point] * 3), ("a_b", [point] * 4)]
+    output_dir = str(tmp_path / "matches")
+    match_trajectories(FakeClient(), trajectories, output_dir)
+    assert sorted(os.listdir(output_dir)) == [".._c.pickle", "a_b.pickle"]
+    with open(os.path.join(output_dir, "a_b.pickle"), "rb") as file_stream:
+        assert pickle.load(file_stream) == {"points": 1}
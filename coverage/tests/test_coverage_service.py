@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+
+from conftest import get_way_segments
+from coverage_service import ROLLUP_ZOOM, CoverageRollups, CoverageService, get_tile_coordinates, normalize_ref
+from road_database import STRING_COLUMNS, RoadDatabase, write_road_database
+from road_version import get_file_version
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=()):
+        pass
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    def __init__(self, road_version):
+        self.road_version = road_version
+
+    def cursor(self):
+        return FakeCursor([(self.road_version,)] if self.road_version is not None else [])
+
+
+@pytest.fixture
+def rollups(road_database):
+    return CoverageRollups(RoadDatabase(road_database))
+
+
+def test_file_versions_are_chained(tmp_path):
+    osm_file, change_file = tmp_path / "roads.osm", tmp_path / "roads.osc"
+    osm_file.write_bytes(b"<osm/>")
+    change_file.write_bytes(b"<osmChange/>")
+    version = get_file_version(str(osm_file))
+    assert version == get_file_version(str(osm_file))
+    assert get_file_version(str(change_file), version) not in (version, get_file_version(str(change_file)))
+
+
+@pytest.mark.parametrize("mysql_version, matches", [("a" * 40, True), ("b" * 40, False), (None, False)])
+def test_road_version_mismatch_is_detected(rollups, monkeypatch, mysql_version, matches):
+    monkeypatch.setattr(rollups, "road_version", "a" * 40)
+    service = CoverageService(rollups)
+    assert service._check_road_version(FakeConnection(mysql_version)) == matches
+    assert service.get_stats()["road_version_mismatch"] == (not matches)
+
+
+# a bounding box over the grid of test ways which spans several rollup tiles in both directions
+BBOX = (48.02, 9.02, 48.18, 9.23)
+
+
+@pytest.fixture
+def covered_rollups(road_database):
+    rollups = CoverageRollups(RoadDatabase(road_database))
+    coverage = np.random.default_rng(7).integers(0, 3, len(rollups.coverage))
+    rollups.update_coverage(np.arange(len(coverage)), coverage)
+    return rollups
+
+
+def get_expected_summary(rollups, segments):
+    lengths = rollups.segment_lengths[segments]
+    is_covered = rollups.coverage[segments] > 0
+    return lengths.sum(), lengths[is_covered].sum(), len(lengths), is_covered.sum()
+
+
+def assert_summary(summary, expected):
+    length, covered_length, num_segments, num_covered_segments = expected
+    assert summary["length_km"] == pytest.approx(length)
+    assert summary["covered_length_km"] == pytest.approx(covered_length)
+    assert summary["segments"] == num_segments
+    assert summary["covered_segments"] == num_covered_segments
+
+
+def test_bbox_coverage_adds_inner_and_border_tiles(covered_rollups):
+    min_lat, min_lon, max_lat, max_lon = BBOX
+    (min_x, max_x), (max_y, min_y) = get_tile_coordinates([min_lat, max_lat], [min_lon, max_lon], ROLLUP_ZOOM)
+    assert max_x - min_x >= 2 and max_y - min_y >= 2
+    lats, lons = covered_rollups.segment_lats, covered_rollups.segment_lons
+    segments = np.flatnonzero((lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon))
+    assert 0 < len(segments) < len(lats)
+    assert_summary(covered_rollups.get_bbox_coverage(*BBOX), get_expected_summary(covered_rollups, segments))
+
+
+@pytest.mark.parametrize("zoom", [ROLLUP_ZOOM - 3, ROLLUP_ZOOM, ROLLUP_ZOOM + 2])
+def test_tile_coverage_above_and_below_rollup_zoom(covered_rollups, zoom):
+    xs, ys = get_tile_coordinates(covered_rollups.segment_lats, covered_rollups.segment_lons, zoom)
+    tiles = sorted(set(zip(xs.tolist(), ys.tolist())))
+    for x, y in tiles:
+        segments = np.flatnonzero((xs == x) & (ys == y))
+        assert covered_rollups.get_tile_segments(zoom, x, y).tolist() == segments.tolist()
+        assert_summary(covered_rollups.get_tile_coverage(zoom, x, y),
+                       get_expected_summary(covered_rollups, segments))
+    assert_summary(covered_rollups.get_tile_coverage(zoom, max(xs) + 1, max(ys) + 1), (0, 0, 0, 0))
+
+
+@pytest.fixture(scope="module")
+def ref_rollups(tmp_path_factory, test_ways):
+    # way refs cycle through a road, two roads, a repeated road and none
+    refs = ["A 1", "A1;B 2", "b2;B 2;a 1", None]
+    way_refs = [refs[idx % len(refs)] for idx in range(len(test_ways))]
+    directory = str(tmp_path_factory.mktemp("ref_database"))
+    nodes = sorted({node for way_nodes in test_ways.values() for node in way_nodes})
+    write_road_database(
+        directory,
+        [node_id for node_id, _, _ in nodes],
+        [lat for _, lat, _ in nodes],
+        [lon for _, _, lon in nodes],
+        list(test_ways),
+        np.cumsum([0] + [len(way_nodes) for way_nodes in test_ways.values()]),
+        [node_id for way_nodes in test_ways.values() for node_id, _, _ in way_nodes],
+        np.zeros(len(test_ways), dtype=np.uint8),
+        ("motorway",),
+        get_way_segments(test_ways),
+        {name: way_refs if name == "ref" else [None] * len(test_ways) for name in STRING_COLUMNS},
+        "ellipsoidal")
+    return CoverageRollups(RoadDatabase(directory)), way_refs
+
+
+def test_ref_coverage_sums_every_way_once(ref_rollups):
+    rollups, way_refs = ref_rollups
+    covered_segments = np.arange(0, len(rollups.coverage), 3)
+    rollups.update_coverage(covered_segments, np.ones(len(covered_segments)))
+    roads = rollups.get_road_coverage()
+    assert [road["ref"] for road in roads] == ["A 1", "B 2"]
+    for road in roads:
+        ways = [way for way, value in enumerate(way_refs) if value is not None and
+                normalize_ref(road["ref"]) in {normalize_ref(ref) for ref in value.split(";")}]
+        assert road["ways"] == len(ways)
+        assert_summary(road, get_expected_summary(rollups, np.flatnonzero(np.isin(rollups.segment_ways, ways))))
+        assert rollups.get_ref_coverage(road["ref"].lower()) == road
+    with pytest.raises(KeyError):
+        rollups.get_ref_coverage("C 3")
+
+
+def test_coverage_updates_invalidate_ancestor_and_descendant_tiles(rollups):
+    service = CoverageService(rollups)
+    segment = 0
+    way = rollups.segment_ways[segment]
+    x, y = (int(values[0]) for values in get_tile_coordinates(
+        rollups.segment_lats[[segment]], rollups.segment_lons[[segment]], ROLLUP_ZOOM))
+    changed_tiles = [(ROLLUP_ZOOM - 4, x >> 4, y >> 4), (ROLLUP_ZOOM, x, y),
+                     (ROLLUP_ZOOM + 3, (x << 3) + 5, (y << 3) + 2)]
+    unchanged_tiles = [(ROLLUP_ZOOM - 4, (x >> 4) + 1, y >> 4), (ROLLUP_ZOOM, x + 1, y),
+                       (ROLLUP_ZOOM + 3, (x + 1) << 3, y << 3)]
+    for key in changed_tiles + unchanged_tiles:
+        service.tile_cache.put(key, ("etag", b""))
+    row = (int(rollups.way_ids[way]), segment - int(rollups.segment_offsets[way]),
+           int(rollups.coverage[segment]) + 1)
+    assert service.update_coverage([row]) == 1
+    assert [service.tile_cache.get(key) is None for key in changed_tiles + unchanged_tiles] == \
+        [True] * len(changed_tiles) + [False] * len(unchanged_tiles)
+    # unchanged counts invalidate nothing
+    assert service.update_coverage([row]) == 0
@@ -0,0 +1,30 @@
+from metrics import MetricsRegistry, StageMetrics
+
+
+def test_stage_rss_is_measured_per_run():
+    registry = MetricsRegistry()
+    with registry.measure("small"):
+        pass
+    with registry.measure("large"):
+        buffer = bytearray(64 * 1024 * 1024)
+        buffer[::4096] = b"x" * len(buffer[::4096])
+    del buffer
+    with registry.measure("small"):
+        pass
+    report = registry.get_report()
+    small, large = report["stages"]["small"], report["stages"]["large"]
+    assert large["rss_delta_mib"] > 32
+    assert abs(small["rss_delta_mib"]) < 16
+    assert small["rss_end_mib"] < report["peak_rss_mib"]
+    assert "road_coverage_stage_process_peak_rss_mib" in registry.to_prometheus()
+
+
+def test_merged_worker_rss():
+    stage = StageMetrics("import")
+    stage.add_run(1.0, 1.0, 100.0, 150.0)
+    worker = StageMetrics("import")
+    worker.add_run(1.0, 1.0, 80.0, 200.0)
+    stage.merge(worker.to_dict())
+    stage.merge(StageMetrics("import").to_dict())
+    summary = stage.get_summary()
+    assert (summary["rss_start_mib"], summary["rss_end_mib"], summary["rss_delta_mib"]) == (100.0, 200.0, 170.0)
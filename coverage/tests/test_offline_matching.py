@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from conftest import get_way_segments
+from offline_matching import OfflineMatcher
+from road_database import STRING_COLUMNS, RoadDatabase, write_road_database
+from way_segments import _get_travelled_way_segments
+
+TWO_WAY_ID = 20
+NUM_NODES = 6
+
+
+@pytest.fixture(scope="module")
+def two_way_matcher(tmp_path_factory):
+    ways = {TWO_WAY_ID: [(idx + 1, 48.0 + 0.001 * idx, 9.0) for idx in range(NUM_NODES)]}
+    directory = str(tmp_path_factory.mktemp("two_way_database"))
+    write_road_database(
+        directory,
+        [node_id for node_id, _, _ in ways[TWO_WAY_ID]],
+        [lat for _, lat, _ in ways[TWO_WAY_ID]],
+        [lon for _, _, lon in ways[TWO_WAY_ID]],
+        list(ways),
+        np.array([0, NUM_NODES]),
+        [node_id for node_id, _, _ in ways[TWO_WAY_ID]],
+        np.zeros(1, dtype=np.uint8),
+        ("residential",),
+        get_way_segments(ways),
+        {name: [None] for name in STRING_COLUMNS},
+        "ellipsoidal")
+    return OfflineMatcher(RoadDatabase(directory))
+
+
+def match_segments(matcher, lats):
+    match_result = matcher.match([{"lat": lat, "lon": 9.0} for lat in lats])
+    way_ratios = {TWO_WAY_ID: matcher.database.get_way_segments(TWO_WAY_ID)[1].tolist()}
+    return match_result, _get_travelled_way_segments(match_result, way_ratios)
+
+
+def test_forward_travel(two_way_matcher):
+    lats = [48.0002 + 0.0004 * idx for idx in range(12)]
+    match_result, travelled = match_segments(two_way_matcher, lats)
+    assert [edge["reverse"] for edge in match_result["edges"]] == [False]
+    assert travelled == [[(TWO_WAY_ID, idx) for idx in range(NUM_NODES - 1)]]
+
+
+def test_reverse_travel_on_two_way(two_way_matcher):
+    lats = [48.0048 - 0.0004 * idx for idx in range(12)]
+    match_result, travelled = match_segments(two_way_matcher, lats)
+    assert [edge["reverse"] for edge in match_result["edges"]] == [True]
+    ratios = [match["edge_ratio"] for match in match_result["matches"]]
+    assert ratios == sorted(ratios)
+    assert travelled == [[(TWO_WAY_ID, idx) for idx in reversed(range(NUM_NODES - 1))]]
+
+
+def test_turning_around_on_two_way(two_way_matcher):
+    lats = [48.0012, 48.0022, 48.0032, 48.0026, 48.0016, 48.0006]
+    match_result, travelled = match_segments(two_way_matcher, lats)
+    assert [edge["reverse"] for edge in match_result["edges"]] == [False, True]
+    assert travelled == [[(TWO_WAY_ID, 1), (TWO_WAY_ID, 2), (TWO_WAY_ID, 3),
+                          (TWO_WAY_ID, 2), (TWO_WAY_ID, 1), (TWO_WAY_ID, 0)]]
@@ -0,0 +1,26 @@
+import pytest
+
+from import_osm_highways_mysql import get_query_plan_checks
+from mysql_connection import connect_to_database
+from mysql_schema import _is_index_only, get_query_plan_problems
+
+
+@pytest.mark.parametrize("row, index_only", [
+    ({"type": "range", "key": "PRIMARY", "Extra": "Using where"}, True),
+    ({"type": "eq_ref", "key": "PRIMARY", "Extra": None}, True),
+    ({"type": "ref", "key": "way_node_ids_index", "Extra": "Using index"}, True),
+    ({"type": "ref", "key": "way_node_ids_index", "Extra": None}, False),
+    ({"type": "index", "key": "PRIMARY", "Extra": "Using index"}, False),
+    ({"type": "ALL", "key": None, "Extra": "Using where"}, False),
+])
+def test_index_only_plans(row, index_only):
+    assert _is_index_only(row) == index_only
+
+
+@pytest.mark.parametrize("name", sorted(get_query_plan_checks()))
+def test_query_plan_is_index_only(mysql_database, test_ways, name):
+    query, params = get_query_plan_checks()[name]
+    way_ids = list(test_ways)
+    params = tuple(way_ids[10:10 + len(params)])
+    with connect_to_database(mysql_database["mysql"]) as dbcon:
+        assert get_query_plan_problems(dbcon, {name: (query, params)}) == []
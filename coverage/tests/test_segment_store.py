@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import REPEATED_LOCATION_WAY_ID, SINGLE_NODE_WAY_ID, get_expected_ratios
+from db.mysql_connection import get_connection_pool
+from segment_store import CachedSegmentStore, LocalSegmentStore, MySqlSegmentStore
+
+
+# MySQL stores the ratios as FLOAT
+TOLERANCE = 1e-6
+
+
+@pytest.fixture(params=["local", "pickle", "mysql", "cached_local", "cached_mysql"])
+def segment_store(request):
+    backend = request.param.replace("cached_", "")
+    if backend == "local":
+        segment_store = LocalSegmentStore(request.getfixturevalue("road_database"))
+    elif backend == "pickle":
+        segment_store = LocalSegmentStore(request.getfixturevalue("pickled_road_database"))
+    else:
+        config = request.getfixturevalue("mysql_database")
+        # a small chunk size splits and pads the lookups
+        segment_store = MySqlSegmentStore(get_connection_pool(config["mysql"]), chunk_size=7)
+    if request.param.startswith("cached_"):
+        segment_store = CachedSegmentStore(segment_store, max_size=100)
+    return segment_store
+
+
+@pytest.fixture(scope="module")
+def expected_ratios(test_ways):
+    return get_expected_ratios(test_ways)
+
+
+def assert_ratios(way_ratios, expected_ratios):
+    assert set(way_ratios) == set(expected_ratios)
+    for way_id, ratios in way_ratios.items():
+        assert isinstance(ratios, tuple)
+        assert list(ratios) == pytest.approx(expected_ratios[way_id], abs=TOLERANCE)
+
+
+def test_all_ways(segment_store, test_ways, expected_ratios):
+    assert_ratios(segment_store.get_way_ratios(list(test_ways)), expected_ratios)
+
+
+def test_repeated_lookups(segment_store, test_ways, expected_ratios):
+    way_ids = list(test_ways)[:50]
+    for _ in range(3):
+        assert_ratios(segment_store.get_way_ratios(way_ids),
+                      {way_id: expected_ratios[way_id] for way_id in way_ids if way_id in expected_ratios})
+
+
+def test_missing_ways(segment_store, expected_ratios):
+    way_ids = [1000, 999999, -5, 1010]
+    assert_ratios(segment_store.get_way_ratios(way_ids),
+                  {way_id: expected_ratios[way_id] for way_id in (1000, 1010)})
+
+
+def test_way_without_segments(segment_store):
+    assert segment_store.get_way_ratios([SINGLE_NODE_WAY_ID]) == dict()
+
+
+def test_empty_input(segment_store):
+    assert segment_store.get_way_ratios([]) == dict()
+    assert segment_store.get_way_ratios(iter([])) == dict()
+
+
+def test_duplicate_ids(segment_store, expected_ratios):
+    way_ids = [1020, 1000, 1020, 1020, 1000]
+    assert_ratios(segment_store.get_way_ratios(way_ids),
+                  {way_id: expected_ratios[way_id] for way_id in (1000, 1020)})
+
+
+def test_equal_ratios(segment_store):
+    ratios = segment_store.get_way_ratios([REPEATED_LOCATION_WAY_ID])[REPEATED_LOCATION_WAY_ID]
+    assert list(ratios) == pytest.approx([0.0, 0.0], abs=TOLERANCE)
+
+
+def test_generator_input(segment_store, test_ways, expected_ratios):
+    way_ids = list(test_ways)[100:130]
+    assert_ratios(segment_store.get_way_ratios(way_id for way_id in way_ids),
+                  {way_id: expected_ratios[way_id] for way_id in way_ids})
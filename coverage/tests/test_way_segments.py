@@ -0,0 +1,48 @@
+import pickle
+
+import batch_way_segments
+from way_segments import map_match_result_to_osm_way_segments
+
+UNMATCHED = 4294967295
+
+
+class FakeSegmentStore:
+    def __init__(self, way_ratios):
+        self.way_ratios = way_ratios
+
+    def get_way_ratios(self, way_ids):
+        return {way_id: self.way_ratios[way_id] for way_id in way_ids if way_id in self.way_ratios}
+
+
+def create_match_result(matches):
+    return {
+        "meta": [],
+        "edges": [{"way_id": 1}, {"way_id": 2}],
+        "matches": [{"edge_index": edge_index, "edge_ratio": edge_ratio} for edge_index, edge_ratio in matches],
+    }
+
+
+SEGMENT_STORE = FakeSegmentStore({1: [0.0, 0.5], 2: [0.0, 0.25, 0.5, 0.75]})
+
+
+def test_unmatched_points_are_skipped():
+    match_result = create_match_result([(0, 0.2), (UNMATCHED, 0.0), (1, 0.6), (UNMATCHED, 0.0)])
+    assert map_match_result_to_osm_way_segments(SEGMENT_STORE, match_result) == [
+        [(1, 0), (1, 1), (2, 0), (2, 1), (2, 2)]]
+
+
+def test_broken_files_are_recorded_as_failed(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_way_segments, "_segment_store", SEGMENT_STORE)
+    match_files = []
+    for name, content in (("valid", create_match_result([(0, 0.2), (1, 0.3)])),
+                          ("edge_index", create_match_result([(0, 0.2), (5, 0.3)])),
+                          ("type", {"edges": None, "matches": [{"edge_index": 0, "edge_ratio": 0.1}]})):
+        match_file = str(tmp_path / "{}.pickle".format(name))
+        with open(match_file, "wb") as file_stream:
+            pickle.dump(content, file_stream)
+        match_files.append(match_file)
+    match_files.append(str(tmp_path / "missing.pickle"))
+    results = [batch_way_segments._process_file(match_file) for match_file in match_files]
+    assert results[0][1] == [[(1, 0), (1, 1), (2, 0), (2, 1)]]
+    assert [error is not None for _, _, _, error in results] == [False, False, True, True]
+    assert "TypeError" in results[2][3]
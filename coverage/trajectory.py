@@ -0,0 +1,146 @@
+import numpy as np
+
+
+EARTH_RADIUS = 6371008.8
+
+
+def thin_trajectory(trajectory, min_distance=None, tolerance=None):
+    trajectory = list(trajectory)
+    if min_distance:
+        trajectory = _thin_by_min_distance(trajectory, min_distance)
+    if tolerance:
+        trajectory = _simplify_douglas_peucker(trajectory, tolerance)
+    return trajectory
+
+
+def _to_local_xy(trajectory):
+    lats = np.radians([point["lat"] for point in trajectory])
+    lons = np.radians([point["lon"] for point in trajectory])
+    x = EARTH_RADIUS * (lons - lons[0]) * np.cos(np.mean(lats))
+    y = EARTH_RADIUS * (lats - lats[0])
+    return np.column_stack((x, y))
+
+
+def _thin_by_min_distance(trajectory, min_distance):
+    if len(trajectory) < 3:
+        return trajectory
+    xy = _to_local_xy(trajectory)
+    keep = [0]
+    for idx in range(1, len(trajectory) - 1):
+        if np.hypot(*(xy[idx] - xy[keep[-1]])) >= min_distance:
+            keep.append(idx)
+    keep.append(len(trajectory) - 1)
+    return [trajectory[idx] for idx in keep]
+
+
+def _simplify_douglas_peucker(trajectory, tolerance):
+    if len(trajectory) < 3:
+        return trajectory
+    xy = _to_local_xy(trajectory)
+    keep = np.zeros(len(trajectory), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(trajectory) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _point_segment_distances(
+            xy[first+1:last], xy[first], xy[last])
+        idx = int(np.argmax(distances))
+        if distances[idx] > tolerance:
+            split = first + 1 + idx
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return [point for point, kept in zip(trajectory, keep) if kept]
+
+
+def _point_segment_distances(points, begin, end):
+    direction = end - begin
+    length_squared = np.dot(direction, direction)
+    if length_squared == 0:
+        return np.hypot(*(points - begin).T)
+    t = np.clip(np.dot(points - begin, direction) / length_squared, 0, 1)
+    return np.hypot(*(points - (begin + np.outer(t, direction))).T)
+
+
+def split_trajectory(trajectory, window_size, overlap):
+    if not window_size or len(trajectory) <= window_size:
+        return [(0, trajectory)]
+    if overlap >= window_size:
+        raise ValueError("Overlap ({}) must be smaller than the window size ({})".format(
+            overlap, window_size))
+    windows = []
+    start = 0
+    while True:
+        windows.append((start, trajectory[start:start+window_size]))
+        if start + window_size >= len(trajectory):
+            return windows
+        start += window_size - overlap
+
+
+def stitch_matches(windows, window_matches):
+    if len(window_matches) == 1:
+        return window_matches[0]
+    stitched = {"meta": [], "edges": [], "matches": []}
+    for idx, ((start, points), window_match) in enumerate(zip(windows, window_matches)):
+        begin = _get_cut_index(windows, idx) - start
+        end = _get_cut_index(windows, idx + 1) - start
+        _append_window(stitched, window_match, begin, end)
+    return stitched
+
+
+def _get_cut_index(windows, idx):
+    if idx == 0:
+        return 0
+    if idx == len(windows):
+        start, points = windows[-1]
+        return start + len(points)
+    previous_start, previous_points = windows[idx - 1]
+    start = windows[idx][0]
+    overlap = previous_start + len(previous_points) - start
+    return start + overlap // 2
+
+
+def _append_window(stitched, window_match, begin, end):
+    edges = window_match["edges"]
+    matches = window_match["matches"]
+    edge_indices = [match["edge_index"] for match in matches[max(begin - 1, 0):end]
+                    if match["edge_index"] < len(edges)]
+    if not edge_indices:
+        stitched["matches"].extend(matches[begin:end])
+        return
+
+    first_edge, last_edge = min(edge_indices), max(edge_indices)
+    meta_indices = [_get_meta_index(stitched["meta"], meta)
+                    for meta in window_match["meta"]]
+    offset = len(stitched["edges"]) - first_edge
+    if stitched["edges"] and _is_same_edge(stitched["edges"][-1], edges[first_edge]):
+        offset -= 1
+    else:
+        stitched["edges"].append(
+            _remap_edge(edges[first_edge], meta_indices))
+    stitched["edges"].extend(_remap_edge(edge, meta_indices)
+                             for edge in edges[first_edge+1:last_edge+1])
+    for match in matches[begin:end]:
+        match = dict(match)
+        if match["edge_index"] < len(edges):
+            match["edge_index"] += offset
+        stitched["matches"].append(match)
+
+
+def _is_same_edge(edge, other):
+    return all(edge[key] == other[key] for key in ("way_id", "length", "begin_heading", "end_heading"))
+
+
+def _get_meta_index(meta_list, meta):
+    if meta not in meta_list:
+        meta_list.append(meta)
+    return meta_list.index(meta)
+
+
+def _remap_edge(edge, meta_indices):
+    edge = dict(edge)
+    if edge["meta_index"] < len(meta_indices):
+        edge["meta_index"] = meta_indices[edge["meta_index"]]
+    return edge
@@ -1,23 +1,22 @@
 #! /usr/bin/env python
 
 import argparse
-import copy
 import logging
 import pickle
 
-from collections import defaultdict
-from itertools import groupby
+from bisect import bisect_right
 
-from db.mysql_connection import connect_to_database, load_configuration
+from segment_store import add_segment_store_arguments, open_segment_store
 
 
-def map_match_result_to_osm_way_segments(dbcon, match_result):
+def map_match_result_to_osm_way_segments(segment_store, match_result):
     if _is_valid_match_result(match_result):
-        osm_way_segments = _get_osm_way_segments(
-            dbcon, (e["way_id"] for e in match_result["edges"]))
+        way_ratios = segment_store.get_way_ratios(
+            e["way_id"] for e in match_result["edges"])
         travelled_segments = _get_travelled_way_segments(
-            match_result, osm_way_segments)
-        print("Travelled Segments: {}".format(travelled_segments))
+            match_result, way_ratios)
+        logging.debug("Travelled Segments: {}".format(travelled_segments))
+        return travelled_segments
     else:
         logging.error("Provided match_result is invalid")
 
@@ -26,90 +25,109 @@ def _is_valid_match_result(match_result):
     def is_less(prev, next): return (prev[0] < next[0]) or (
         prev[0] == next[0] and (prev[1] < next[1]))
     index_ratio_list = [(e["edge_index"], e["edge_ratio"])
-                        for e in match_result["matches"]]
+                        for e in match_result["matches"]
+                        if _is_matched(e, match_result["edges"])]
     return all([is_less(index_ratio_list[i], index_ratio_list[i+1]) for i in range(len(index_ratio_list)-1)])
 
 
-def _get_osm_way_segments(dbcon, way_ids):
-    with dbcon.cursor() as cursor:
-        cursor.execute("SELECT way_id, length, way_length_ratio FROM way_segments WHERE way_id IN ({}) ORDER BY way_id, segment_id".format(
-            ",".join([str(w) for w in way_ids])
-        ))
-        way_segments = defaultdict()
-        for row in cursor.fetchall():
-            way_id, length, ratio = row
-            way_segments.setdefault(way_id, []).append({
-                "length": row[1],
-                "ratio": row[2]
-            })
-    return way_segments
-
-
-def _get_travelled_way_segments(match_result, way_segments):
+def _get_travelled_way_segments(match_result, way_ratios):
     edges = match_result["edges"]
     travelled_way_segments = []
     new_trace = []
     for match in match_result["matches"]:
-        way_id = edges[match["edge_index"]]["way_id"]
-        if way_id in way_segments:
+        if not _is_matched(match, edges):
+            continue
+        edge = edges[match["edge_index"]]
+        way_id = edge["way_id"]
+        if way_id in way_ratios:
+            # ratios of edges against the way direction start at the end of the way
+            reverse = edge.get("reverse", False)
             segment_id = _get_segment_id_by_ratio(
-                match["edge_ratio"], way_segments[way_id])
-            new_trace.append((way_id, segment_id))
+                1 - match["edge_ratio"] if reverse else match["edge_ratio"], way_ratios[way_id])
+            new_trace.append((way_id, segment_id, reverse))
         else:
             if new_trace:
                 travelled_way_segments.append(new_trace)
                 new_trace = []
     if new_trace:
         travelled_way_segments.append(new_trace)
-    print("Travelled: {}".format(travelled_way_segments))
-    return _fill_in_missing_segments(travelled_way_segments, edges, way_segments)
+    logging.debug("Travelled: {}".format(travelled_way_segments))
+    return _fill_in_missing_segments(travelled_way_segments, edges, way_ratios)
+
 
+def _is_matched(match, edges):
+    # Valhalla marks unmatched points with an edge index of 2^32 - 1
+    return 0 <= match["edge_index"] < len(edges)
 
-def _get_segment_id_by_ratio(edge_ratio, way_segments):
-    for idx, way_segment in enumerate(way_segments):
-        if way_segment["ratio"] > edge_ratio:
-            return idx - 1
-    return len(way_segments) - 1
 
+def _get_segment_id_by_ratio(edge_ratio, ratios):
+    return bisect_right(ratios, edge_ratio) - 1
 
-def _fill_in_missing_segments(travelled_way_segments, edges, way_segments):
+
+def _fill_in_missing_segments(travelled_way_segments, edges, way_ratios):
+    next_ways = _get_next_ways(edges)
     completed_travelled_way_segments = []
     for travelled_segments in travelled_way_segments:
-        cur_segment = None
-        completed_segments = []
-        for segment in travelled_segments:
-            if not cur_segment:
-                completed_segments.append(segment)
-            else:
-                iter_segment = [cur_segment[0], cur_segment[1]]
-                while not (iter_segment[0] == segment[0] and iter_segment[1] == segment[1]):
-                    iter_segment[1] += 1
-                    if iter_segment[1] > len(way_segments[iter_segment[0]])-1:
-                        iter_segment[0] = _get_next_way(
-                            iter_segment[0], edges)
-                        iter_segment[1] = 0
-                    completed_segments.append(copy.copy(iter_segment))
-            cur_segment = segment
+        completed_segments = [(way_id, segment_id)
+                              for way_id, segment_id, _ in travelled_segments[:1]]
+        for cur_segment, segment in zip(travelled_segments, travelled_segments[1:]):
+            completed_segments.extend(_get_segments_between(
+                cur_segment, segment, next_ways, way_ratios))
         completed_travelled_way_segments.append(completed_segments)
     return completed_travelled_way_segments
 
 
-def _get_next_way(cur_edge_id, edges):
-    for i in range(len(edges)):
-        if edges[i]["way_id"] == cur_edge_id:
-            return edges[i+1]["way_id"]
-    return None
+def _get_segments_between(begin, end, next_ways, way_ratios):
+    way_id, segment_id, reverse = begin
+    end_way_id, end_segment_id, end_reverse = end
+    if way_id == end_way_id and not end_reverse and segment_id <= end_segment_id:
+        return [(way_id, idx) for idx in range(segment_id + 1, end_segment_id + 1)]
+    if way_id == end_way_id and end_reverse and segment_id >= end_segment_id:
+        return [(way_id, idx) for idx in range(segment_id - 1, end_segment_id - 1, -1)]
+
+    segments = [(way_id, idx) for idx in _get_segment_range(
+        len(way_ratios[way_id]), reverse, segment_id)[1:]]
+    visited_ways = {(way_id, reverse)}
+    way_id, reverse = next_ways.get((way_id, reverse), (None, False))
+    while (way_id, reverse) != (end_way_id, end_reverse):
+        if way_id not in way_ratios or (way_id, reverse) in visited_ways:
+            logging.warning("Cannot fill in segments between ways {} and {}".format(
+                begin[0], end_way_id))
+            segments.append((end_way_id, end_segment_id))
+            return segments
+        visited_ways.add((way_id, reverse))
+        segments.extend((way_id, idx) for idx in _get_segment_range(
+            len(way_ratios[way_id]), reverse))
+        way_id, reverse = next_ways.get((way_id, reverse), (None, False))
+    segments.extend((end_way_id, idx) for idx in _get_segment_range(
+        len(way_ratios[end_way_id]), not end_reverse, end_segment_id)[::-1])
+    return segments
+
+
+def _get_segment_range(num_segments, reverse, begin=None):
+    # the segments from begin to the end of the way in travel direction
+    if reverse:
+        return range(num_segments - 1 if begin is None else begin, -1, -1)
+    return range(0 if begin is None else begin, num_segments)
+
+
+def _get_next_ways(edges):
+    next_ways = dict()
+    for edge, next_edge in zip(edges, edges[1:]):
+        next_ways.setdefault((edge["way_id"], edge.get("reverse", False)),
+                             (next_edge["way_id"], next_edge.get("reverse", False)))
+    return next_ways
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("OSM Way Segments")
-    parser.add_argument("config", metavar="MYSQL_CONFIG")
-    parser.add_argument("map_match_file", metavar="MATCH_FILE")
+    add_segment_store_arguments(parser)
+    parser.add_argument("map_match_files", metavar="MATCH_FILE", nargs="+")
     args = parser.parse_args()
 
-    with open(args.map_match_file, "rb") as file_stream:
-        match_result = pickle.load(file_stream)
-
-    config = load_configuration(args.config)
-    with connect_to_database(config["mysql"]) as dbcon:
-        print(map_match_result_to_osm_way_segments(dbcon, match_result))
+    with open_segment_store(args.backend, args.source, args.segment_cache_size) as segment_store:
+        for map_match_file in args.map_match_files:
+            with open(map_match_file, "rb") as file_stream:
+                match_result = pickle.load(file_stream)
+            print(map_match_result_to_osm_way_segments(
+                segment_store, match_result))